@@ -2,10 +2,10 @@ import logging
 import os
 from typing import List, Optional
 
-import boto3
 from botocore.exceptions import ClientError
 from fastapi import APIRouter, Header, Request, Response, status
 from fastapi.responses import JSONResponse
+from rctools.aws.clients import get_client
 from rctools.aws.cognito import (add_pool_attributes, add_user_to_group,
                                  create_user_in_user_pool, disable_user,
                                  get_user_from_user_pool, get_user_groups,
@@ -15,18 +15,18 @@ from rctools.aws.cognito import (add_pool_attributes, add_user_to_group,
 from rctools.installers import get_user_company, is_company_admin
 from rctools.models import Admin
 from rctools.users import get_admin_user_data_from_s3, is_rc_admin
-from utils import filter_results, parse_params
+from utils import DecimalRoute, filter_results, parse_params
 
 ADMIN_USER_POOL_ID = os.environ.get('ADMIN_USER_POOL_ID')
 RC_ADMIN_GROUP_ID = os.environ.get('RC_ADMIN_GROUP_ID')
 USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
 
 @router.get('/admins', response_model=List[dict], status_code=status.HTTP_200_OK)
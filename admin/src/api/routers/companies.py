@@ -3,15 +3,15 @@ import os
 from operator import itemgetter
 from typing import Optional
 
-import boto3
 from fastapi import APIRouter, Header, HTTPException, Request, Response, status
+from rctools.aws.clients import get_client
 from rctools.aws.cognito import get_user_with_access_token
 from rctools.aws.s3 import list_folders_in_s3
 from rctools.company import (create_company_admin, create_company_id,
-                             get_company_data, put_company_data,
+                             get_companies_data, get_company_data, put_company_data,
                              put_company_installer_code)
 from rctools.models import Company, CompanyAdmin, CompanyInstaller
-from utils import build_content_range_header, filter_results, parse_params
+from utils import DecimalRoute, build_content_range_header, filter_results, parse_params
 
 ADMIN_USER_POOL_ID = os.getenv('ADMIN_USER_POOL_ID')
 COMPANY_DATA_BUCKET = os.getenv('COMPANY_DATA_BUCKET')
@@ -21,11 +21,11 @@ RC_ADMIN_GROUP_ID = os.getenv('RC_ADMIN_GROUP_ID')
 USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
 
 @router.post('/companies/{company_id}/installer/code', status_code=status.HTTP_201_CREATED)
@@ -49,12 +49,7 @@ def get_companies(request: Request, response: Response):
 
     logger.info(f'Getting all companies with request url {req_url}')
     companies = list_folders_in_s3(s3_client, COMPANY_DATA_BUCKET)
-    data = []
-    for company_id in companies:
-        logger.info(f'Getting data for id {company_id[:-1]}')
-        company_data = get_company_data(s3_client, COMPANY_DATA_BUCKET, company_id[:-1])  # remove trailing slash from prefix
-        if company_data:
-            data.append(company_data)
+    data = get_companies_data(s3_client, COMPANY_DATA_BUCKET, [c[:-1] for c in companies])  # remove trailing slash from prefix
     logger.info(f'{len(data)} found')
 
     if field:
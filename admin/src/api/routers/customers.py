@@ -5,13 +5,13 @@ from operator import itemgetter
 from typing import List
 from urllib.parse import parse_qs
 
-import boto3
 from fastapi import APIRouter, Request, Response
+from rctools.aws.clients import get_client
 from rctools.customers import get_all_customers
 from rctools.models.users import Customer
-from utils import build_content_range_header, filter_results, parse_params
+from utils import DecimalRoute, build_content_range_header, filter_results, parse_params
 
-router = APIRouter()
+router = APIRouter(route_class=DecimalRoute)
 
 COMPANY_DATA_BUCKET = os.getenv('COMPANY_DATA_BUCKET')
 CUSTOMER_USER_POOL_ID = os.environ.get('CUSTOMER_USER_POOL_ID')
@@ -20,11 +20,11 @@ INSTALLER_USER_POOL_ID = os.environ.get('INSTALLER_USER_POOL_ID')
 OWNER_ADMIN_GROUP_ID = os.environ.get('OWNER_ADMIN_GROUP_ID')
 USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
 
 @router.get('/customers', response_model=List[Customer])
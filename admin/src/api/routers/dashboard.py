@@ -3,21 +3,22 @@ import os
 
 from enum import Enum
 
-import boto3
 from fastapi import APIRouter
 from models import DashboardCard
+from rctools.aws.clients import get_client, get_resource
 from rctools.customers import get_all_customers
 from rctools.installers import get_all_installers
 from rctools.jobs import get_job_tickets
+from utils import DecimalRoute
 
 
-cognito_client = boto3.client('cognito-idp')
-dynamodb = boto3.resource('dynamodb')
+cognito_client = get_client('cognito-idp')
+dynamodb = get_resource('dynamodb')
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
 CUSTOMER_USER_POOL_ID = os.getenv('CUSTOMER_USER_POOL_ID')
 INSTALLER_USER_POOL_ID = os.getenv('INSTALLER_USER_POOL_ID')
@@ -66,7 +67,7 @@ def get_dashboard_data(data: DashboardDataTypes):
     elif data == DashboardDataTypes.jobs:
         # get all jobs, get the day's total, get open, canceled and potential
         jobs_card = DashboardCard(title='Jobs')
-        jobs = get_job_tickets(jobs_table)
+        jobs = get_job_tickets(jobs_table, attributes=['ticket_id'])
         days_total = 0  # TODO waiting on scheduling work
         open = 0  # TODO waiting on scheduling work
         cancelled = 0  # TODO waiting on scheduling work
@@ -4,29 +4,28 @@ import os
 from operator import itemgetter
 from typing import List, Optional
 
-import boto3
-import botocore
 from botocore.exceptions import ClientError
-from fastapi import APIRouter, Header, Request, Response, status
+from fastapi import APIRouter, Depends, Header, Request, Response, status
 from fastapi.responses import JSONResponse
 from rctools.alerts import (add_user_alert,
                             create_certification_in_progress_alert)
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import (disable_user, get_user_from_user_pool,
-                                 get_user_with_access_token,
-                                 list_users_from_user_pool, merge_user_data)
+                                 get_user_with_access_token, merge_user_data)
+from rctools.aws.unit_of_work import UnitOfWork, request_unit_of_work
 from rctools.company import (get_company_installer_by_code,
                              put_company_installer_code)
-from rctools.exceptions import UserNotAuthorizedToEditInstaller
-from rctools.installers import (get_installer_data_from_s3, get_user_company,
-                                is_company_admin, put_installer_data_into_s3,
+from rctools.exceptions import RecordAlreadyExists, UserNotAuthorizedToEditInstaller
+from rctools.installers import (get_all_installers, get_installer_data_from_s3, get_user_company,
+                                is_company_admin, put_installer_data_into_s3, remove_installer_from_directory,
                                 update_installer_data_in_cognito,
                                 update_installer_data_in_s3, update_installer_service_area)
-from rctools.jobs import get_job_tickets
+from rctools.jobs import JOB_TICKET_SUMMARY_ATTRIBUTES, get_job_tickets
 from rctools.models import Installer, NewInstallerResponse
 from rctools.users import is_rc_admin
 from rctools.utils import mk_timestamp
 from rctools.installers import get_installer as get_full_installer
-from utils import build_content_range_header, filter_results, parse_params
+from utils import DecimalRoute, build_content_range_header, filter_results, parse_params
 
 ADMIN_USER_POOL_ID = os.environ.get('ADMIN_USER_POOL_ID')
 COMPANY_DATA_BUCKET = os.getenv('COMPANY_DATA_BUCKET')
@@ -42,16 +41,15 @@ INSTALLER_SERVICE_AREA_TABLE_NAME = os.environ.get('INSTALLER_SERVICE_AREA_TABLE
 ZIP_CODE_DISTANCE_BUCKET = os.environ.get('ZIP_CODE_DISTANCE_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
 
-dynamodb = boto3.resource('dynamodb')
-lambda_config = botocore.config.Config(retries={'max_attempts': 0})
-lambda_client = boto3.client('lambda', config=lambda_config)
+dynamodb = get_resource('dynamodb')
+lambda_client = get_client('lambda')
 alerts_table = dynamodb.Table(ALERTS_TABLE)
 jobs_table = dynamodb.Table(JOBS_TABLE)
 installer_codes_table = dynamodb.Table(INSTALLER_CODES_TABLE)
@@ -73,21 +71,20 @@ def get_installers(request: Request, response: Response, X_Amz_Access_Token: Opt
         if is_company_admin(cognito_client, ADMIN_USER_POOL_ID, uid):
             company_id = get_user_company(s3_client, USER_DATA_BUCKET, uid)
             logger.info(f'Fetching company installers for {company_id}')
-    installer_users = list_users_from_user_pool(cognito_client, INSTALLER_USER_POOL_ID)
+    installers = get_all_installers(cognito_client, s3_client, INSTALLER_USER_POOL_ID, USER_DATA_BUCKET)
 
     data = []
-    job_data = get_job_tickets(jobs_table)
+    job_data = get_job_tickets(jobs_table, attributes=JOB_TICKET_SUMMARY_ATTRIBUTES)
 
-    for user in installer_users:
-        uid = user['Username']
-        user_data = get_installer_data_from_s3(s3_client, USER_DATA_BUCKET, uid)
-        user_data['jobs'] = [ticket for ticket in job_data if ticket.get('installer_id') == uid]
+    for installer in installers:
+        uid = installer['Username']
+        installer['jobs'] = [ticket for ticket in job_data if ticket.get('installer_id') == uid]
 
         if company_id:
-            if user_data.get('company_id') == company_id:
-                data.append(merge_user_data(user, user_data))
+            if installer.get('company_id') == company_id:
+                data.append(installer)
         else:
-            data.append(merge_user_data(user, user_data))
+            data.append(installer)
 
     # get query params
     req_url = request.url
@@ -185,7 +182,11 @@ def create_new_installer(installer: dict, request: Request, response: Response):
     adds the non-cognito data to s3 and returns a new installer with s3 data and cognito data
     """
     logger.info(f'POST request received with {installer}')
-    code = put_company_installer_code(installer_codes_table, installer)
+    try:
+        code = put_company_installer_code(installer_codes_table, installer)
+    except RecordAlreadyExists as e:
+        logger.exception('Error creating installer code')
+        return JSONResponse({'error': str(e)}, 503)
     logger.info(f'Generate code {code} for company installer')
     response = NewInstallerResponse(**{'user_id': code, 'id': code})
     return response
@@ -198,7 +199,9 @@ def create_new_installer(installer: dict, request: Request, response: Response):
 @router.delete('/installers/{id}')
 def delete_installer(id: str):
     """End point that disables installer from installer user pool"""
-    return disable_user(cognito_client, id, INSTALLER_USER_POOL_ID)
+    resp = disable_user(cognito_client, id, INSTALLER_USER_POOL_ID)
+    remove_installer_from_directory(s3_client, USER_DATA_BUCKET, id)
+    return resp
 
 
 @router.post('/download/object', status_code=status.HTTP_201_CREATED)
@@ -223,7 +226,8 @@ def create_presigned_url(data: dict, request: Request, response: Response, expir
 
 
 @router.put('/installer/{installer_id}/certification', response_model=Installer, status_code=status.HTTP_200_OK)
-def update_installer_certification(installer_id: str, update: dict, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> Installer:
+def update_installer_certification(installer_id: str, update: dict, X_Amz_Access_Token: Optional[str] = Header(default=None),
+                                   uow: Optional[UnitOfWork] = Depends(request_unit_of_work)) -> Installer:
     """Updates installer with certification data and triggers the lambda to check it by state"""
     logger.info(f'Updating with certification info {update}')
     user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
@@ -244,7 +248,8 @@ def update_installer_certification(installer_id: str, update: dict, X_Amz_Access
         license_number = installer['license']['licenseNumber']
         # Add certification in-progress alert
         alert = create_certification_in_progress_alert(installer_id)
-        add_user_alert(alerts_table, installer_id, alert)
+        # Written with the rest of the request once it succeeds
+        add_user_alert(alerts_table, installer_id, alert, transaction=uow)
         # Invoke lambda
         logger.info(f'Invoking certification lambda {CERTIFICATION_LAMBDA_NAME} with {state, license_number, installer_id}')
         # logger.info (f'with {state, license_number, installer_id}')
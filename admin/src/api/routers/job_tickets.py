@@ -1,17 +1,18 @@
 import logging
 import os
 from typing import Optional
-import boto3
 from fastapi import APIRouter, Header, Request, Response, status
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import get_user_with_access_token
 from rctools.customers import get_customer
 from rctools.exceptions import UserNotAuthorizedToListTickets
 from rctools.installers import (get_installer, get_installers_for_company,
                                 get_user_company, is_company_admin)
+from rctools.job_collection import get_job_aggregate
 from rctools.jobs import get_job_ticket, get_job_tickets
 from rctools.scheduling import get_scheduled_job
 from rctools.users import is_rc_admin
-from utils import build_content_range_header, filter_results, parse_params
+from utils import DecimalRoute, build_content_range_header, filter_results, parse_params
 
 ADMIN_USER_POOL_ID = os.environ.get('ADMIN_USER_POOL_ID')
 CUSTOMER_USER_POOL_ID = os.getenv('CUSTOMER_USER_POOL_ID')
@@ -21,13 +22,13 @@ JOBS_TABLE = os.environ.get('JOBS_TABLE')
 USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 RC_ADMIN_GROUP_ID = os.getenv('RC_ADMIN_GROUP_ID')
 
-router = APIRouter()
+router = APIRouter(route_class=DecimalRoute)
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-s3_client = boto3.client('s3')
-cognito_client = boto3.client('cognito-idp')
+s3_client = get_client('s3')
+cognito_client = get_client('cognito-idp')
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = get_resource('dynamodb')
 jobs_table = dynamodb.Table(JOBS_TABLE)
 job_schedule_table = dynamodb.Table(JOB_SCHEDULE_TABLE)
 
@@ -75,13 +76,15 @@ def get_all_job_tickets(request: Request, response: Response, X_Amz_Access_Token
 def get_job_ticket_by_id(id: str):
     """Fetches a job ticket by the id"""
     logger.info(f'Getting job {id}')
-    ticket = get_job_ticket(jobs_table, id)
+    # The ticket and its schedule come from one query when the job collection is in use
+    aggregate = get_job_aggregate(id)
+    ticket = aggregate.ticket if aggregate else get_job_ticket(jobs_table, id)
     ticket['id'] = ticket['ticket_id']
     ticket['customer_data'] = get_customer(cognito_client, s3_client, CUSTOMER_USER_POOL_ID, USER_DATA_BUCKET, ticket['customer_id'])
     if ticket.get('installer_id') is not None:
         ticket['installer_data'] = get_installer(cognito_client, s3_client, INSTALLER_USER_POOL_ID, USER_DATA_BUCKET, ticket['installer_id'])
 
-    ticket['schedule_data'] = get_scheduled_job(job_schedule_table, ticket['id'])
+    ticket['schedule_data'] = aggregate.schedule if aggregate else get_scheduled_job(job_schedule_table, ticket['id'])
     return ticket
     
 
@@ -3,8 +3,8 @@ import os
 from typing import Optional
 from uuid import uuid4
 
-import boto3
 from fastapi import APIRouter, Header, status
+from rctools.aws.clients import get_client
 from rctools.aws.cognito import get_user_with_access_token, merge_user_data
 from rctools.aws.secrets import get_json_secret
 from rctools.payments import (
@@ -14,6 +14,7 @@ from rctools.payments import (
 from rctools.rates import lookup_rate_by_state
 from rctools.users import get_admin_user, get_admin_user_data_from_s3, update_admin_data_in_s3
 from rctools.utils import mk_timestamp
+from utils import DecimalRoute
 
 
 ADMIN_USER_POOL_ID = os.environ.get('ADMIN_USER_POOL_ID')
@@ -23,12 +24,12 @@ STRIPE_PRIVATE_KEY = os.environ.get('STRIPE_PRIVATE_KEY')
 USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
-secrets_client = boto3.client('secretsmanager')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
+secrets_client = get_client('secretsmanager')
 g_context = {}
 
 
@@ -3,13 +3,14 @@ import logging
 import os
 from typing import Optional
 
-import boto3
 from fastapi import APIRouter, Header, status
 from rctools import get_user_with_access_token
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import merge_user_data
 from rctools.company import update_company_service_area
 from rctools.models import Admin
 from rctools.users import get_admin_user_data_from_s3, update_admin_data_in_s3
+from utils import DecimalRoute
 
 
 ADMIN_USER_POOL_ID = os.environ.get('ADMIN_USER_POOL_ID')
@@ -21,14 +22,14 @@ USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 ZIP_CODE_DISTANCE_BUCKET = os.environ.get('ZIP_CODE_DISTANCE_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
-dynamodb = boto3.resource('dynamodb')
-lambda_client = boto3.client('lambda')
-s3_client = boto3.client('s3')
+cognito_client = get_client('cognito-idp')
+dynamodb = get_resource('dynamodb')
+lambda_client = get_client('lambda')
+s3_client = get_client('s3')
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
+router = APIRouter(route_class=DecimalRoute)
 
 service_area_table = dynamodb.Table(INSTALLER_SERVICE_AREA_TABLE_NAME)
 
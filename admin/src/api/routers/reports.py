@@ -6,9 +6,9 @@ from urllib.parse import parse_qs
 from db import reportsData
 from fastapi import APIRouter, Request, Response
 from models import ReportsResponse
-from utils import filter_results, parse_params
+from utils import DecimalRoute, filter_results, parse_params
 
-router = APIRouter()
+router = APIRouter(route_class=DecimalRoute)
 
 
 @router.get('/reports', response_model=List[ReportsResponse])
@@ -2,10 +2,10 @@ import logging
 import os
 from typing import Optional
 
-import boto3
 from botocore.exceptions import ClientError
 from fastapi import APIRouter, Header, status
 from fastapi.responses import JSONResponse
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import (get_user_with_access_token)
 from rctools.exceptions import (InstallerNotAuthorizedToEditSchedule)
 from rctools.exceptions import UserNotAuthorizedToEditInstaller
@@ -13,6 +13,7 @@ from rctools.exceptions import UserNotAuthorizedToEditInstaller
 from rctools.installers import is_company_admin
 from rctools.scheduling import (get_customer_scheduled_jobs_from_dynamo, get_scheduled_job)
 from rctools.users import is_rc_admin
+from utils import DecimalRoute
 
 JOBS_TABLE = os.environ.get('JOBS_TABLE')
 JOB_SCHEDULE_TABLE = os.environ.get('JOB_SCHEDULE_TABLE')
@@ -21,12 +22,12 @@ ADMIN_USER_POOL_ID = os.environ.get('ADMIN_USER_POOL_ID')
 RC_ADMIN_GROUP_ID = os.getenv('RC_ADMIN_GROUP_ID')
 
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
+router = APIRouter(route_class=DecimalRoute)
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = get_resource('dynamodb')
 jobs_table = dynamodb.Table(JOBS_TABLE)
 job_schedule_table = dynamodb.Table(JOB_SCHEDULE_TABLE)
 
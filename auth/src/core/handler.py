@@ -1,14 +1,14 @@
-import boto3
 import logging
 import os
 
 from rctools.alerts import add_user_alert, create_welcome_alert
 from rctools.aws.aws_lambda import async_invoke
+from rctools.aws.clients import get_client, get_resource
 from rctools.mail import EmailTemplates
 
 
-dynamodb = boto3.resource('dynamodb')
-lambda_client = boto3.client('lambda')
+dynamodb = get_resource('dynamodb')
+lambda_client = get_client('lambda')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
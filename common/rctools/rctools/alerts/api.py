@@ -1,39 +1,42 @@
 import logging
-from typing import List
+from typing import List, Optional
 
-from rctools.aws.dynamodb import (KEY_COND_GTE, DynamoPrimaryKey,
-                                  create_dynamo_record, fetch_items_by_pk)
+from rctools.aws.dynamodb import (KEY_COND_GT, DynamoPrimaryKey, DynamoTransaction,
+                                  create_dynamo_record, iter_query, mk_ttl)
 from rctools.models.alerts import Alert
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+ALERT_TTL = 90 * 24 * 60 * 60  # seconds an alert is kept before DynamoDB deletes it
 
-def add_user_alert(table, user_id, alert: Alert) -> str:
+
+def add_user_alert(table, user_id, alert: Alert, transaction: Optional[DynamoTransaction] = None) -> str:
     """
-    Adds an alert for the specified user to the alerts table.
+    Adds an alert for the specified user to the alerts table, or stages it
+    into the given transaction. Alerts expire ALERT_TTL after they are created
+    unless the alert already carries a TimeToLive.
 
     Returns the newly created alert ID.
     """
     logger.info(f'Adding alert {alert.json()} for user {user_id}')
     if not alert.uid:
         alert.uid = user_id
-    return create_dynamo_record(table, alert.dict())
+    if not alert.TimeToLive:
+        alert.TimeToLive = mk_ttl(ALERT_TTL, since=alert.ts)
+    put = transaction.put if transaction is not None else create_dynamo_record
+    return put(table, alert.dict())
 
 
-def check_for_user_alerts(table, user_id, limit=20) -> List[Alert]:
+def check_for_user_alerts(table, user_id, limit=20, since: Optional[int] = None) -> List[Alert]:
     """
     Queries a dyanmo table for any alerts assigned to the user after the
-    given timestamp
+    given timestamp, leaving out expired ones
     """
     logger.info(f'Checking for alerts for user {user_id}')
     pk = DynamoPrimaryKey()
     pk.partition = {'uid': user_id}
-    alerts, pagination_token = [], None
-    while True:
-        items, cursor_token = fetch_items_by_pk(table, pk, cursor_token=pagination_token, limit=limit)
-        alerts += items
-        pagination_token = cursor_token
-        if not pagination_token:
-            break
-    return alerts
+    if since:
+        pk.sort = {'ts': since}
+        pk.sort.comparator = KEY_COND_GT
+    return list(iter_query(table, pk, page_size=limit, exclude_expired=True))
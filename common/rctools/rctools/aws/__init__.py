@@ -1,6 +1,11 @@
 from .aws_lambda import *
+from .cache import *
+from .clients import *
 from .cognito import *
 from .dynamodb import *
+from .metrics import *
 from .s3 import *
 from .secrets import *
-from .ses import *
\ No newline at end of file
+from .ses import *
+from .streams import *
+from .unit_of_work import *
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""
+Read-through cache for DynamoDB point lookups.
+
+Items are kept per process, so across invocations of a warm Lambda, in a
+bounded LRU keyed by table name and lookup key, and expire after a per-table
+TTL. The write helpers in rctools.aws.dynamodb invalidate every cached lookup
+that the written key matches, so a process always reads its own writes; writes
+made by other processes are picked up once the entry expires.
+
+    ticket = get_cached_item(jobs_table, {'ticket_id': id}, lambda: query_ticket(id))
+    item_cache.set_ttl(JOBS_TABLE, 10)  # or pass ttl= per lookup
+
+Inside an identity_map block (opened per request by rctools.unit_of_work)
+each key is also resolved at most once, even for tables with caching off.
+"""
+import contextvars
+import copy
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+DEFAULT_CACHE_MAX_ITEMS = 1024
+# Seconds an item is served from the cache when its table has no TTL of its own
+DEFAULT_CACHE_TTL = 5
+
+_identity_map: contextvars.ContextVar = contextvars.ContextVar('identity_map', default=None)
+
+
+class CacheStats(BaseModel):
+    """Counters for one table, or totals for the whole cache"""
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+
+def _cache_key(table_name: str, key: dict) -> Tuple[str, tuple]:
+    return table_name, tuple(sorted(key.items()))
+
+
+def _matches(cache_key: Tuple[str, tuple], item: dict) -> bool:
+    return all(attribute in item and item[attribute] == value for attribute, value in cache_key[1])
+
+
+class ItemCache:
+    """Thread-safe LRU of DynamoDB items with per-table TTLs"""
+    def __init__(self, max_items=DEFAULT_CACHE_MAX_ITEMS, default_ttl=DEFAULT_CACHE_TTL):
+        self.max_items = max_items
+        self.default_ttl = default_ttl
+        self.ttls: Dict[str, float] = {}
+        self._items: OrderedDict = OrderedDict()
+        # (table, attribute, value) -> cache keys that have that key attribute, for invalidation
+        self._index: Dict[tuple, set] = {}
+        self._stats: Dict[str, CacheStats] = {}
+        self._lock = threading.Lock()
+
+    def set_ttl(self, table_name: str, seconds: float):
+        """Sets how long items from a table are cached; 0 turns caching off for it"""
+        self.ttls[table_name] = seconds
+
+    def get(self, table_name: str, key: dict) -> Optional[dict]:
+        """Returns a copy of the cached item, or None on a miss"""
+        cache_key = _cache_key(table_name, key)
+        with self._lock:
+            stats = self._table_stats(table_name)
+            entry = self._items.get(cache_key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(cache_key)
+                stats.expired += 1
+                entry = None
+            if entry is None:
+                stats.misses += 1
+                return None
+            self._items.move_to_end(cache_key)
+            stats.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def put(self, table_name: str, key: dict, item: Optional[dict], ttl: Optional[float] = None):
+        """Caches a copy of item for ttl seconds, or the table's TTL if not given"""
+        if ttl is None:
+            ttl = self.ttls.get(table_name, self.default_ttl)
+        if not ttl or item is None:
+            return
+        cache_key = _cache_key(table_name, key)
+        item = copy.deepcopy(item)
+        with self._lock:
+            self._remove(cache_key)
+            self._items[cache_key] = (time.monotonic() + ttl, item)
+            for attribute, value in cache_key[1]:
+                self._index.setdefault((table_name, attribute, value), set()).add(cache_key)
+            while len(self._items) > self.max_items:
+                oldest = next(iter(self._items))
+                self._remove(oldest)
+                self._table_stats(oldest[0]).evictions += 1
+
+    def invalidate(self, table_name: str, item: dict):
+        """
+        Drops every cached lookup whose key attributes all match item, which
+        may be a written key or a whole item, so a write to (ticket_id, ts)
+        also drops a cached lookup by ticket_id alone
+        """
+        with self._lock:
+            matches = set()
+            for attribute, value in item.items():
+                try:
+                    matches |= self._index.get((table_name, attribute, value), set())
+                except TypeError:
+                    continue  # maps and lists are never key attributes
+            for cache_key in matches:
+                if _matches(cache_key, item):
+                    self._remove(cache_key)
+                    self._table_stats(table_name).invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._index.clear()
+
+    def stats(self, table_name: Optional[str] = None) -> CacheStats:
+        """Counters for one table, or summed over every table"""
+        with self._lock:
+            if table_name is not None:
+                return self._table_stats(table_name).copy()
+            totals = CacheStats()
+            for stats in self._stats.values():
+                for field in CacheStats.__fields__:
+                    setattr(totals, field, getattr(totals, field) + getattr(stats, field))
+            return totals
+
+    def table_stats(self) -> Dict[str, CacheStats]:
+        with self._lock:
+            return {name: stats.copy() for name, stats in self._stats.items()}
+
+    def _table_stats(self, table_name: str) -> CacheStats:
+        if table_name not in self._stats:
+            self._stats[table_name] = CacheStats()
+        return self._stats[table_name]
+
+    def _remove(self, cache_key):
+        if self._items.pop(cache_key, None) is None:
+            return
+        table_name, key = cache_key
+        for attribute, value in key:
+            keys = self._index.get((table_name, attribute, value))
+            if keys is not None:
+                keys.discard(cache_key)
+                if not keys:
+                    del self._index[(table_name, attribute, value)]
+
+
+item_cache = ItemCache()
+
+
+@contextmanager
+def identity_map():
+    """
+    Within the block every key looked up through get_cached_item is loaded at
+    most once. Each read still gets its own copy, so one caller changing an
+    item can't leak into another's view of it.
+    """
+    items = {}
+    token = _identity_map.set(items)
+    try:
+        yield items
+    finally:
+        _identity_map.reset(token)
+
+
+def get_cached_item(table, key: dict, load: Callable[[], Optional[dict]], ttl: Optional[float] = None) -> Optional[dict]:
+    """
+    Returns the item cached for key in the table, or calls load and caches what
+    it returns. Missing items (None) are not cached.
+    """
+    identity = _identity_map.get()
+    if identity is not None:
+        cache_key = _cache_key(table.name, key)
+        if cache_key in identity:
+            return copy.deepcopy(identity[cache_key])
+    item = item_cache.get(table.name, key)
+    if item is None:
+        item = load()
+        item_cache.put(table.name, key, item, ttl=ttl)
+    if identity is not None and item is not None:
+        identity[cache_key] = copy.deepcopy(item)
+    return item
+
+
+def invalidate_cached_item(table, item: dict):
+    """Drops the lookups item matches from the cache and the current identity map"""
+    item_cache.invalidate(table.name, item)
+    identity = _identity_map.get()
+    if identity:
+        for cache_key in [k for k in identity if k[0] == table.name and _matches(k, item)]:
+            del identity[cache_key]
+
+
+def item_cache_stats() -> Dict[str, CacheStats]:
+    """Hit, miss, expiry, eviction and invalidation counts per table"""
+    return item_cache.table_stats()
@@ -0,0 +1,158 @@
+"""
+Shared boto3 client factory with a common retry and throttling policy.
+
+Clients and resources are created once per process and service, with the
+retry mode that suits the service, so throttling backs off with jitter instead
+of surfacing as errors. Cognito admin calls also go through a client-side
+rate limiter, and every throttled response is counted (see throttle_counts).
+
+    cognito_client = get_client('cognito-idp')
+    dynamodb = get_resource('dynamodb')
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# botocore retry settings per service. Both modes back off exponentially with full jitter;
+# adaptive mode additionally slows the client down while it is being throttled.
+RETRY_POLICIES = {
+    'dynamodb': {'mode': 'adaptive', 'max_attempts': 10},
+    'cognito-idp': {'mode': 'adaptive', 'max_attempts': 8},
+    # Never retried: a retried Event invoke can be queued twice when the first request timed out
+    # after Lambda accepted it, and the async handlers aren't idempotent
+    'lambda': {'mode': 'standard', 'max_attempts': 0},
+}
+DEFAULT_RETRY_POLICY = {'mode': 'standard', 'max_attempts': 5}
+
+# Requests per second allowed per process for Cognito admin APIs, kept under the
+# account quotas so bursts (e.g. admin listings) queue up instead of being throttled
+COGNITO_RATE_LIMITS = {
+    'ListUsers': 25,
+    'ListUsersInGroup': 25,
+    'AdminGetUser': 100,
+    'AdminListGroupsForUser': 100,
+    'AdminCreateUser': 40,
+}
+COGNITO_DEFAULT_ADMIN_RATE_LIMIT = 20
+
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'Throttling',
+    'ThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'SlowDown',
+}
+
+_clients: Dict[tuple, object] = {}
+_clients_lock = threading.Lock()
+_throttles: Dict[Tuple[str, str], int] = {}
+_throttles_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Token bucket that blocks callers until a token is available"""
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+_cognito_limiters: Dict[str, RateLimiter] = {}
+_cognito_limiters_lock = threading.Lock()
+
+
+def _cognito_limiter(operation: str) -> Optional[RateLimiter]:
+    rate = COGNITO_RATE_LIMITS.get(operation)
+    if rate is None:
+        if not operation.startswith('Admin'):
+            return None
+        rate = COGNITO_DEFAULT_ADMIN_RATE_LIMIT
+    with _cognito_limiters_lock:
+        if operation not in _cognito_limiters:
+            _cognito_limiters[operation] = RateLimiter(rate)
+        return _cognito_limiters[operation]
+
+
+def _limit_cognito_call(model, **kwargs):
+    limiter = _cognito_limiter(model.name)
+    if limiter:
+        limiter.acquire()
+
+
+def _count_throttle(response, operation, **kwargs):
+    if not response:
+        return
+    code = response[1].get('Error', {}).get('Code')
+    if code not in THROTTLING_ERROR_CODES:
+        return
+    key = (operation.service_model.service_name, operation.name)
+    with _throttles_lock:
+        _throttles[key] = _throttles.get(key, 0) + 1
+        total = _throttles[key]
+    logger.warning(f'Throttled by {key[0]} {key[1]} ({code}), {total} throttle(s) so far')
+
+
+def throttle_counts() -> Dict[str, int]:
+    """Throttled responses seen by this process, keyed by 'service.Operation'"""
+    with _throttles_lock:
+        return {f'{service}.{operation}': count for (service, operation), count in _throttles.items()}
+
+
+def mk_client_config(service: str, **kwargs) -> Config:
+    """botocore Config with the shared retry policy for the service; kwargs are passed to Config"""
+    return Config(retries=dict(RETRY_POLICIES.get(service, DEFAULT_RETRY_POLICY)), **kwargs)
+
+
+def _register_handlers(client):
+    events = client.meta.events
+    events.register('needs-retry', _count_throttle, unique_id='rctools-count-throttles')
+    if client.meta.service_model.service_name == 'cognito-idp':
+        events.register('before-call.cognito-idp', _limit_cognito_call, unique_id='rctools-cognito-rate-limit')
+    return client
+
+
+def get_client(service: str, region_name: Optional[str] = None, endpoint_url: Optional[str] = None):
+    """
+    Returns the process-wide client for the service, creating it on first use.
+    A region or endpoint other than the default gets a client of its own.
+    """
+    key = ('client', service, region_name, endpoint_url)
+    with _clients_lock:
+        if key not in _clients:
+            client = boto3.client(service, region_name=region_name, endpoint_url=endpoint_url,
+                                  config=mk_client_config(service))
+            _clients[key] = _register_handlers(client)
+        return _clients[key]
+
+
+def get_resource(service: str):
+    """Returns the process-wide resource for the service, creating it on first use"""
+    with _clients_lock:
+        if ('resource', service) not in _clients:
+            resource = boto3.resource(service, config=mk_client_config(service))
+            _register_handlers(resource.meta.client)
+            _clients[('resource', service)] = resource
+        return _clients[('resource', service)]
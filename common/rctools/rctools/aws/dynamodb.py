@@ -1,19 +1,79 @@
 import base64
 import decimal
+import heapq
 import json
 import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import List, Literal, Union, Optional
+from typing import Any, Callable, Dict, Iterator, List, Literal, Union, Optional
 
-from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.conditions import Attr, ConditionExpressionBuilder, Key
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
 from pydantic import BaseModel
 
+from rctools.aws.cache import invalidate_cached_item
+from rctools.aws.clients import get_client
+from rctools.aws.metrics import with_context
+from rctools.exceptions import (BatchRequestIncomplete, ConditionalWriteConflict, QueryDeadlineExceeded, RecordAlreadyExists,
+                                TransactionCancelled)
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Constants for key condition expressions
 KEY_COND_EQ = 'EQ'
+KEY_COND_LT = 'LT'
+KEY_COND_LTE = 'LTE'
+KEY_COND_GT = 'GT'
 KEY_COND_GTE = 'GTE'
+KEY_COND_BETWEEN = 'BETWEEN'  # value is a (low, high) pair, both inclusive
+KEY_COND_BEGINS_WITH = 'BEGINS_WITH'  # string and binary sort keys only
+
+# Constants for key attribute types
+KEY_TYPE_NUMBER = 'N'
+KEY_TYPE_STRING = 'S'
+KEY_TYPE_BINARY = 'B'
+
+# Page sizes used when lazily paginating through queries
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+# Number of segments full-table scans are split into and run in parallel
+DEFAULT_SCAN_SEGMENTS = 4
+
+# Batch request limits and retry policy for unprocessed keys/items
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+BATCH_MAX_RETRIES = 8
+BATCH_BACKOFF_BASE = 0.05  # seconds
+BATCH_BACKOFF_CAP = 2  # seconds
+DEFAULT_BATCH_WORKERS = 4
+
+# Query fan-out across partitions
+DEFAULT_QUERY_WORKERS = 8
+
+# Optimistic locking
+VERSION_ATTRIBUTE = 'version'
+CONDITIONAL_MAX_RETRIES = 5
+
+# TransactWriteItems limit
+TRANSACT_MAX_ITEMS = 100
+
+# Attribute the tables' TimeToLiveSpecification points at, holding epoch seconds
+TTL_ATTRIBUTE = 'TimeToLive'
+
+# decode_item (fast_call, stream records): numbers stay Decimal under these attribute names, and
+# otherwise only become floats if they have few enough digits to round-trip
+MONEY_ATTRIBUTES = frozenset({'price', 'amount'})
+FLOAT_SAFE_DIGITS = 15
+
+# Key attribute names per table name, see table_key_names
+_table_key_names: Dict[str, List[str]] = {}
 
 
 class DynamoJsonEncoder(json.JSONEncoder):
@@ -24,25 +84,159 @@ class DynamoJsonEncoder(json.JSONEncoder):
         return super(DynamoJsonEncoder, self).default(o)
 
 
+def decimal_to_json(value: decimal.Decimal):
+    """Encodes a number read from DynamoDB for an API response, as an int when it is integral"""
+    return int(value) if value == value.to_integral_value() else float(value)
+
+
+# custom_encoder for fastapi's jsonable_encoder, see the APIs' DecimalRoute
+JSON_ENCODERS = {decimal.Decimal: decimal_to_json}
+
+
+def _dispatch(table: dict, cls: type):
+    """
+    Looks up the converter for a type, falling back to its base classes; the
+    result (including None for types without one) is cached in the table
+    """
+    try:
+        return table[cls]
+    except KeyError:
+        pass
+    converter = next((table[base] for base in cls.__mro__[1:] if base in table), None)
+    table[cls] = converter
+    return converter
+
+
+def _datetime_to_dynamo(value: datetime) -> str:
+    return value.replace(tzinfo=None).isoformat(timespec='seconds') + 'Z'
+
+
+def _float_to_dynamo(value: float) -> decimal.Decimal:
+    return decimal.Decimal(str(value))
+
+
+def _set_to_dynamo(value) -> set:
+    return {_float_to_dynamo(v) if type(v) is float else v for v in value}
+
+
+# Markers for the containers that mk_dynamo_record copies as it walks them
+_MAP = 'M'
+_LIST = 'L'
+
+# Converters used by mk_dynamo_record, keyed by type. Types mapped to None
+# are written as they are; subclasses are resolved and cached by _dispatch
+TO_DYNAMO = {
+    dict: _MAP,
+    list: _LIST,
+    tuple: _LIST,
+    float: _float_to_dynamo,
+    datetime: _datetime_to_dynamo,
+    set: _set_to_dynamo,
+    frozenset: _set_to_dynamo,
+    str: None,
+    int: None,
+    bool: None,
+    decimal.Decimal: None,
+    bytes: None,
+    type(None): None,
+}
+
+
+def _encode_value(value, stack: list):
+    """Converts a scalar, or queues a copy of a map or list for mk_dynamo_record"""
+    encode = _dispatch(TO_DYNAMO, type(value))
+    if encode is None:
+        return value
+    if encode is _MAP:
+        encoded = {}
+    elif encode is _LIST:
+        encoded = []
+    else:
+        return encode(value)
+    stack.append((value, encoded))
+    return encoded
+
+
+def _decode_money(raw: str, money: bool):
+    return decimal.Decimal(raw) if money else decode_number(raw)
+
+
+# Decoders for low-level attribute values keyed by type tag. Maps (M) and
+# lists (L) are walked by _decode_containers
+FROM_DYNAMO = {
+    'S': lambda raw, money: raw,
+    'N': _decode_money,
+    'BOOL': lambda raw, money: raw,
+    'NULL': lambda raw, money: None,
+    'B': lambda raw, money: raw,
+    'SS': lambda raw, money: set(raw),
+    'BS': lambda raw, money: set(raw),
+    'NS': lambda raw, money: {_decode_money(n, money) for n in raw},
+}
+
+
+class ScanProgress(BaseModel):
+    """Running totals reported while a parallel scan is in flight"""
+    total_segments: int
+    segments_done: int = 0
+    pages: int = 0
+    items: int = 0
+    scanned: int = 0
+
+
+class BatchWriteStats(BaseModel):
+    """Summary of a batch_write call, logged and returned to the caller"""
+    puts: int = 0
+    deletes: int = 0
+    requests: int = 0
+    retries: int = 0
+    seconds: float = 0
+
+    @property
+    def items_per_second(self) -> float:
+        if not self.seconds:
+            return 0
+        return (self.puts + self.deletes) / self.seconds
+
+
 class DynamoPrimaryKey:
     class KeyQuery(BaseModel):
         key: str
-        comparator: Literal['EQ', 'GTE'] = 'EQ'
-        value: Union[str, int]
+        comparator: Literal['EQ', 'LT', 'LTE', 'GT', 'GTE', 'BETWEEN', 'BEGINS_WITH'] = 'EQ'
+        value: Any
         type: Literal['partition', 'sort'] = 'partition'
+        # Defaults to a string partition key and a number sort key
+        value_type: Optional[Literal['N', 'S', 'B']] = None
+
+        def cast(self, value):
+            value_type = self.value_type or (KEY_TYPE_NUMBER if self.type == 'sort' else KEY_TYPE_STRING)
+            if value_type == KEY_TYPE_NUMBER:
+                return int(value)
+            if value_type == KEY_TYPE_BINARY:
+                return value if isinstance(value, bytes) else str(value).encode('utf-8')
+            return str(value)
 
         def get_typed_value(self):
-            if self.type == 'sort':
-                return int(self.value)
-            return self.value
+            if self.comparator == KEY_COND_BETWEEN:
+                low, high = self.value
+                return self.cast(low), self.cast(high)
+            return self.cast(self.value)
 
         def to_key_expression(self):
-            if self.comparator == KEY_COND_EQ:
-                # logger.info(f'Returning EQ key expression with {self.key} and {type(self.get_typed_value())} {self.value}')
-                return Key(self.key).eq(self.get_typed_value())
-            elif self.comparator == KEY_COND_GTE:
-                # logger.info(f'Returning GTE key expression with {self.key} and {type(self.get_typed_value())} {self.value}')
-                return Key(self.key).gte(self.get_typed_value())
+            if self.type == 'partition' and self.comparator != KEY_COND_EQ:
+                raise ValueError(f'Partition key {self.key} only supports {KEY_COND_EQ}, not {self.comparator}')
+            key = Key(self.key)
+            if self.comparator == KEY_COND_BETWEEN:
+                return key.between(*self.get_typed_value())
+            if self.comparator == KEY_COND_BEGINS_WITH:
+                return key.begins_with(self.get_typed_value())
+            return {
+                KEY_COND_EQ: key.eq,
+                KEY_COND_LT: key.lt,
+                KEY_COND_LTE: key.lte,
+                KEY_COND_GT: key.gt,
+                KEY_COND_GTE: key.gte,
+            }[self.comparator](self.get_typed_value())
 
     _partition: Optional[Union[dict, KeyQuery]] = None
     _sort: Optional[Union[dict, KeyQuery]] = None
@@ -84,10 +278,164 @@ class DynamoPrimaryKey:
         return keys
 
 
+def backoff(attempt: int):
+    """Sleeps for an exponentially growing, fully jittered interval"""
+    time.sleep(random.uniform(0, min(BATCH_BACKOFF_CAP, BATCH_BACKOFF_BASE * 2 ** attempt)))
+
+
+def batch_get(table, keys: List[dict], max_workers=DEFAULT_BATCH_WORKERS, attributes: Optional[List[str]] = None,
+              fast: bool = False, **kwargs) -> List[dict]:
+    """
+    Fetches many items by their full primary key with BatchGetItem.
+
+    Keys are de-duplicated and split into requests of BATCH_GET_SIZE which run
+    concurrently. UnprocessedKeys are retried with jittered backoff. Found items
+    are returned in the order of the given keys, and missing keys are skipped.
+
+    If attributes is given, only those (plus the key attributes, which are
+    needed to order the results) are read. With fast, reads go through the
+    low-level client (see fast_call). Additional kwargs are forwarded with the
+    keys, e.g. ConsistentRead.
+    """
+    if not keys:
+        return []
+    key_names = list(keys[0].keys())
+    if attributes:
+        attributes = key_names + [a for a in attributes if a not in key_names]
+    kwargs = add_projection(kwargs, attributes)
+
+    def key_id(item):
+        return tuple(item[k] for k in key_names)
+
+    unique_keys = list({key_id(k): k for k in keys}.values())
+    chunks = [unique_keys[i:i + BATCH_GET_SIZE] for i in range(0, len(unique_keys), BATCH_GET_SIZE)]
+    client = table.meta.client
+
+    def get_chunk(chunk):
+        request, items, attempt = {'Keys': chunk, **kwargs}, [], 0
+        while True:
+            if fast:
+                response = fast_call(table, 'batch_get_item', {'RequestItems': {table.name: request}})
+            else:
+                response = client.batch_get_item(RequestItems={table.name: request})
+            items += response.get('Responses', {}).get(table.name, [])
+            request = response.get('UnprocessedKeys', {}).get(table.name)
+            if not request:
+                return items
+            if attempt >= BATCH_MAX_RETRIES:
+                raise BatchRequestIncomplete(f'{len(request["Keys"])} key(s) unprocessed for {table.name}')
+            backoff(attempt)
+            attempt += 1
+
+    found = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        for items in executor.map(with_context(get_chunk), chunks):
+            found.update({key_id(i): i for i in items})
+    logger.info(f'Batch get found {len(found)} of {len(unique_keys)} item(s) in {len(chunks)} request(s)')
+    return [found[key_id(k)] for k in unique_keys if key_id(k) in found]
+
+
+def table_key_names(table) -> List[str]:
+    """The table's key attribute names, from its key schema (one DescribeTable per table per process)"""
+    if table.name not in _table_key_names:
+        _table_key_names[table.name] = [key['AttributeName'] for key in table.key_schema]
+    return _table_key_names[table.name]
+
+
+def batch_write(table, puts: Optional[List[dict]] = None, deletes: Optional[List[dict]] = None,
+                max_workers=DEFAULT_BATCH_WORKERS) -> BatchWriteStats:
+    """
+    Puts and deletes many items with BatchWriteItem.
+
+    Requests are split into BATCH_WRITE_SIZE items and run concurrently, and
+    UnprocessedItems are retried with jittered backoff. Puts go through
+    mk_dynamo_record. BatchWriteItem rejects two writes to the same key and
+    the requests run in no particular order, so only the last put of a key is
+    sent, and a delete for a key that is also being put is dropped, since the
+    put replaces that item anyway.
+
+    Returns a BatchWriteStats with counts, retries and elapsed time.
+    """
+    started = time.monotonic()
+    records = [mk_dynamo_record(obj) for obj in puts or []]
+    deletes = deletes or []
+    key_names = list(deletes[0].keys()) if deletes else table_key_names(table) if len(records) > 1 else None
+    if key_names:
+        def key_id(item):
+            return tuple(item.get(k) for k in key_names)
+
+        records = list({key_id(r): r for r in records}.values())
+        put_keys = {key_id(r) for r in records}
+        deletes = list({key_id(d): d for d in deletes if key_id(d) not in put_keys}.values())
+    requests = [{'PutRequest': {'Item': r}} for r in records] + [{'DeleteRequest': {'Key': k}} for k in deletes]
+    stats = BatchWriteStats(puts=len(records), deletes=len(deletes))
+    if not requests:
+        return stats
+
+    chunks = [requests[i:i + BATCH_WRITE_SIZE] for i in range(0, len(requests), BATCH_WRITE_SIZE)]
+    client = table.meta.client
+
+    def write_chunk(chunk):
+        attempt = 0
+        while True:
+            response = client.batch_write_item(RequestItems={table.name: chunk})
+            chunk = response.get('UnprocessedItems', {}).get(table.name)
+            if not chunk:
+                return attempt + 1, attempt
+            if attempt >= BATCH_MAX_RETRIES:
+                raise BatchRequestIncomplete(f'{len(chunk)} item(s) unprocessed for {table.name}')
+            backoff(attempt)
+            attempt += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            for num_requests, retries in executor.map(with_context(write_chunk), chunks):
+                stats.requests += num_requests
+                stats.retries += retries
+    finally:
+        for item in records + deletes:
+            invalidate_cached_item(table, item)
+    stats.seconds = time.monotonic() - started
+    logger.info(f'Batch wrote {stats.puts} put(s) and {stats.deletes} delete(s) to {table.name} in {stats.requests} request(s), '
+                f'{stats.retries} retried, {stats.items_per_second:.0f} items/s')
+    return stats
+
+
 def create_dynamo_record(table, obj):
     record = mk_dynamo_record(obj)
     logger.info(f'Creating new dynamo record: {record}')
-    return table.put_item(Item=record)
+    try:
+        return table.put_item(Item=record)
+    finally:
+        invalidate_cached_item(table, record)
+
+
+def is_conditional_check_failure(err: ClientError) -> bool:
+    return err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def create_dynamo_record_if_absent(table, obj, key: str, condition=None):
+    """
+    Puts a new item only if nothing is stored under its primary key yet, so
+    claiming a key is a single write rather than a query followed by a put.
+
+    key is the table's partition key attribute. An extra boto3 condition may be
+    given to also allow replacing an existing item it matches (e.g. an expired
+    lock). Raises RecordAlreadyExists when the key is taken.
+    """
+    record = mk_dynamo_record(obj)
+    condition_expression = Attr(key).not_exists()
+    if condition is not None:
+        condition_expression |= condition
+    logger.info(f'Creating new dynamo record if absent: {record}')
+    try:
+        return table.put_item(Item=record, ConditionExpression=condition_expression)
+    except ClientError as e:
+        if is_conditional_check_failure(e):
+            raise RecordAlreadyExists(f'{key} {record.get(key)} already exists') from e
+        raise
+    finally:
+        invalidate_cached_item(table, record)
 
 
 def decode_decimal(dct):
@@ -107,7 +455,153 @@ def encode_key_as_token(key):
     return base64.b64encode(json_string.encode('utf-8')).decode('utf-8')
 
 
-def fetch_items_by_pk(table, pk: DynamoPrimaryKey, limit=200, cursor_token=None, **kwargs):
+_serializer = TypeSerializer()
+
+
+def decode_number(value: str):
+    """
+    Decodes a DynamoDB number to int when it is integral, to float when that
+    loses no precision, and to Decimal otherwise
+    """
+    if '.' not in value and 'e' not in value and 'E' not in value:
+        return int(value)
+    digits = value.lstrip('-').split('e')[0].split('E')[0].replace('.', '').strip('0')
+    if len(digits) <= FLOAT_SAFE_DIGITS:
+        return float(value)
+    return decimal.Decimal(value)
+
+
+def decode_attribute(value: dict, money: bool = False, money_attributes=MONEY_ATTRIBUTES):
+    """Decodes a low-level attribute value; money keeps numbers as Decimal"""
+    stack = []
+    decoded = _decode_value(value, money, stack)
+    _decode_containers(stack, money_attributes)
+    return decoded
+
+
+def decode_item(item: dict, money_attributes=MONEY_ATTRIBUTES, decimals: bool = False) -> dict:
+    """
+    Decodes a low-level item into plain Python values (see decode_number).
+    With decimals, every number is kept as Decimal like the Table resource does.
+    """
+    decoded = {}
+    _decode_containers([(item, decoded, decimals)], money_attributes)
+    return decoded
+
+
+def _decode_value(value: dict, money: bool, stack: list):
+    (tag, raw), = value.items()
+    if tag == 'M':
+        decoded = {}
+    elif tag == 'L':
+        decoded = []
+    else:
+        decode = FROM_DYNAMO.get(tag)
+        if decode is None:
+            raise TypeError(f'Unknown DynamoDB type {tag}')
+        return decode(raw, money)
+    stack.append((raw, decoded, money))
+    return decoded
+
+
+def _decode_containers(stack: list, money_attributes):
+    """
+    Fills in the maps and lists queued by _decode_value without recursing.
+    Numbers stay Decimal under a money attribute or a container that is money.
+    """
+    while stack:
+        source, target, money = stack.pop()
+        if type(target) is dict:
+            for key, value in source.items():
+                target[key] = _decode_value(value, money or key in money_attributes, stack)
+        else:
+            for value in source:
+                target.append(_decode_value(value, money, stack))
+
+
+def _serialize(value) -> dict:
+    """Serializes a value for the low-level client, taking the floats fast_call decodes"""
+    return _serializer.serialize(_float_to_dynamo(value) if type(value) is float else value)
+
+
+def mk_low_level_args(args: dict) -> dict:
+    """
+    Converts request args in the form the Table resource takes (condition
+    objects, Python values) into the form the low-level client takes
+    """
+    args = dict(args)
+    names = dict(args.pop('ExpressionAttributeNames', {}))
+    values = dict(args.pop('ExpressionAttributeValues', {}))
+    builder = ConditionExpressionBuilder()
+    for name in ('KeyConditionExpression', 'FilterExpression', 'ConditionExpression'):
+        condition = args.get(name)
+        if condition is not None and not isinstance(condition, str):
+            built = builder.build_expression(condition, is_key_condition=name == 'KeyConditionExpression')
+            args[name] = built.condition_expression
+            names.update(built.attribute_name_placeholders)
+            values.update(built.attribute_value_placeholders)
+    if names:
+        args['ExpressionAttributeNames'] = names
+    if values:
+        args['ExpressionAttributeValues'] = {k: _serialize(v) for k, v in values.items()}
+    for name in ('Key', 'Item', 'ExclusiveStartKey'):
+        if name in args:
+            args[name] = {k: _serialize(v) for k, v in args[name].items()}
+    if 'RequestItems' in args:
+        args['RequestItems'] = {
+            table: {**request, 'Keys': [{k: _serialize(v) for k, v in key.items()} for key in request['Keys']]}
+            for table, request in args['RequestItems'].items()
+        }
+    return args
+
+
+def low_level_client(table):
+    """
+    The client fast_call reads through: a plain one for the region and
+    endpoint of the table's own client, which has the Table resource's
+    (de)serialization hooks registered on it. Tables can bring their own as
+    meta.low_level_client (the test fakes do).
+    """
+    client = getattr(table.meta, 'low_level_client', None)
+    if client is not None:
+        return client
+    meta = table.meta.client.meta
+    return get_client('dynamodb', region_name=meta.region_name, endpoint_url=meta.endpoint_url)
+
+
+def fast_call(table, operation: str, args: dict) -> dict:
+    """
+    Runs a read (query, scan, get_item or batch_get_item) through the plain
+    low-level client instead of the Table resource, skipping boto3's
+    TypeDeserializer, and decodes the items with decode_item: numbers become
+    int or float when that is safe, and stay Decimal under MONEY_ATTRIBUTES.
+    Keys (LastEvaluatedKey, UnprocessedKeys) keep Decimal numbers, as they
+    are sent back in follow-up requests.
+
+    Takes and returns the same shapes as the Table resource methods.
+    """
+    args = mk_low_level_args(args)
+    if operation != 'batch_get_item':
+        args['TableName'] = table.name
+    response = getattr(low_level_client(table), operation)(**args)
+    if 'Items' in response:
+        response['Items'] = [decode_item(i) for i in response['Items']]
+    if 'Item' in response:
+        response['Item'] = decode_item(response['Item'])
+    if 'LastEvaluatedKey' in response:
+        response['LastEvaluatedKey'] = decode_item(response['LastEvaluatedKey'], decimals=True)
+    if 'Responses' in response:
+        response['Responses'] = {t: [decode_item(i) for i in items] for t, items in response['Responses'].items()}
+    if 'UnprocessedKeys' in response:
+        response['UnprocessedKeys'] = {
+            t: {**request, 'Keys': [decode_item(k, decimals=True) for k in request['Keys']]}
+            for t, request in response['UnprocessedKeys'].items()
+        }
+    return response
+
+
+def fetch_items_by_pk(table, pk: DynamoPrimaryKey, limit=200, cursor_token=None, attributes: Optional[List[str]] = None,
+                      fast: bool = False, **kwargs):
     """
     Performs an efficient query operation on the user events table
     to produce a list of results and a 'LastEvaluatedKey' which if set
@@ -116,6 +610,9 @@ def fetch_items_by_pk(table, pk: DynamoPrimaryKey, limit=200, cursor_token=None,
     Can be passed additional kwargs that are forwarded to the query args.
     Some common keyword arguments here are IndexName for GSIs, ScanIndexForward
     to control sort order (False returns newest first).
+
+    Pass attributes to only read those attribute paths (see mk_projection_expression),
+    and fast to read through the low-level client (see fast_call).
     """
     key_condition_expression = mk_key_condition_expression(pk)
 
@@ -125,13 +622,14 @@ def fetch_items_by_pk(table, pk: DynamoPrimaryKey, limit=200, cursor_token=None,
         'KeyConditionExpression': key_condition_expression,  # Required
         **kwargs  # e.g., IndexName, ScanIndexForward
     }
+    add_projection(query_args, attributes)
     if cursor_token:
         decoder_cursor_token = decode_token_to_key(cursor_token)
         query_args['ExclusiveStartKey'] = decoder_cursor_token
     if limit:
         query_args['Limit'] = limit
 
-    response = table.query(**query_args)
+    response = fast_call(table, 'query', query_args) if fast else table.query(**query_args)
     response_last_evaluated_key = response.get('LastEvaluatedKey')
     encoded_cursor_token = None
 
@@ -143,26 +641,153 @@ def fetch_items_by_pk(table, pk: DynamoPrimaryKey, limit=200, cursor_token=None,
     return items, encoded_cursor_token
 
 
-def mk_dynamo_record(obj):
+def iter_query(table, pk: DynamoPrimaryKey, index: Optional[str] = None, page_size: Optional[int] = DEFAULT_PAGE_SIZE,
+               max_items: Optional[int] = None, max_page_size: int = MAX_PAGE_SIZE, cursor_token: Optional[str] = None,
+               attributes: Optional[List[str]] = None, fast: bool = False, exclude_expired: bool = False,
+               **kwargs) -> Iterator[dict]:
+    """
+    Lazily yields the items matching the primary key, one page at a time.
+
+    Pages are only requested as the caller consumes items, so breaking out of
+    the loop (or passing max_items) stops any further reads. The first page is
+    requested with page_size and each following page doubles in size up to
+    max_page_size, which keeps "first few rows" lookups cheap while long
+    partitions still finish in a handful of round trips. The page limit never
+    exceeds the number of items still wanted.
+
+    Pass attributes to only read those attribute paths, and fast to read
+    through the low-level client (see fast_call). With exclude_expired, items
+    past their TTL_ATTRIBUTE are filtered out server-side (see not_expired);
+    on an index the attribute must be projected. Additional kwargs are
+    forwarded to the query args, e.g. ScanIndexForward.
+    """
+    query_args = {
+        'KeyConditionExpression': mk_key_condition_expression(pk),  # Required
+        **kwargs
+    }
+    add_projection(query_args, attributes)
+    if exclude_expired:
+        add_filter(query_args, not_expired())
+    if index:
+        query_args['IndexName'] = index
+    if cursor_token:
+        query_args['ExclusiveStartKey'] = decode_token_to_key(cursor_token)
+
+    remaining = max_items
+    while remaining is None or remaining > 0:
+        limit = page_size
+        if remaining is not None:
+            limit = min(limit, remaining) if limit else remaining
+        if limit:
+            query_args['Limit'] = limit
+
+        response = fast_call(table, 'query', query_args) if fast else table.query(**query_args)
+        items = response.get('Items', [])
+        for item in items[:remaining]:
+            yield item
+        if remaining is not None:
+            remaining -= min(len(items), remaining)
+
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            break
+        query_args['ExclusiveStartKey'] = last_evaluated_key
+        if page_size:
+            page_size = min(page_size * 2, max_page_size)
+
+
+def query_partitions(table, key: str, values: List, sort: Optional[Union[dict, DynamoPrimaryKey.KeyQuery]] = None,
+                     index: Optional[str] = None, max_items_per_key: Optional[int] = None, deadline: Optional[float] = None,
+                     max_workers=DEFAULT_QUERY_WORKERS, **kwargs) -> Dict[Any, List[dict]]:
+    """
+    Runs the same query for many partition key values at once, so the call
+    takes as long as the slowest partition rather than the sum of them all.
+
+    key is the partition key attribute (of the index, if given) and values the
+    partitions to read; duplicates are queried once. sort, if given, applies
+    to every partition. Each partition is read with iter_query, so
+    max_items_per_key, attributes, fast, exclude_expired and any other kwargs
+    (e.g. ScanIndexForward) behave as they do there.
+
+    Returns the items grouped by partition value, in the order of values, with
+    an empty list for partitions without items; use merge_partitions for a
+    single sorted list. If deadline (in seconds) passes first, the remaining
+    queries are abandoned and QueryDeadlineExceeded is raised with the
+    partitions that did finish.
+    """
+    values = list(dict.fromkeys(values))
+    if not values:
+        return {}
+    stop = threading.Event()
+
+    def query_partition(value):
+        pk = DynamoPrimaryKey()
+        pk.partition = {key: value}
+        if sort is not None:
+            pk.sort = sort.copy() if isinstance(sort, DynamoPrimaryKey.KeyQuery) else sort
+        items = []
+        for item in iter_query(table, pk, index=index, max_items=max_items_per_key, **kwargs):
+            if stop.is_set():  # an abandoned query reads at most the page it is waiting on
+                break
+            items.append(item)
+        return items
+
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(values)))
+    futures = {executor.submit(with_context(query_partition), value): value for value in values}
+    try:
+        done, pending = wait(futures, timeout=deadline, return_when=FIRST_EXCEPTION)
+        results = {futures[f]: f.result() for f in done}  # raises the first failure
+        if pending:
+            raise QueryDeadlineExceeded(f'{len(pending)} of {len(values)} {key} partition(s) of {table.name} '
+                                        f'not read within {deadline}s', results=results)
+    finally:
+        stop.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+    logger.info(f'Queried {len(values)} {key} partition(s) of {table.name} for {sum(map(len, results.values()))} item(s) '
+                f'in {time.monotonic() - started:.3f}s')
+    return {value: results[value] for value in values}
+
+
+def merge_partitions(results: Dict[Any, List[dict]], sort_key: str, reverse: bool = False) -> List[dict]:
     """
-    Recurses through an object, replacing floats with decimals and
-    generally making the object suitable for writing to Dynamo
+    Merges the grouped results of query_partitions into one list ordered by
+    sort_key. Each partition is expected to already be in that order, as it is
+    when sort_key is the sort key of the table or index queried.
     """
-    if isinstance(obj, datetime):
-        return obj.strftime('%Y-%m-%dT%H:%M:%SZ')
-    if isinstance(obj, list):
-        for i in range(len(obj)):
-            ditem = mk_dynamo_record(obj[i])
-            if ditem is None:
-                ditem = ''
-            obj[i] = ditem
-        return obj
-    if isinstance(obj, dict):
-        return {k: mk_dynamo_record(v) for k, v in obj.items() if v is not None}
-    if isinstance(obj, float):
-        return decimal.Decimal(str(obj))
+    return list(heapq.merge(*results.values(), key=lambda item: item[sort_key], reverse=reverse))
 
-    return obj
+
+def mk_dynamo_record(obj):
+    """
+    Returns a copy of an object that is suitable for writing to Dynamo: floats
+    become decimals, datetimes become ISO strings, None values are dropped
+    from maps and blanked in lists. The input is never modified.
+    """
+    stack = []
+    record = _encode_value(obj, stack)
+    converters = TO_DYNAMO
+    while stack:
+        source, target = stack.pop()
+        if type(target) is dict:
+            pairs = source.items()
+        else:
+            pairs = enumerate(source)
+            target.extend([''] * len(source))
+        for key, value in pairs:
+            encode = converters.get(type(value), _encode_value)
+            if encode is None:
+                if value is not None:
+                    target[key] = value
+                elif type(target) is not dict:
+                    target[key] = ''
+            elif encode is _MAP or encode is _LIST or encode is _encode_value:
+                target[key] = _encode_value(value, stack)
+            else:
+                target[key] = encode(value)
+    return record
 
 
 def mk_key_condition_expression(pk: DynamoPrimaryKey):
@@ -176,6 +801,62 @@ def mk_key_condition_expression(pk: DynamoPrimaryKey):
     return key_condition_expression
 
 
+def mk_projection_expression(attributes: List[str]):
+    """
+    Builds a ProjectionExpression for the given attribute paths, returning the
+    expression and its ExpressionAttributeNames.
+
+    Every path segment is swapped for a #p placeholder, so reserved words
+    (e.g. name, state, zip) are safe. Nested map paths use dots and list
+    elements use brackets, e.g. 'job_scope.chargers.purchased[0]'.
+    """
+    placeholders = {}
+    paths = []
+    for attribute in attributes:
+        segments = []
+        for segment in attribute.split('.'):
+            name, bracket, index = segment.partition('[')
+            if name not in placeholders:
+                placeholders[name] = f'#p{len(placeholders)}'
+            segments.append(f'{placeholders[name]}{bracket}{index}')
+        paths.append('.'.join(segments))
+    return ', '.join(paths), {v: k for k, v in placeholders.items()}
+
+
+def add_projection(args: dict, attributes: Optional[List[str]]) -> dict:
+    """Adds a projection for the given attributes to query, scan or batch get args"""
+    if attributes:
+        projection_expression, names = mk_projection_expression(attributes)
+        args['ProjectionExpression'] = projection_expression
+        args['ExpressionAttributeNames'] = {**args.get('ExpressionAttributeNames', {}), **names}
+    return args
+
+
+def add_filter(args: dict, condition) -> dict:
+    """ANDs a boto3 condition into the FilterExpression of query or scan args"""
+    existing = args.get('FilterExpression')
+    args['FilterExpression'] = condition if existing is None else existing & condition
+    return args
+
+
+def mk_ttl(seconds: float, since: Optional[int] = None) -> int:
+    """
+    Returns the TTL_ATTRIBUTE value for an item that should expire the given
+    number of seconds after since (a millisecond timestamp, default now)
+    """
+    since = since if since is not None else int(time.time() * 1000)
+    return int(since / 1000 + seconds)
+
+
+def not_expired(ttl_attribute=TTL_ATTRIBUTE):
+    """
+    Filter condition for items without a TTL or whose TTL is still ahead.
+    DynamoDB deletes expired items in the background, up to a couple of days
+    late, so reads that must not see them filter them out as well.
+    """
+    return Attr(ttl_attribute).not_exists() | Attr(ttl_attribute).gt(int(time.time()))
+
+
 def mk_fetch_key_condition_expression(pk={}):
     key_condition_expression = None
     for key, value in pk.items():
@@ -199,84 +880,400 @@ def mk_update_expression(update={}):
     return update_expression, expression_attribute_values
 
 
+def mk_diff_update_expression(old: dict, new: dict, exclude=()):
+    """
+    Compares a stored item with its new values and builds an update expression
+    that only touches what changed.
+
+    Changed values are SET by their full path, recursing into maps that exist
+    on both sides, so a single nested field is written without resending its
+    parent. Values explicitly set to None in the new object are REMOVEd.
+    Attributes missing from the new object are left alone. Attributes named in
+    exclude (e.g. the primary key) are never written.
+
+    Returns (update_expression, expression_attribute_names, expression_attribute_values).
+    If nothing changed, update_expression is None.
+    """
+    placeholders, values, sets, removes = {}, {}, [], []
+
+    def mk_path(path):
+        for name in path:
+            if name not in placeholders:
+                placeholders[name] = f'#u{len(placeholders)}'
+        return '.'.join(placeholders[name] for name in path)
+
+    def diff(old, new, path):
+        for name, value in new.items():
+            if not path and name in exclude:
+                continue
+            old_value = old.get(name)
+            if value is None:
+                if old_value is not None:
+                    removes.append(mk_path(path + [name]))
+                continue
+            if isinstance(value, dict) and isinstance(old_value, dict):
+                diff(old_value, value, path + [name])
+                continue
+            record = mk_dynamo_record(value)
+            if record != old_value:
+                value_key = f':u{len(values)}'
+                values[value_key] = record
+                sets.append(f'{mk_path(path + [name])} = {value_key}')
+
+    diff(old or {}, new, [])
+    clauses = []
+    if sets:
+        clauses.append('SET ' + ', '.join(sets))
+    if removes:
+        clauses.append('REMOVE ' + ', '.join(removes))
+    update_expression = ' '.join(clauses) or None
+    logger.info(f'Diff update expression: {update_expression}')
+    return update_expression, {v: k for k, v in placeholders.items()}, values
+
+
 def query_items_with_pk(table, pk: DynamoPrimaryKey, limit=200, cursor_token=None):
     """
     Performs an efficient query operation on the user events table
     to produce a list of results and a 'LastEvaluatedKey' which if set
     can be passed in again to achieve cursor pagination.
     """
-    key_condition_expression = mk_key_condition_expression(pk)
+    return fetch_items_by_pk(table, pk, limit=limit, cursor_token=cursor_token)
 
-    # Note, table.query requires a KeyConditionExpression;
-    # to query everything use db.scan_by_attributes
-    query_args = {
-        'KeyConditionExpression': key_condition_expression,  # Required
+
+def mk_attr_condition_expression(attrs={}):
+    attr_condition_expression = None
+    for attr, value in attrs.items():
+        if not attr_condition_expression:
+            attr_condition_expression = Attr(attr).eq(value)
+            continue
+        attr_condition_expression &= Attr(attr).eq(value)
+    return attr_condition_expression
+
+
+def iter_parallel_scan(table, attrs={}, total_segments=DEFAULT_SCAN_SEGMENTS, page_size=None,
+                       on_progress: Optional[Callable[[ScanProgress], None]] = None, attributes: Optional[List[str]] = None,
+                       fast: bool = False, **kwargs) -> Iterator[dict]:
+    """
+    Scans the whole table using DynamoDB's Segment/TotalSegments, with one
+    worker thread per segment, and yields items as soon as any segment returns
+    a page.
+
+    on_progress, if given, is called with a ScanProgress after every page.
+    Closing the generator early stops the workers after their in-flight page.
+    Pass attributes to only read those attribute paths, and fast to read
+    through the low-level client (see fast_call).
+    """
+    scan_args = add_projection({'TableName': table.name, **kwargs}, attributes)
+    attr_condition_expression = mk_attr_condition_expression(attrs)
+    if attr_condition_expression:
+        scan_args['FilterExpression'] = attr_condition_expression
+    if page_size:
+        scan_args['Limit'] = page_size
+
+    # The low-level client is thread safe where the Table resource is not
+    client = table.meta.client
+    pages = queue.Queue(maxsize=total_segments * 2)
+    stop = threading.Event()
+
+    def put(message):
+        while not stop.is_set():
+            try:
+                pages.put(message, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan_segment(segment):
+        try:
+            segment_args = {**scan_args, 'Segment': segment, 'TotalSegments': total_segments}
+            while not stop.is_set():
+                response = fast_call(table, 'scan', segment_args) if fast else client.scan(**segment_args)
+                put(('page', response.get('Items', []), response.get('ScannedCount', 0)))
+                last_evaluated_key = response.get('LastEvaluatedKey')
+                if not last_evaluated_key:
+                    break
+                segment_args['ExclusiveStartKey'] = last_evaluated_key
+            put(('done', None, 0))
+        except Exception as e:
+            put(('error', e, 0))
+
+    progress = ScanProgress(total_segments=total_segments)
+    executor = ThreadPoolExecutor(max_workers=total_segments)
+    try:
+        for segment in range(total_segments):
+            executor.submit(with_context(scan_segment), segment)
+        while progress.segments_done < total_segments:
+            kind, payload, scanned = pages.get()
+            if kind == 'error':
+                raise payload
+            if kind == 'done':
+                progress.segments_done += 1
+            else:
+                progress.pages += 1
+                progress.items += len(payload)
+                progress.scanned += scanned
+            if on_progress:
+                on_progress(progress)
+            if kind == 'page':
+                yield from payload
+        logger.info(f'Parallel scan of {table.name} returned {progress.items} of {progress.scanned} scanned item(s) in {progress.pages} page(s)')
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+
+def scan_by_attributes(table, attrs={}, limit=200, cursor_token=None, total_segments=None, on_progress=None,
+                       attributes: Optional[List[str]] = None, fast: bool = False):
+    """
+    Similar to fetch_items_by_pk except that it provides the capability
+    to perform a scan on the table by attributes
+
+    If total_segments is given, the whole table is read with a parallel
+    segmented scan (see iter_parallel_scan) and no cursor is returned.
+    Pass attributes to only read those attribute paths, and fast to read
+    through the low-level client (see fast_call).
+    """
+    if total_segments:
+        items = list(iter_parallel_scan(table, attrs, total_segments=total_segments, on_progress=on_progress,
+                                        attributes=attributes, fast=fast))
+        return items, None
+
+    scan_args = {
         'Limit': limit,
     }
+    add_projection(scan_args, attributes)
+    attr_condition_expression = mk_attr_condition_expression(attrs)
+    if attr_condition_expression:
+        scan_args['FilterExpression'] = attr_condition_expression
     if cursor_token:
         decoder_cursor_token = decode_token_to_key(cursor_token)
-        query_args['ExclusiveStartKey'] = decoder_cursor_token
+        scan_args['ExclusiveStartKey'] = decoder_cursor_token
 
-    response = table.query(**query_args)
+    response = fast_call(table, 'scan', scan_args) if fast else table.scan(**scan_args)
     response_last_evaluated_key = response.get('LastEvaluatedKey')
     encoded_cursor_token = None
 
     if response_last_evaluated_key:
         encoded_cursor_token = encode_key_as_token(response_last_evaluated_key)
-
     items = response['Items']
-    logger.info(f'Dynamo response items from pk: {items},\n with encoded cursor:{encoded_cursor_token}')
     return items, encoded_cursor_token
 
 
-def scan_by_attributes(table, attrs={}, limit=200, cursor_token=None):
-        """
-        Similar to fetch_items_by_pk except that it provides the capability
-        to perform a scan on the table by attributes
-        """
-        attr_condition_expression = None
-        for attr, value in attrs.items():
-            if not attr_condition_expression:
-                attr_condition_expression = Attr(attr).eq(value)
-                continue
-            attr_condition_expression &= Attr(attr).eq(value)
-
-        scan_args = {
-            'Limit': limit,
-        }
-        if attr_condition_expression:
-            scan_args['FilterExpression'] = attr_condition_expression
-        if cursor_token:
-            decoder_cursor_token = decode_token_to_key(cursor_token)
-            scan_args['ExclusiveStartKey'] = decoder_cursor_token
-
-        response = table.scan(**scan_args)
-        response_last_evaluated_key = response.get('LastEvaluatedKey')
-        encoded_cursor_token = None
-        
-        if response_last_evaluated_key:
-            encoded_cursor_token = encode_key_as_token(response_last_evaluated_key)
-        items = response['Items']
-        return items, encoded_cursor_token
-
-
-def update_dynamo_record(table, pk={}, update={}):
+def update_dynamo_record(table, pk={}, update={}, old: Optional[dict] = None):
     """
     Updates an existing item in dynamo
+
+    If the currently stored item is passed as old, only the attributes that
+    differ from it are written (see mk_diff_update_expression), and no request
+    is made at all when nothing changed.
     """
+    if old is not None:
+        update_expression, expression_attribute_names, expression_attribute_values = mk_diff_update_expression(
+            old, update, exclude=pk.keys())
+        if not update_expression:
+            logger.info(f'No changes to update for {pk}')
+            return None
+        update_args = {
+            'Key': pk,
+            'UpdateExpression': update_expression,
+            'ExpressionAttributeNames': expression_attribute_names,
+        }
+        if expression_attribute_values:
+            update_args['ExpressionAttributeValues'] = expression_attribute_values
+        try:
+            resp = table.update_item(**update_args)
+        finally:
+            invalidate_cached_item(table, pk)
+        logger.info(f'Dynamo response {resp}')
+        return resp
     if update is not None:
         record = mk_dynamo_record(update)
         update_expression, expression_attribute_values = mk_update_expression(record)
         logger.info(f'Updating record {record}')
-    resp = table.update_item(
-        Key=pk,
-        UpdateExpression=update_expression,
-        ExpressionAttributeValues=expression_attribute_values
-    )
+    try:
+        resp = table.update_item(
+            Key=pk,
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=expression_attribute_values
+        )
+    finally:
+        invalidate_cached_item(table, pk)
     logger.info(f'Dynamo response {resp}')
     return resp
 
 
+def mk_versioned_update(pk: dict, current: dict, new: dict, version_attribute=VERSION_ATTRIBUTE) -> Optional[dict]:
+    """
+    Builds the UpdateItem arguments that turn current into new under optimistic
+    locking: only the changed attributes are written, the version is bumped and
+    the write is conditional on the stored version still being current's.
+    Items written before versioning have no version attribute and count as
+    version 0. Returns None if nothing changed.
+    """
+    version = int(current.get(version_attribute) or 0)
+    update_expression, names, values = mk_diff_update_expression(
+        current, new, exclude=[*pk.keys(), version_attribute])
+    if not update_expression:
+        return None
+
+    version_set = '#ver = :ver_next'
+    if update_expression.startswith('SET '):
+        update_expression = f'SET {version_set}, {update_expression[4:]}'
+    else:
+        update_expression = f'SET {version_set} {update_expression}'
+    names['#ver'] = version_attribute
+    values[':ver_next'] = version + 1
+    if version:
+        condition_expression = '#ver = :ver'
+        values[':ver'] = version
+    else:
+        condition_expression = 'attribute_not_exists(#ver)'
+    return {
+        'Key': pk,
+        'UpdateExpression': update_expression,
+        'ConditionExpression': condition_expression,
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+    }
+
+
+def update_versioned_dynamo_record(table, pk: dict, apply: Callable[[dict], dict], current: Optional[dict] = None,
+                                   version_attribute=VERSION_ATTRIBUTE, max_retries=CONDITIONAL_MAX_RETRIES) -> dict:
+    """
+    Applies a change to an item with optimistic locking on a version attribute
+    (see mk_versioned_update).
+
+    apply is called with the stored item and returns the full new item. If the
+    caller already holds the item it can be passed as current and the common
+    case is a single write; after a conflict the item is re-read and apply
+    runs again.
+
+    Returns the new item, or the stored one if apply changed nothing. Raises
+    ConditionalWriteConflict if the item is gone or still contended after
+    max_retries.
+    """
+    for attempt in range(max_retries + 1):
+        if current is None:
+            current = table.get_item(Key=pk, ConsistentRead=True).get('Item')
+            if current is None:
+                raise ConditionalWriteConflict(f'No item found for {pk}')
+        new = apply(dict(current))
+        update_args = mk_versioned_update(pk, current, new, version_attribute=version_attribute)
+        if not update_args:
+            logger.info(f'No changes to update for {pk}')
+            return current
+        try:
+            table.update_item(**update_args)
+            new[version_attribute] = update_args['ExpressionAttributeValues'][':ver_next']
+            return new
+        except ClientError as e:
+            if not is_conditional_check_failure(e):
+                raise
+            logger.info(f'{pk} changed since it was read (attempt {attempt + 1})')
+            current = None
+            if attempt < max_retries:
+                backoff(attempt)
+        finally:
+            invalidate_cached_item(table, pk)
+    raise ConditionalWriteConflict(f'Gave up updating {pk} after {max_retries} conflicting writes')
+
+
+class DynamoTransaction:
+    """
+    Collects puts, updates, deletes and condition checks, across any number of
+    tables, and commits them atomically with a single TransactWriteItems call:
+    either every write is applied or none is.
+
+    put has the same (table, obj) signature as create_dynamo_record, so helpers
+    can take an optional transaction and stage their writes into it instead of
+    writing straight away.
+    """
+    def __init__(self):
+        self.items = []
+        self.written = []
+        self.client = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def _add(self, table, action: str, op: dict, condition=None):
+        op['TableName'] = table.name
+        if condition is not None:
+            built = ConditionExpressionBuilder().build_expression(condition)
+            op['ConditionExpression'] = built.condition_expression
+            op.setdefault('ExpressionAttributeNames', {}).update(built.attribute_name_placeholders)
+            if built.attribute_value_placeholders:
+                op.setdefault('ExpressionAttributeValues', {}).update(built.attribute_value_placeholders)
+        if len(self.items) >= TRANSACT_MAX_ITEMS:
+            raise ValueError(f'A transaction can hold at most {TRANSACT_MAX_ITEMS} items')
+        self.client = self.client or table.meta.client
+        self.items.append({action: op})
+        if action != 'ConditionCheck':
+            self.written.append((table, op.get('Key') or op['Item']))
+
+    def put(self, table, obj, condition=None):
+        self._add(table, 'Put', {'Item': mk_dynamo_record(obj)}, condition)
+
+    def update(self, table, pk: dict, update: dict, condition=None, increment: Optional[dict] = None):
+        """Stages a SET of every non-None attribute in update, and an ADD of each amount in increment"""
+        update_expression, names, values = mk_diff_update_expression({}, update, exclude=pk.keys())
+        clauses = [update_expression] if update_expression else []
+        adds = []
+        for i, (name, amount) in enumerate((increment or {}).items()):
+            names[f'#a{i}'] = name
+            values[f':a{i}'] = mk_dynamo_record(amount)
+            adds.append(f'#a{i} :a{i}')
+        if adds:
+            clauses.append('ADD ' + ', '.join(adds))
+        if not clauses:
+            return
+        op = {'Key': pk, 'UpdateExpression': ' '.join(clauses), 'ExpressionAttributeNames': names}
+        if values:
+            op['ExpressionAttributeValues'] = values
+        self._add(table, 'Update', op, condition)
+
+    def update_versioned(self, table, pk: dict, current: dict, new: dict, version_attribute=VERSION_ATTRIBUTE):
+        """
+        Stages an optimistically locked update (see mk_versioned_update).
+        Returns the version the item will have, or None if nothing changed.
+        """
+        update_args = mk_versioned_update(pk, current, new, version_attribute=version_attribute)
+        if not update_args:
+            return None
+        self._add(table, 'Update', update_args)
+        return update_args['ExpressionAttributeValues'][':ver_next']
+
+    def delete(self, table, pk: dict, condition=None):
+        self._add(table, 'Delete', {'Key': pk}, condition)
+
+    def condition_check(self, table, pk: dict, condition):
+        """Makes the whole transaction conditional on an item nobody writes"""
+        self._add(table, 'ConditionCheck', {'Key': pk}, condition)
+
+    def commit(self, client_request_token: Optional[str] = None):
+        """
+        Writes everything staged so far. A client_request_token makes retries of
+        the same commit idempotent. Raises TransactionCancelled, carrying the
+        per-item CancellationReasons, if any condition failed or an item conflicted
+        with another transaction.
+        """
+        if not self.items:
+            return None
+        args = {'TransactItems': self.items}
+        if client_request_token:
+            args['ClientRequestToken'] = client_request_token
+        logger.info(f'Committing transaction of {len(self.items)} items')
+        try:
+            return self.client.transact_write_items(**args)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'TransactionCanceledException':
+                raise TransactionCancelled(str(e), reasons=e.response.get('CancellationReasons', [])) from e
+            raise
+        finally:
+            for table, key in self.written:
+                invalidate_cached_item(table, key)
+
+
 def delete_dynamo_record(table, pk={}, update={}):
     """
     Deletes a record from dynamo
@@ -287,40 +1284,20 @@ def delete_dynamo_record(table, pk={}, update={}):
     #     record = mk_dynamo_record(update)
     #     update_expression, expression_attribute_values = mk_update_expression(record)
     #     logger.info(f'Deleting record {record}')
-    return table.delete_item(
-        Key=pk,
-        # UpdateExpression=update_expression,
-        # ExpressionAttributeValues=expression_attribute_values
-    )
+    try:
+        return table.delete_item(
+            Key=pk,
+            # UpdateExpression=update_expression,
+            # ExpressionAttributeValues=expression_attribute_values
+        )
+    finally:
+        invalidate_cached_item(table, pk)
 
 
-def fetch_items_by_gsi(table, pk: DynamoPrimaryKey, indexName, limit=200,  cursor_token=None):
+def fetch_items_by_gsi(table, pk: DynamoPrimaryKey, indexName, limit=200,  cursor_token=None, attributes: Optional[List[str]] = None):
     """
     Performs an efficient query operation on the user events table
     to produce a list of results and a 'LastEvaluatedKey' which if set
     can be passed in again to achieve cursor pagination.
     """
-    key_condition_expression = mk_key_condition_expression(pk)
-
-    # Note, table.query requires a KeyConditionExpression;
-    # to query everything use db.scan_by_attributes
-    query_args = {
-        'KeyConditionExpression': key_condition_expression,  # Required
-        'IndexName': indexName,
-        'Limit': limit,
-    }
-    if cursor_token:
-        decoder_cursor_token = decode_token_to_key(cursor_token)
-        query_args['ExclusiveStartKey'] = decoder_cursor_token
-
-    response = table.query(**query_args)
-    response_last_evaluated_key = response.get('LastEvaluatedKey')
-    encoded_cursor_token = None
-
-    if response_last_evaluated_key:
-        encoded_cursor_token = encode_key_as_token(response_last_evaluated_key)
-
-    items = response['Items']
-    logger.info(
-        f'Dynamo response items from pk: {items},\n with encoded cursor:{encoded_cursor_token}')
-    return items, encoded_cursor_token
+    return fetch_items_by_pk(table, pk, limit=limit, cursor_token=cursor_token, attributes=attributes, IndexName=indexName)
@@ -0,0 +1,238 @@
+"""
+Opt-in consumed capacity and latency metrics for DynamoDB calls.
+
+instrument_dynamodb hooks into botocore's event system, so every call made
+through an instrumented session, resource or client is measured, including
+the ones made by the helpers in rctools.aws.dynamodb. Nothing is recorded and
+ReturnConsumedCapacity is not requested unless the call happens inside
+collect_dynamodb_metrics, which the API middleware opens for each request:
+
+    instrument_dynamodb()  # before any clients are created
+    with collect_dynamodb_metrics() as metrics:
+        ...
+    log_dynamodb_metrics(metrics, path='/jobs')
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import boto3
+from pydantic import BaseModel
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+METRICS_NAMESPACE = 'ReadiCharge/DynamoDB'
+READ_OPERATIONS = {'GetItem', 'Query', 'Scan', 'BatchGetItem', 'TransactGetItems'}
+PAGED_OPERATIONS = {'Query', 'Scan'}
+
+_current_metrics: contextvars.ContextVar = contextvars.ContextVar('dynamodb_metrics', default=None)
+
+
+class TableMetrics(BaseModel):
+    """Totals for one table, or one index of a table, within a request"""
+    table: str
+    index: Optional[str]
+    calls: int = 0
+    pages: int = 0
+    items: int = 0
+    scanned: int = 0
+    rcu: float = 0
+    wcu: float = 0
+    seconds: float = 0
+    max_seconds: float = 0
+    operations: Dict[str, int] = {}
+
+
+class RequestMetrics:
+    """Thread-safe accumulator for the DynamoDB calls made during one request"""
+    def __init__(self):
+        self.tables: Dict[Tuple[str, Optional[str]], TableMetrics] = {}
+        self.calls = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _entry(self, table: str, index: Optional[str] = None) -> TableMetrics:
+        key = (table, index)
+        if key not in self.tables:
+            self.tables[key] = TableMetrics(table=table, index=index)
+        return self.tables[key]
+
+    def record(self, operation: str, params: dict, parsed: dict, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+            for table, index, items, scanned in _call_targets(operation, params, parsed):
+                entry = self._entry(table, index)
+                entry.calls += 1
+                entry.pages += operation in PAGED_OPERATIONS
+                entry.items += items
+                entry.scanned += scanned
+                entry.seconds += seconds
+                entry.max_seconds = max(entry.max_seconds, seconds)
+                entry.operations[operation] = entry.operations.get(operation, 0) + 1
+            for capacity in _as_list(parsed.get('ConsumedCapacity')):
+                self._add_capacity(operation, capacity)
+
+    def _add_capacity(self, operation: str, capacity: dict):
+        table = capacity.get('TableName')
+        if not table:
+            return
+        is_read = operation in READ_OPERATIONS
+        # With INDEXES the table and each index are reported separately, otherwise only the total
+        parts = [(None, capacity.get('Table', capacity))]
+        for group in ('GlobalSecondaryIndexes', 'LocalSecondaryIndexes'):
+            parts += list(capacity.get(group, {}).items())
+        for index, units in parts:
+            entry = self._entry(table, index)
+            entry.rcu += units.get('ReadCapacityUnits', units.get('CapacityUnits', 0) if is_read else 0)
+            entry.wcu += units.get('WriteCapacityUnits', 0 if is_read else units.get('CapacityUnits', 0))
+
+    def summary(self) -> dict:
+        """Plain dict of the totals, suitable for attaching to a log line"""
+        with self._lock:
+            tables = [t.dict() for t in self.tables.values()]
+            return {
+                'calls': self.calls,
+                'seconds': round(self.seconds, 4),
+                'rcu': sum(t['rcu'] for t in tables),
+                'wcu': sum(t['wcu'] for t in tables),
+                'tables': tables,
+            }
+
+    def to_emf(self, namespace: str = METRICS_NAMESPACE, dimensions: Optional[Dict[str, str]] = None) -> List[dict]:
+        """
+        Returns one CloudWatch embedded metric format document per table/index,
+        which CloudWatch turns into metrics when it is logged from a Lambda
+        """
+        dimensions = dimensions or {}
+        documents = []
+        for entry in self.summary()['tables']:
+            entry_dimensions = {**dimensions, 'Table': entry['table'], 'Index': entry['index'] or '-'}
+            metrics = {
+                'Calls': entry['calls'], 'Pages': entry['pages'], 'Items': entry['items'], 'ScannedItems': entry['scanned'],
+                'RCU': entry['rcu'], 'WCU': entry['wcu'], 'Latency': round(entry['seconds'] * 1000, 2),
+            }
+            documents.append({
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [list(entry_dimensions.keys())],
+                        'Metrics': [{'Name': name, 'Unit': 'Milliseconds' if name == 'Latency' else 'Count'}
+                                    for name in metrics],
+                    }],
+                },
+                **entry_dimensions,
+                **metrics,
+            })
+        return documents
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _call_targets(operation: str, params: dict, parsed: dict):
+    """Yields (table, index, items, scanned) for each table a call touched"""
+    if operation in ('BatchGetItem', 'BatchWriteItem'):
+        responses = parsed.get('Responses', {})
+        unprocessed = parsed.get('UnprocessedItems', {})
+        for table, request in params.get('RequestItems', {}).items():
+            if operation == 'BatchGetItem':
+                items = len(responses.get(table, []))
+            else:
+                items = len(request) - len(unprocessed.get(table, []))
+            yield table, None, items, 0
+    elif operation in ('TransactWriteItems', 'TransactGetItems'):
+        counts = {}
+        for item in params.get('TransactItems', []):
+            (op,) = item.values()
+            counts[op['TableName']] = counts.get(op['TableName'], 0) + 1
+        for table, items in counts.items():
+            yield table, None, items, 0
+    elif 'TableName' in params:
+        if 'Count' in parsed:
+            items, scanned = parsed['Count'], parsed.get('ScannedCount', parsed['Count'])
+        else:
+            items, scanned = int('Item' in parsed or operation not in READ_OPERATIONS), 0
+        yield params['TableName'], params.get('IndexName'), items, scanned
+
+
+def current_dynamodb_metrics() -> Optional[RequestMetrics]:
+    return _current_metrics.get()
+
+
+@contextmanager
+def collect_dynamodb_metrics():
+    """Records the DynamoDB calls made inside the block (and in threads started with with_context)"""
+    metrics = RequestMetrics()
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def with_context(fn):
+    """
+    Wraps fn so that it runs in a copy of the caller's context, so calls made
+    from worker threads are still recorded against the caller's request
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def _start_call(params, model, context, **kwargs):
+    if _current_metrics.get() is None:
+        return
+    if 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'INDEXES')
+    context['rctools_metrics_params'] = params
+    context['rctools_metrics_started'] = time.monotonic()
+
+
+def _record_call(parsed, model, context, **kwargs):
+    metrics = _current_metrics.get()
+    if metrics is None or 'rctools_metrics_started' not in context:
+        return
+    seconds = time.monotonic() - context['rctools_metrics_started']
+    metrics.record(model.name, context.get('rctools_metrics_params', {}), parsed or {}, seconds)
+
+
+def instrument_dynamodb(target=None):
+    """
+    Registers the metrics hooks on a boto3 Session, resource or client, or on
+    the default session if no target is given. Clients only pick up hooks that
+    were registered on their session before they were created.
+    """
+    if target is None:
+        target = boto3._get_default_session()
+    if hasattr(target, 'events'):
+        events = target.events
+    elif hasattr(target.meta, 'events'):
+        events = target.meta.events
+    else:
+        events = target.meta.client.meta.events
+    events.register('provide-client-params.dynamodb', _start_call, unique_id='rctools-metrics-start')
+    events.register('after-call.dynamodb', _record_call, unique_id='rctools-metrics-record')
+    return target
+
+
+def log_dynamodb_metrics(metrics: RequestMetrics, emit: bool = True, **labels):
+    """
+    Logs the request summary alongside the given labels (e.g. method and path)
+    and, with emit, the embedded metric documents dimensioned by those labels
+    """
+    if not metrics.calls:
+        return
+    logger.info(json.dumps({'dynamodb': metrics.summary(), **labels}))
+    if emit:
+        for document in metrics.to_emf(dimensions={k: str(v) for k, v in labels.items()}):
+            print(json.dumps(document))
@@ -1,15 +1,165 @@
-"""Helper methods for reading and writing to S3"""
+"""
+Helper methods for reading and writing to S3
+
+JSON documents that are read on most requests can be kept in an in-process
+cache with get_object_from_s3(..., cache=True). Cached documents are stored
+with their ETag, and later reads send If-None-Match so an unchanged document
+costs a 304 instead of a download and a parse. Within max_age seconds of the
+last check a cached document is returned without any request, which suits
+documents that never change in place, like zips/*.min.json. Writes through
+put_object_into_s3 and write_to_s3 drop the written key from the cache.
+
+update_object_in_s3 changes a document with If-Match writes on its ETag, so
+concurrent updates are retried instead of overwriting each other.
+"""
+import copy
 import json
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from botocore.exceptions import ClientError
+from pydantic import BaseModel
+
+from rctools.aws.dynamodb import backoff
+from rctools.aws.metrics import with_context
+from rctools.exceptions import ConditionalWriteConflict
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Concurrent GETs for get_objects_from_s3, at most botocore's default connection pool size
+DEFAULT_FETCH_WORKERS = 10
+DEFAULT_OBJECT_CACHE_MAX_ITEMS = 512
+# Attempts update_object_in_s3 makes before giving up on a contended document
+CONDITIONAL_PUT_MAX_RETRIES = 5
+PRECONDITION_ERROR_CODES = {'PreconditionFailed', 'ConditionalRequestConflict', '412', '409'}
+
+
+class ObjectCacheStats(BaseModel):
+    """Counters for the S3 object cache"""
+    hits: int = 0  # served within max_age without a request
+    not_modified: int = 0  # revalidated with a 304
+    misses: int = 0  # downloaded, including changed documents
+    evictions: int = 0
+    invalidations: int = 0
+
+
+def _copy_json(value):
+    """Copies parsed JSON, much faster than copy.deepcopy since only dicts and lists need copying"""
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
+
+def is_precondition_failure(err: ClientError) -> bool:
+    """True for If-Match / If-None-Match writes that lost to another write"""
+    return err.response.get('Error', {}).get('Code') in PRECONDITION_ERROR_CODES
+
+
+def is_not_modified(err: ClientError) -> bool:
+    return (err.response.get('Error', {}).get('Code') in ('304', 'NotModified')
+            or err.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304)
+
+
+class ObjectCache:
+    """Thread-safe LRU of parsed S3 JSON documents and their ETags"""
+    def __init__(self, max_items=DEFAULT_OBJECT_CACHE_MAX_ITEMS):
+        self.max_items = max_items
+        # (bucket, key) -> (etag, document, monotonic time it was last known current)
+        self._items: OrderedDict = OrderedDict()
+        self._stats = ObjectCacheStats()
+        self._lock = threading.Lock()
+
+    def get(self, s3_client, bucket: str, key: str, max_age: float = 0):
+        """
+        Returns a copy of the document, checking it with a conditional GET once
+        it is older than max_age. ClientErrors other than a 304 are raised.
+        """
+        return self.get_with_etag(s3_client, bucket, key, max_age=max_age)[1]
+
+    def get_with_etag(self, s3_client, bucket: str, key: str, max_age: float = 0) -> Tuple[Optional[str], Any]:
+        """Same as get, also returning the document's ETag"""
+        cache_key = (bucket, key)
+        with self._lock:
+            entry = self._items.get(cache_key)
+            if entry is not None:
+                self._items.move_to_end(cache_key)
+                if time.monotonic() - entry[2] < max_age:
+                    self._stats.hits += 1
+                    return entry[0], _copy_json(entry[1])
+
+        args = {'Bucket': bucket, 'Key': key}
+        if entry is not None:
+            args['IfNoneMatch'] = entry[0]
+        checked = time.monotonic()
+        try:
+            obj = s3_client.get_object(**args)
+        except ClientError as e:
+            if entry is not None and is_not_modified(e):
+                self._store(cache_key, entry[0], entry[1], checked, not_modified=True)
+                return entry[0], _copy_json(entry[1])
+            self.invalidate(bucket, key)
+            raise
+        document = json.loads(obj['Body'].read().decode('utf-8'))
+        self._store(cache_key, obj.get('ETag'), document, checked)
+        return obj.get('ETag'), _copy_json(document)
+
+    def put(self, bucket: str, key: str, etag: str, document):
+        """Caches a copy of a document this process just wrote, saving the next read a download"""
+        with self._lock:
+            self._items[(bucket, key)] = (etag, _copy_json(document), time.monotonic())
+            self._items.move_to_end((bucket, key))
+            self._evict()
+
+    def invalidate(self, bucket: str, key: str):
+        with self._lock:
+            if self._items.pop((bucket, key), None) is not None:
+                self._stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> ObjectCacheStats:
+        with self._lock:
+            return self._stats.copy()
+
+    def _store(self, cache_key: Tuple[str, str], etag: Optional[str], document, checked: float, not_modified=False):
+        with self._lock:
+            if not_modified:
+                self._stats.not_modified += 1
+            else:
+                self._stats.misses += 1
+            if not etag:
+                return
+            self._items[cache_key] = (etag, document, checked)
+            self._items.move_to_end(cache_key)
+            self._evict()
+
+    def _evict(self):
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+            self._stats.evictions += 1
+
 
-def get_object_from_s3(s3_client, bucket, key, default=None):
+object_cache = ObjectCache()
+
+
+def get_object_from_s3(s3_client, bucket, key, default=None, cache: bool = False, max_age: float = 0):
+    """
+    Returns the parsed JSON document at key, or default if it can't be read.
+    With cache, the document is kept in object_cache and revalidated by ETag
+    once it is more than max_age seconds old.
+    """
     try:
+        if cache:
+            return object_cache.get(s3_client, bucket, key, max_age=max_age)
         obj = s3_client.get_object(
             Bucket=bucket,
             Key=key
@@ -22,6 +172,75 @@ def get_object_from_s3(s3_client, bucket, key, default=None):
             return default
 
 
+def get_objects_from_s3(s3_client, bucket, keys: List[str], default=None, cache: bool = False, max_age: float = 0,
+                        max_workers=DEFAULT_FETCH_WORKERS) -> Dict[str, Any]:
+    """
+    Fetches many JSON objects at once with get_object_from_s3, so N objects
+    take about as long as the slowest GET instead of N GETs back to back.
+
+    Returns the objects keyed by S3 key, in the order of keys. Keys that are
+    missing or fail to load map to their own copy of default, so callers can
+    modify one without affecting the others. cache and max_age are passed on
+    to get_object_from_s3.
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+
+    def get(key):
+        obj = get_object_from_s3(s3_client, bucket, key, default, cache=cache, max_age=max_age)
+        return copy.deepcopy(default) if obj is default else obj
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        objects = dict(zip(keys, executor.map(with_context(get), keys)))
+    logger.info(f'Fetched {len(keys)} object(s) from bucket {bucket}')
+    return objects
+
+
+def update_object_in_s3(s3_client, bucket, key, apply: Callable[[Any], Any], default=None,
+                        max_retries=CONDITIONAL_PUT_MAX_RETRIES):
+    """
+    Read-modify-write of a JSON document that can't lose concurrent updates.
+
+    apply is called with a copy of the stored document, or default if it
+    can't be read, and returns the new document. It is written with If-Match on
+    the ETag that was read (If-None-Match: * for a new document), so if
+    another write got there first S3 refuses it, and the document is re-read
+    and apply runs again after a jittered backoff. Reads go through
+    object_cache, so an unchanged document isn't downloaded again, and the
+    written document is cached with its new ETag.
+
+    Returns the new document. Raises ConditionalWriteConflict if the document
+    is still contended after max_retries.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            etag, current = object_cache.get_with_etag(s3_client, bucket, key)
+        except ClientError as e:
+            # Missing keys read as AccessDenied without s3:ListBucket. Either way the document is
+            # treated as new, which is safe since If-None-Match: * fails if it does exist.
+            logger.info(f'Could not read {key} from bucket {bucket} ({e.response.get("Error", {}).get("Code")}), creating it')
+            etag, current = None, copy.deepcopy(default)
+        new = apply(current)
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        try:
+            response = s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(new), **condition)
+        except ClientError as e:
+            object_cache.invalidate(bucket, key)
+            if not is_precondition_failure(e):
+                raise
+            logger.info(f'{key} in bucket {bucket} changed since it was read (attempt {attempt + 1})')
+            if attempt < max_retries:
+                backoff(attempt)
+            continue
+        if response.get('ETag'):
+            object_cache.put(bucket, key, response['ETag'], new)
+        else:
+            object_cache.invalidate(bucket, key)
+        return new
+    raise ConditionalWriteConflict(f'Gave up updating {key} in bucket {bucket} after {max_retries} conflicting writes')
+
+
 def list_folders_in_s3(s3_client, bucket, prefix=''):
     """Lists the folders at a given level (prefix) in S3"""
     folders = []
@@ -58,12 +277,51 @@ def put_object_into_s3(s3_client, bucket, key, obj):
         return resp
     except ClientError:
         logger.exception(f'Error putting object {key} into bucket {bucket}')
+    finally:
+        object_cache.invalidate(bucket, key)
 
 
 def write_to_s3(s3_client, bucket, key, body):
-    return s3_client.put_object(
+    try:
+        return s3_client.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps(body, indent=4, sort_keys=True, default=str)
+        )
+    finally:
+        object_cache.invalidate(bucket, key)
+
+
+def create_presigned_post(s3_client, bucket, key, content_type: str, max_bytes: int, expiration: int) -> dict:
+    """
+    Returns the url and form fields for a browser-style POST of one file
+    straight to key. S3 rejects the upload unless it has the given
+    Content-Type and is at most max_bytes long.
+    """
+    return s3_client.generate_presigned_post(
         Bucket=bucket,
         Key=key,
-        Body=json.dumps(body, indent=4, sort_keys=True, default=str)
+        Fields={'Content-Type': content_type},
+        Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_bytes]],
+        ExpiresIn=expiration
     )
 
+
+def create_presigned_get_url(s3_client, bucket, key, expiration: int) -> str:
+    """Returns a URL anyone can GET the object with until it expires. Signing is local, no request is made"""
+    return s3_client.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=expiration)
+
+
+def head_object_in_s3(s3_client, bucket, key) -> Optional[dict]:
+    """Returns the object's metadata (ContentLength, ContentType, ETag, ...) or None if there is no such object"""
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def object_cache_stats() -> ObjectCacheStats:
+    """Hit, 304, download, eviction and invalidation counts of the S3 object cache"""
+    return object_cache.stats()
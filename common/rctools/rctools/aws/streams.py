@@ -0,0 +1,247 @@
+"""
+Framework for Lambda handlers that consume DynamoDB Streams and keep derived
+views (dashboard counts, job counts per installer, conversation previews, ...)
+up to date, so read paths don't have to scan the base tables.
+
+Projectors are registered per source table and event name:
+
+    streams = StreamRouter('dashboard', checkpoint_table=dynamodb.Table(STREAM_CHECKPOINTS_TABLE))
+
+    @streams.projector(JOBS_TABLE, events=[INSERT])
+    def count_new_jobs(record: StreamRecord, view: ViewBatch):
+        view.increment(counts_table, {'id': 'jobs', 'ts': 0}, total=1)
+
+    def handler(event, context):
+        return streams.handle(event)
+
+Projectors only stage writes on the ViewBatch, which coalesces them per view
+item: increments are summed, and puts and deletes replace what came before.
+The writes are committed with TransactWriteItems together with a checkpoint
+for each source item, holding the last sequence number applied to it. Records
+at or below their item's checkpoint are skipped, so a retried batch never
+applies a record twice.
+"""
+import json
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel
+
+from rctools.aws.dynamodb import TRANSACT_MAX_ITEMS, Attr, DynamoTransaction, batch_get, decode_item
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+INSERT = 'INSERT'
+MODIFY = 'MODIFY'
+REMOVE = 'REMOVE'
+STREAM_EVENTS = (INSERT, MODIFY, REMOVE)
+
+# Checkpoints live under a fixed sort key, one item per consumer and source item
+CHECKPOINT_TS = 0
+# Sequence numbers are digit strings of varying length; padding them makes string order numeric order
+SEQUENCE_NUMBER_DIGITS = 40
+
+
+class StreamRecord(BaseModel):
+    """A DynamoDB stream record with its key and images decoded (see decode_item)"""
+    event_id: str
+    event_name: str
+    table: str
+    key: dict
+    new_image: Optional[dict]
+    old_image: Optional[dict]
+    sequence_number: str
+
+    @classmethod
+    def from_event(cls, record: dict) -> 'StreamRecord':
+        change = record['dynamodb']
+        return cls(
+            event_id=record['eventID'],
+            event_name=record['eventName'],
+            table=table_name_from_arn(record['eventSourceARN']),
+            key=decode_item(change['Keys']),
+            new_image=decode_item(change['NewImage']) if 'NewImage' in change else None,
+            old_image=decode_item(change['OldImage']) if 'OldImage' in change else None,
+            sequence_number=change['SequenceNumber'],
+        )
+
+    @property
+    def image(self) -> dict:
+        """The item after the change, or before it for a REMOVE"""
+        return self.new_image or self.old_image or self.key
+
+
+def table_name_from_arn(arn: str) -> str:
+    """arn:aws:dynamodb:<region>:<account>:table/<name>/stream/<label> -> <name>"""
+    return arn.split(':', 5)[5].split('/')[1]
+
+
+def _item_key(key: dict) -> tuple:
+    return tuple(sorted(key.items()))
+
+
+class ViewBatch:
+    """Writes to derived-view tables staged by projectors, coalesced per view item"""
+    def __init__(self):
+        self.ops: Dict[tuple, dict] = {}
+        self.tables = {}
+
+    def __len__(self):
+        return len(self.ops)
+
+    def _op(self, table, key: dict) -> tuple:
+        self.tables[table.name] = table
+        return table.name, _item_key(key)
+
+    def put(self, table, key: dict, item: dict):
+        """Replaces the view item stored under key"""
+        self.ops[self._op(table, key)] = {'action': 'put', 'key': key, 'item': {**item, **key}}
+
+    def delete(self, table, key: dict):
+        self.ops[self._op(table, key)] = {'action': 'delete', 'key': key}
+
+    def _updatable(self, table, key: dict) -> dict:
+        """The staged write that further changes to the view item are folded into"""
+        op_key = self._op(table, key)
+        op = self.ops.get(op_key)
+        if op is None:
+            op = self.ops[op_key] = {'action': 'update', 'key': key, 'set': {}, 'add': {}}
+        elif op['action'] == 'delete':
+            # The item is deleted first, so changing it afterwards starts a new one
+            op = self.ops[op_key] = {'action': 'put', 'key': key, 'item': dict(key)}
+        return op
+
+    def update(self, table, key: dict, **attributes):
+        """Sets attributes on the view item, leaving the rest of it alone"""
+        op = self._updatable(table, key)
+        if op['action'] == 'put':
+            op['item'].update(attributes)
+            return
+        for name, value in attributes.items():
+            op['add'].pop(name, None)
+            op['set'][name] = value
+
+    def increment(self, table, key: dict, **amounts):
+        """Adds to numeric attributes of the view item, creating it if needed"""
+        op = self._updatable(table, key)
+        for name, amount in amounts.items():
+            if op['action'] == 'put':
+                op['item'][name] = op['item'].get(name, 0) + amount
+            elif name in op['set']:
+                op['set'][name] += amount
+            else:
+                op['add'][name] = op['add'].get(name, 0) + amount
+
+    def merge(self, other: 'ViewBatch'):
+        """Applies another batch's writes on top of this one's"""
+        for (table_name, _), op in other.ops.items():
+            table = other.tables[table_name]
+            if op['action'] == 'put':
+                self.put(table, op['key'], op['item'])
+            elif op['action'] == 'delete':
+                self.delete(table, op['key'])
+            else:
+                self.update(table, op['key'], **op['set'])
+                self.increment(table, op['key'], **op['add'])
+
+    def stage(self, transaction: DynamoTransaction):
+        for (table_name, _), op in self.ops.items():
+            table = self.tables[table_name]
+            if op['action'] == 'put':
+                transaction.put(table, op['item'])
+            elif op['action'] == 'delete':
+                transaction.delete(table, op['key'])
+            else:
+                transaction.update(table, op['key'], op['set'], increment=op['add'])
+
+
+class StreamRouter:
+    """
+    Routes stream records to the projectors registered for their table and
+    event, and commits what they stage with per-item checkpoints under name
+    """
+    def __init__(self, name: str, checkpoint_table):
+        self.name = name
+        self.checkpoint_table = checkpoint_table
+        self.projectors: Dict[tuple, List[Callable]] = {}
+
+    def projector(self, table_name: str, events: Iterable[str] = STREAM_EVENTS):
+        """Registers the decorated function(record, view) for the table's events"""
+        def register(fn: Callable[[StreamRecord, ViewBatch], None]):
+            for event in events:
+                self.projectors.setdefault((table_name, event), []).append(fn)
+            return fn
+        return register
+
+    def checkpoint_key(self, record: StreamRecord) -> dict:
+        key = json.dumps(record.key, sort_keys=True, default=str)
+        return {'id': f'{self.name}#{record.table}#{key}', 'ts': CHECKPOINT_TS}
+
+    def _unapplied(self, records: List[StreamRecord]) -> List[StreamRecord]:
+        """Drops the records at or below their item's checkpoint, i.e. already applied"""
+        keys = [self.checkpoint_key(r) for r in records]
+        checkpoints = {c['id']: c['sequence_number'] for c in batch_get(self.checkpoint_table, keys)}
+        pending = [r for r, k in zip(records, keys)
+                   if checkpoints.get(k['id'], '') < r.sequence_number.zfill(SEQUENCE_NUMBER_DIGITS)]
+        logger.info(f'{self.name}: projecting {len(pending)} of {len(records)} record(s), '
+                    f'{len(records) - len(pending)} already applied')
+        return pending
+
+    def _commit(self, view: ViewBatch, checkpoints: Dict[str, tuple]):
+        transaction = DynamoTransaction()
+        view.stage(transaction)
+        for key, sequence_number in checkpoints.values():
+            transaction.update(self.checkpoint_table, key, {'sequence_number': sequence_number},
+                               condition=Attr('sequence_number').not_exists() | Attr('sequence_number').lt(sequence_number))
+        transaction.commit()
+
+    def handle(self, event: dict, report_failures: bool = False) -> Optional[dict]:
+        """
+        Processes a Lambda stream event. Writes are committed in order, in as
+        few transactions as fit TRANSACT_MAX_ITEMS.
+
+        If a commit fails the error is raised and Lambda retries the batch;
+        records committed before it are skipped on the retry. With
+        report_failures (only for event sources with ReportBatchItemFailures
+        on) the failed record is returned as a batch item failure instead.
+        """
+        records = [StreamRecord.from_event(r) for r in event.get('Records', [])]
+        records = [r for r in records if (r.table, r.event_name) in self.projectors]
+        failed = self._project(self._unapplied(records) if records else [], report_failures)
+        if report_failures:
+            return {'batchItemFailures': [{'itemIdentifier': failed.sequence_number}] if failed else []}
+        return None
+
+    def _project(self, records: List[StreamRecord], report_failures: bool) -> Optional[StreamRecord]:
+        """Runs the projectors and commits group by group; returns the first record of a failed group"""
+        view, checkpoints, first = ViewBatch(), {}, None
+        for record in records:
+            record_view = ViewBatch()
+            for projector in self.projectors[(record.table, record.event_name)]:
+                projector(record, record_view)
+            if not record_view:
+                continue
+            key = self.checkpoint_key(record)
+            size = len(view.ops.keys() | record_view.ops.keys()) + len(checkpoints.keys() | {key['id']})
+            if view and size > TRANSACT_MAX_ITEMS:
+                if not self._try_commit(view, checkpoints, first, report_failures):
+                    return first
+                view, checkpoints, first = ViewBatch(), {}, None
+            view.merge(record_view)
+            first = first or record
+            checkpoints[key['id']] = (key, record.sequence_number.zfill(SEQUENCE_NUMBER_DIGITS))
+        if view and not self._try_commit(view, checkpoints, first, report_failures):
+            return first
+        return None
+
+    def _try_commit(self, view: ViewBatch, checkpoints: Dict[str, tuple], first: StreamRecord,
+                    report_failures: bool) -> bool:
+        try:
+            self._commit(view, checkpoints)
+            return True
+        except Exception:
+            if not report_failures:
+                raise
+            logger.exception(f'{self.name}: failed to commit from record {first.event_id}')
+            return False
@@ -0,0 +1,176 @@
+"""
+Request-scoped unit of work for DynamoDB.
+
+While a unit of work is open, point lookups made through rctools.aws.cache
+(get_job_ticket, get_reservation_by_id, ...) resolve once per key, and the
+writes staged on it are sent together when it commits: one BatchWriteItem
+per table when they are all plain puts, otherwise one TransactWriteItems
+call. UnitOfWork has the same staging methods as DynamoTransaction, so it can
+be passed wherever a helper takes a transaction.
+
+The APIs open one per request with UnitOfWorkMiddleware, which commits it
+before the response is sent, and only if the response is a success. Handlers
+get the read side without changes and ask for the unit when they stage writes:
+
+    app.add_middleware(UnitOfWorkMiddleware)
+
+    @router.post('/thing')
+    def post_thing(uow: Optional[UnitOfWork] = Depends(request_unit_of_work)):
+        add_user_alert(alerts_table, user_id, alert, transaction=uow)
+"""
+import asyncio
+import contextvars
+import json
+import logging
+from contextlib import contextmanager
+from typing import Optional
+
+from rctools.aws.cache import identity_map
+from rctools.aws.dynamodb import DynamoTransaction, batch_write
+from rctools.exceptions import TransactionCancelled
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+_current_unit_of_work: contextvars.ContextVar = contextvars.ContextVar('unit_of_work', default=None)
+
+
+class UnitOfWork(DynamoTransaction):
+    """Writes staged during a request, committed together at its end"""
+    def __init__(self):
+        super().__init__()
+        self.tables = {}
+
+    def _add(self, table, action: str, op: dict, condition=None):
+        super()._add(table, action, op, condition)
+        self.tables[table.name] = table
+
+    def commit(self, client_request_token: Optional[str] = None):
+        """
+        Sends everything staged so far and clears it, so committing again only
+        sends what was staged since. Unconditional puts are batch written,
+        which costs half the write capacity of a transaction; anything else
+        goes out as one transaction (see DynamoTransaction.commit).
+        """
+        if not self.items:
+            return None
+        try:
+            if all('Put' in item and 'ConditionExpression' not in item['Put'] for item in self.items):
+                return self._batch_write_puts()
+            return super().commit(client_request_token)
+        finally:
+            self.items, self.written = [], []
+
+    def _batch_write_puts(self):
+        puts = {}
+        for item in self.items:
+            puts.setdefault(item['Put']['TableName'], []).append(item['Put']['Item'])
+        logger.info(f'Committing unit of work of {len(self.items)} puts to {len(puts)} table(s)')
+        return {name: batch_write(self.tables[name], puts=items) for name, items in puts.items()}
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    return _current_unit_of_work.get()
+
+
+@contextmanager
+def open_unit_of_work():
+    """
+    Opens a unit of work and commits it when the block exits normally. If the
+    block raises, the staged writes are dropped.
+    """
+    uow = UnitOfWork()
+    token = _current_unit_of_work.set(uow)
+    try:
+        with identity_map():
+            yield uow
+        uow.commit()
+    except Exception:
+        if uow.items:
+            logger.warning(f'Dropping {len(uow.items)} staged write(s) after an error')
+        raise
+    finally:
+        _current_unit_of_work.reset(token)
+
+
+def request_unit_of_work() -> Optional[UnitOfWork]:
+    """
+    FastAPI dependency for the request's unit of work, opened by
+    UnitOfWorkMiddleware. Returns None when there is none, which the write
+    helpers treat as "write right away".
+    """
+    return current_unit_of_work()
+
+
+def _error_response(status: int, error: str) -> list:
+    body = json.dumps({'error': error}).encode('utf-8')
+    return [
+        {'type': 'http.response.start', 'status': status,
+         'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]},
+        {'type': 'http.response.body', 'body': body},
+    ]
+
+
+class UnitOfWorkMiddleware:
+    """
+    ASGI middleware that opens a unit of work for each HTTP request and
+    commits it when the handler's response starts, before anything is sent.
+    Error responses (status 400 and up) and unhandled exceptions drop the
+    staged writes. If the commit fails the client gets a 409 (transaction
+    cancelled) or 500 instead of the handler's response.
+
+    Writes staged by background tasks, which run after the response is sent,
+    are not committed.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        uow = UnitOfWork()
+        token = _current_unit_of_work.set(uow)
+        replaced = False
+
+        async def commit_then_send(message):
+            nonlocal replaced
+            if replaced:
+                return  # the handler's body, after its response was swapped for an error
+            if message['type'] == 'http.response.start':
+                if message['status'] >= 400:
+                    if uow.items:
+                        logger.warning(f'Dropping {len(uow.items)} staged write(s) after a {message["status"]} response')
+                    uow.items, uow.written = [], []
+                else:
+                    error = await self._commit(uow)
+                    if error is not None:
+                        replaced = True
+                        for error_message in _error_response(*error):
+                            await send(error_message)
+                        return
+            await send(message)
+
+        try:
+            with identity_map():
+                await self.app(scope, receive, commit_then_send)
+        except Exception:
+            if uow.items:
+                logger.warning(f'Dropping {len(uow.items)} staged write(s) after an error')
+            raise
+        finally:
+            _current_unit_of_work.reset(token)
+
+    @staticmethod
+    async def _commit(uow: UnitOfWork) -> Optional[tuple]:
+        """Commits in a worker thread, returning the (status, error) to respond with if it fails"""
+        context = contextvars.copy_context()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, context.run, uow.commit)
+        except TransactionCancelled as e:
+            logger.exception(f'Unit of work was cancelled: {e.reasons}')
+            return 409, 'The request conflicted with a concurrent change, nothing was written'
+        except Exception:
+            logger.exception('Error committing unit of work')
+            return 500, 'Error saving the request'
+        return None
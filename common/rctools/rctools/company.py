@@ -1,13 +1,16 @@
 import json
 import logging
+from typing import List, Optional
 from uuid import uuid4
 
 from pydantic import ValidationError
 from rctools.aws.cognito import add_user_to_group, create_user_in_user_pool
 from rctools.users import put_admin_user_data_into_s3
 from rctools.zip_codes import get_zip_codes_in_radius
-from .aws.dynamodb import create_dynamo_record, fetch_items_by_pk, DynamoPrimaryKey, delete_dynamo_record, fetch_items_by_gsi
-from .aws.s3 import get_object_from_s3, put_object_into_s3
+from .aws.cache import get_cached_item
+from .aws.dynamodb import batch_write, create_dynamo_record_if_absent, fetch_items_by_pk, DynamoPrimaryKey, iter_query
+from .exceptions import RecordAlreadyExists
+from .aws.s3 import get_object_from_s3, get_objects_from_s3, put_object_into_s3
 from .models import AdminUser, Company, CompanyAdminUser, CompanyInstaller
 from .utils import create_random_code, mk_timestamp
 
@@ -15,11 +18,20 @@ from .utils import create_random_code, mk_timestamp
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Installer codes are stored under a fixed sort key so a conditional put can tell whether a code
+# is already taken. The creation time is still recorded in created_at. Codes created before this
+# have their creation time as ts instead, so the whole code partition is checked as well.
+INSTALLER_CODE_TS = 1
+# Codes to try before giving up; with six character codes a collision is already unlikely
+INSTALLER_CODE_ATTEMPTS = 5
+# Codes rarely change once issued, so lookups are cached for longer than the default
+INSTALLER_CODE_CACHE_TTL = 60
+
 
 def get_company_data(s3_client, bucket, company_id):
     try:
         logger.info(f'Getting company data by id {company_id}')
-        data = get_object_from_s3(s3_client, bucket, f'{company_id}/data.json')
+        data = get_object_from_s3(s3_client, bucket, f'{company_id}/data.json', cache=True)
         if data:
             # XXX When going through onboarding webapp the only company fields set are id, and account_owner_id
             # return Company(**data).dict() 
@@ -29,6 +41,13 @@ def get_company_data(s3_client, bucket, company_id):
         logger.exception(f'Company {company_id} failed validation')
 
 
+def get_companies_data(s3_client, bucket, company_ids: List[str]) -> List[dict]:
+    """Returns the data of many companies at once, skipping companies without any"""
+    logger.info(f'Getting company data for {len(company_ids)} companies')
+    objects = get_objects_from_s3(s3_client, bucket, [f'{company_id}/data.json' for company_id in company_ids], cache=True)
+    return [data for data in objects.values() if data]
+
+
 def put_company_data(s3_client, bucket, data):
     logger.info(f'putting company in s3 before {data}')
     # company = Company(**data).dict()
@@ -38,36 +57,57 @@ def put_company_data(s3_client, bucket, data):
     )
 
 
-def create_new_installer_code(table, length=6):
-    while True:
-        code = create_random_code(length)
-        logger.info(f'code created {code}')
-        pk = DynamoPrimaryKey()
-        pk.partition = {'code': code}
-        items, _ = fetch_items_by_pk(table, pk)
-        if not items:
-            break
+def create_new_installer_code(length=6):
+    code = create_random_code(length)
+    logger.info(f'code created {code}')
     return code
 
 
 def get_company_installer_by_code(table, code: str) -> dict:
+    installer = get_cached_item(table, {'code': code}, lambda: _fetch_company_installer(table, code),
+                                ttl=INSTALLER_CODE_CACHE_TTL)
+    if installer is None:
+        logger.warn('No installer found.')
+    return installer
+
+
+def _fetch_company_installer(table, code: str) -> Optional[dict]:
     pk = DynamoPrimaryKey()
     pk.partition = {'code': code}
     items, _ = fetch_items_by_pk(table, pk)
     if items:
         return CompanyInstaller(**items[0]).dict()
-    logger.warn('No installer found.')
 
 
-def put_company_installer_code(table, data) -> dict:
-    data['code'] = create_new_installer_code(table)
-    data['ts'] = mk_timestamp()
-    logger.info(f'creating installer with {data}')
-    installer = CompanyInstaller(**data).dict()
-    logger.info(f'creating dynamo record for {installer} in {table}')
-    resp = create_dynamo_record(table, installer)
-    logger.info(f'Results from dynamo {resp}')
-    return data['code']
+def _installer_code_taken(table, code: str) -> bool:
+    """Whether any item is stored under the code, including codes stored under their creation time"""
+    pk = DynamoPrimaryKey()
+    pk.partition = {'code': code}
+    items, _ = fetch_items_by_pk(table, pk, limit=1, attributes=['code'])
+    return bool(items)
+
+
+def put_company_installer_code(table, data) -> str:
+    """
+    Stores the installer under a new unused code and returns the code.
+    Raises RecordAlreadyExists if every code tried was taken.
+    """
+    data['ts'] = INSTALLER_CODE_TS
+    for _ in range(INSTALLER_CODE_ATTEMPTS):
+        data['code'] = create_new_installer_code()
+        if _installer_code_taken(table, data['code']):
+            logger.info(f'Installer code {data["code"]} is taken, trying another')
+            continue
+        logger.info(f'creating installer with {data}')
+        installer = CompanyInstaller(**data).dict()
+        try:
+            resp = create_dynamo_record_if_absent(table, installer, 'code')
+        except RecordAlreadyExists:
+            logger.info(f'Installer code {data["code"]} is taken, trying another')
+            continue
+        logger.info(f'Results from dynamo {resp}')
+        return data['code']
+    raise RecordAlreadyExists(f'No unused installer code found in {INSTALLER_CODE_ATTEMPTS} attempts')
 
 
 def create_company_id() -> str:
@@ -99,20 +139,11 @@ def update_company_service_area(s3_client, service_area_table, zip_bucket, compa
     # Delete old rows
     pk = DynamoPrimaryKey()
     pk.partition = {'company_id': company_id}
-    pagination_token = None
-    logger.info('Deleting old service area entries')
-    while True:
-        items, cursor_token = fetch_items_by_gsi(service_area_table, pk, 'gsiCompanyIndex', cursor_token=pagination_token)
-        logger.info(f'Deleting {len(items)}')
-        for i in items:
-            row_pk = {'zip_code': i['zip_code'], 'ts': i['ts']}
-            delete_dynamo_record(service_area_table, row_pk)
-        pagination_token = cursor_token
-        if not pagination_token:
-            break
+    old_rows = [{'zip_code': i['zip_code'], 'ts': i['ts']} for i in iter_query(service_area_table, pk, index='gsiCompanyIndex')]
+    logger.info(f'Deleting {len(old_rows)} old service area entries')
     # Fetch pre-calculated zip codes from bucket
     zips = get_zip_codes_in_radius(s3_client, zip_bucket, zip_code, radius)
     logger.info(f'Found {len(zips)} zips')
-    for idx, z in enumerate(zips):
-        ts = mk_timestamp() + idx  # ensure unique ts for dynamo key
-        create_dynamo_record(service_area_table, {'zip_code': z, 'company_id': company_id, 'ts': ts})
+    ts = mk_timestamp()
+    new_rows = [{'zip_code': z, 'company_id': company_id, 'ts': ts + idx} for idx, z in enumerate(zips)]  # ensure unique ts for dynamo key
+    batch_write(service_area_table, puts=new_rows, deletes=old_rows)
@@ -2,16 +2,17 @@
 import json
 import logging
 import os
-from typing import List
+from typing import Dict, List, Optional
 
 from rctools.aws.cognito import (create_user_in_user_pool,
                                  flatten_user_attributes,
                                  get_user_from_user_pool,
                                  list_users_from_user_pool, merge_user_data,
                                  update_user_attributes)
-from rctools.aws.dynamodb import (KEY_COND_EQ, DynamoPrimaryKey,
-                                  fetch_items_by_gsi, fetch_items_by_pk)
-from rctools.aws.s3 import get_object_from_s3, put_object_into_s3
+from rctools.aws.dynamodb import (KEY_COND_EQ, DynamoPrimaryKey, batch_get,
+                                  iter_query)
+from rctools.aws.s3 import get_object_from_s3, get_objects_from_s3, put_object_into_s3, update_object_in_s3
+from rctools.directory import CUSTOMERS, list_directory_users, seed_user_directory, update_directory_entry
 from rctools.models import Customer, CustomerUser
 
 logger = logging.getLogger()
@@ -24,6 +25,7 @@ def create_customer(cognito_client, s3_client, pool_id, bucket, data) -> str:
     """Creates a full customer, returning the newly created user ID"""
     cognito_resp = create_customer_user(cognito_client, pool_id, data)
     user_id = cognito_resp['User']['Username']
+    update_directory_entry(s3_client, bucket, CUSTOMERS, user_id, cognito=cognito_resp['User'])
     put_customer_data_into_s3(s3_client, bucket, user_id, data)
     return user_id
 
@@ -37,10 +39,18 @@ def create_customer_user(cognito_client, pool_id, data):
 
 # TODO utilize pagination tokens in React Admin instead of start/end, which doesn't really work for cognito/dynamo
 def get_all_customers(cognito_client, s3_client, pool_id, bucket, pagination_token=None, limit=20) -> List[Customer]:
+    """
+    Returns every customer from the customer directory. Until the directory
+    exists they are read from Cognito and S3 and used to seed it.
+    """
+    customers = list_directory_users(cognito_client, s3_client, pool_id, bucket, CUSTOMERS)
+    if customers is not None:
+        return customers
     customers = list_users_from_user_pool(cognito_client, pool_id)
+    customers_data = get_customers_data_from_s3(s3_client, bucket, [customer['Username'] for customer in customers])
+    seed_user_directory(s3_client, bucket, CUSTOMERS, customers, customers_data)
     for customer in customers:
-        user_data = get_customer_data_from_s3(s3_client, bucket, customer['Username'])
-        customer = merge_user_data(customer, user_data)
+        merge_user_data(customer, customers_data[customer['Username']])
     return customers
 
 
@@ -78,34 +88,29 @@ def get_customer(cognito_client, s3_client, pool_id, bucket, user_id) -> Custome
 
 def get_customer_data_from_s3(s3_client, bucket, user_id):
     """Returns extra customer user data stored in S3"""
-    return get_object_from_s3(s3_client, bucket, f'customers/{user_id}.json', {})
+    return get_object_from_s3(s3_client, bucket, f'customers/{user_id}.json', {}, cache=True)
+
 
+def get_customers_data_from_s3(s3_client, bucket, user_ids: List[str]) -> Dict[str, dict]:
+    """Returns the S3 data of many customers at once, keyed by user ID"""
+    objects = get_objects_from_s3(s3_client, bucket, [f'customers/{user_id}.json' for user_id in user_ids], {}, cache=True)
+    return {user_id: objects[f'customers/{user_id}.json'] for user_id in user_ids}
 
-def get_customer_jobs_from_dynamo(jobs_table, customer_id, limit=20):
+
+def get_customer_jobs_from_dynamo(jobs_table, customer_id, limit: Optional[int] = None):
     """
-    Queries a dyanmo table for any jobs assigned to the customer
+    Queries a dyanmo table for any jobs assigned to the customer, at most limit of them if given
     """
     logger.info(f'Checking for jobs for user {customer_id}')
     pk = DynamoPrimaryKey()
     pk.partition = {'customer_id': customer_id}
     # pk.sort = {'ts': mk_timestamp()}
     
-    jobs, pagination_token = [], None
-    while True:
-        # Query the customer's tickets using the jobs table
-        items, cursor_token = fetch_items_by_gsi(jobs_table, pk, 'customer_id', cursor_token=pagination_token)
-        # Then pull the whole ticket
-        for i in items:
-            job_pk = DynamoPrimaryKey()
-            job_pk.partition = {'ticket_id': i['ticket_id']}
-            logger.info(f'Fetching ticket_id {i["ticket_id"]}')
-            job_items, _ = fetch_items_by_pk(jobs_table, job_pk)
-            jobs += job_items
-        pagination_token = cursor_token
-        if len(items) > limit:
-            break
-        if not pagination_token:
-            break
+    # Query the customer's ticket keys using the jobs table index
+    keys = [{'ticket_id': i['ticket_id'], 'ts': i['ts']}
+            for i in iter_query(jobs_table, pk, index='customer_id', fast=True, max_items=limit)]
+    # Then pull the whole tickets
+    jobs = batch_get(jobs_table, keys, fast=True)
     logger.info(f'Returning {len(jobs)} job(s)')
     return jobs
 
@@ -123,25 +128,36 @@ def get_pool_attributes(pool_res, user):
 def put_customer_data_into_s3(s3_client, bucket, user_id, data):
     CustomerUser.strip_cognito_fields(data)
     logger.info(f'Updating customer user {user_id} with {data}')
-    return put_object_into_s3(s3_client, bucket, f'customers/{user_id}.json', json.dumps(data))
+    resp = put_object_into_s3(s3_client, bucket, f'customers/{user_id}.json', json.dumps(data))
+    if resp is not None:  # put_object_into_s3 logs and swallows errors
+        update_directory_entry(s3_client, bucket, CUSTOMERS, user_id, data=data)
+    return resp
 
 
 def update_customer_data_in_s3(s3_client, bucket, user_id, data):
     """Updates an existing customer user data object in S3 with new data"""
-    user_data = get_customer_data_from_s3(s3_client, bucket, user_id)
-    user_data.update(data)
-    put_customer_data_into_s3(s3_client, bucket, user_id, user_data)
+    def apply(user_data):
+        user_data.update(data)
+        CustomerUser.strip_cognito_fields(user_data)
+        return user_data
+
+    logger.info(f'Updating customer user {user_id} with {data}')
+    user_data = update_object_in_s3(s3_client, bucket, f'customers/{user_id}.json', apply, default={})
+    update_directory_entry(s3_client, bucket, CUSTOMERS, user_id, data=user_data)
+    return user_data
 
 
 def update_customer_job_data_in_s3(s3_client, bucket, user_id, job_data):
     """appends the new customer job data to user data object in S3"""
-    user_data = get_customer_data_from_s3(s3_client, bucket, user_id)
-    if user_data.get('jobs') is not None:
+    def apply(user_data):
+        if user_data.get('jobs') is None:
+            user_data['jobs'] = []
         user_data['jobs'].append(job_data) # XXX list or dict or?
-        return put_customer_data_into_s3(s3_client, bucket, user_id, user_data)
-    user_data['jobs'] = []
-    user_data['jobs'].append(job_data) 
-    put_customer_data_into_s3(s3_client, bucket, user_id, user_data)
+        return user_data
+
+    user_data = update_object_in_s3(s3_client, bucket, f'customers/{user_id}.json', apply, default={})
+    update_directory_entry(s3_client, bucket, CUSTOMERS, user_id, data=user_data)
+    return user_data
 
 
 
@@ -0,0 +1,284 @@
+"""
+Compact snapshot of every installer and customer, so the admin listings and
+scheduling read one cached S3 object instead of paging through Cognito and
+fetching one S3 document per user on every call.
+
+Each kind of user has one JSON document in the user data bucket:
+
+    directory/installers.json   {"format": 3, "version": 42, "updated_at": <ms>, "cognito_refreshed_at": <ms>,
+                                 "users": {"<Username>": {"cognito": {<list_users record>}, "data": {<S3 data>}}, ...}}
+
+An entry keeps the user's Cognito record and S3 document apart, and
+directory_user merges them the way get_installer and get_customer do, so
+the listings return the same records as before.
+
+The S3 side is kept current by the installer and customer write helpers,
+which replace the changed user's data with update_directory_entry, using
+If-Match writes so concurrent profile updates don't overwrite each other.
+Cognito changes (sign up confirmation, attribute edits made in Cognito) don't
+go through rctools, so the Cognito side is refreshed from one list_users
+pass at most every COGNITO_REFRESH_INTERVAL seconds, when a listing finds it
+older than that. The refresh also adds new users and drops disabled ones.
+
+Reads go through the S3 object cache and are revalidated by ETag, so reading
+the directory costs at most one conditional GET. A directory only exists once
+it has been seeded: the first listing of a kind seeds it, or it can be
+rebuilt explicitly, e.g. after DIRECTORY_FORMAT changes:
+
+    python -m rctools.directory rebuild --kind installers --user-pool-id ... --bucket ...
+
+Until then, and for users missing from it, callers read Cognito and S3 as
+before.
+"""
+import argparse
+import copy
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from pydantic import BaseModel, ValidationError
+
+from rctools.aws.clients import get_client
+from rctools.aws.cognito import list_users_from_user_pool, merge_user_data
+from rctools.aws.s3 import get_object_from_s3, get_objects_from_s3, update_object_in_s3
+from rctools.utils import mk_timestamp
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+INSTALLERS = 'installers'
+CUSTOMERS = 'customers'
+KINDS = [CUSTOMERS, INSTALLERS]
+
+# Bump when the entry layout changes; older snapshots are ignored until they are rebuilt
+DIRECTORY_FORMAT = 3
+# Seconds a process serves its cached copy of a directory before checking it again
+DIRECTORY_MAX_AGE = 10
+# Seconds before a listing refreshes the Cognito side of a directory
+COGNITO_REFRESH_INTERVAL = 5 * 60
+
+
+class UserDirectory(BaseModel):
+    """The stored snapshot of one kind of user, keyed by Username"""
+    format: int = DIRECTORY_FORMAT
+    version: int = 0
+    updated_at: int = 0
+    cognito_refreshed_at: int = 0
+    users: Dict[str, dict] = {}
+
+
+class _DirectoryMissing(Exception):
+    """The directory disappeared or went out of date while it was being updated"""
+    pass
+
+
+class _DirectoryExists(Exception):
+    """Another process seeded the directory first"""
+    pass
+
+
+def directory_key(kind: str) -> str:
+    return f'directory/{kind}.json'
+
+
+def user_data_key(kind: str, username: str) -> str:
+    return f'{kind}/{username}.json'
+
+
+def _cognito_record(user: dict) -> dict:
+    """A Cognito user as stored in the directory, with its dates as ISO strings"""
+    return {key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in user.items() if key != 'ResponseMetadata'}
+
+
+def directory_user(entry: dict) -> dict:
+    """The user record of an entry, its Cognito record merged with its S3 data"""
+    return merge_user_data(copy.deepcopy(entry['cognito']), copy.deepcopy(entry.get('data', {})))
+
+
+def _parse(document) -> Optional[UserDirectory]:
+    if not document:
+        return None
+    try:
+        directory = UserDirectory.parse_obj(document)
+    except ValidationError:
+        logger.exception('Ignoring malformed user directory')
+        return None
+    return directory if directory.format == DIRECTORY_FORMAT else None
+
+
+def read_user_directory(s3_client, bucket, kind: str, max_age: float = DIRECTORY_MAX_AGE) -> Optional[UserDirectory]:
+    """Returns the directory, or None if it hasn't been seeded or can't be read"""
+    directory = _parse(get_object_from_s3(s3_client, bucket, directory_key(kind), {}, cache=True, max_age=max_age))
+    if directory is None:
+        logger.info(f'No {kind} directory in bucket {bucket}')
+    return directory
+
+
+def get_user_directory(s3_client, bucket, kind: str, max_age: float = DIRECTORY_MAX_AGE) -> Optional[Dict[str, dict]]:
+    """
+    Returns the record of every user of the kind keyed by Username, or None if
+    the directory hasn't been seeded or can't be read
+    """
+    directory = read_user_directory(s3_client, bucket, kind, max_age=max_age)
+    if directory is None:
+        return None
+    logger.info(f'Returning {len(directory.users)} {kind} from directory version {directory.version}')
+    return {username: directory_user(entry) for username, entry in directory.users.items() if 'cognito' in entry}
+
+
+def list_directory_users(cognito_client, s3_client, pool_id, bucket, kind: str,
+                         refresh_interval: float = COGNITO_REFRESH_INTERVAL) -> Optional[List[dict]]:
+    """
+    Returns the record of every user of the kind, refreshing the Cognito side
+    first if it is older than refresh_interval seconds. Returns None if the
+    directory hasn't been seeded.
+    """
+    directory = read_user_directory(s3_client, bucket, kind)
+    if directory is None:
+        return None
+    if mk_timestamp() - directory.cognito_refreshed_at > refresh_interval * 1000:
+        try:
+            directory = refresh_user_directory(cognito_client, s3_client, pool_id, bucket, kind)
+        except Exception:
+            # Serve the snapshot as it is; the next listing tries again
+            logger.exception(f'Error refreshing Cognito fields of {kind} directory')
+    logger.info(f'Returning {len(directory.users)} {kind} from directory version {directory.version}')
+    return [directory_user(entry) for entry in directory.users.values() if 'cognito' in entry]
+
+
+def _write_directory(s3_client, bucket, kind: str,
+                     change: Callable[[Optional[UserDirectory]], UserDirectory]) -> UserDirectory:
+    def apply(document):
+        directory = change(_parse(document))
+        directory.version += 1
+        directory.updated_at = mk_timestamp()
+        return directory.dict()
+
+    return UserDirectory.parse_obj(update_object_in_s3(s3_client, bucket, directory_key(kind), apply))
+
+
+def _entries(users: List[dict], data: Dict[str, dict]) -> Dict[str, dict]:
+    return {user['Username']: {'cognito': _cognito_record(user), 'data': data.get(user['Username'], {})}
+            for user in users}
+
+
+def seed_user_directory(s3_client, bucket, kind: str, users: List[dict], data: Dict[str, dict]):
+    """
+    Stores the given users, as returned by list_users_from_user_pool, with
+    their S3 data keyed by Username as the directory, unless there already is
+    one: it is only written when none exists, since the write helpers and the
+    Cognito refresh keep an existing directory current.
+    """
+    def change(directory):
+        if directory is not None:
+            raise _DirectoryExists()
+        return UserDirectory(users=_entries(users, data), cognito_refreshed_at=mk_timestamp())
+
+    try:
+        if read_user_directory(s3_client, bucket, kind) is not None:
+            return
+        _write_directory(s3_client, bucket, kind, change)
+        logger.info(f'Seeded {kind} directory with {len(users)} user(s)')
+    except _DirectoryExists:
+        pass
+    except Exception:
+        logger.exception(f'Error seeding {kind} directory in bucket {bucket}')
+
+
+def refresh_user_directory(cognito_client, s3_client, pool_id, bucket, kind: str,
+                           reload_data: bool = False) -> UserDirectory:
+    """
+    Replaces the Cognito side of every entry from one list_users pass, adding
+    users that aren't in the directory yet and dropping users that are gone or
+    disabled. S3 data is only read for users without any in the directory, or
+    for every user with reload_data. Creates the directory if there is none.
+    """
+    users = list_users_from_user_pool(cognito_client, pool_id)
+    current = None if reload_data else read_user_directory(s3_client, bucket, kind, max_age=0)
+    known = current.users if current is not None else {}
+    missing = [user['Username'] for user in users if 'data' not in known.get(user['Username'], {})]
+    objects = get_objects_from_s3(s3_client, bucket, [user_data_key(kind, username) for username in missing], {})
+    fetched = {username: objects[user_data_key(kind, username)] for username in missing}
+
+    def change(directory):
+        existing = directory.users if directory is not None and not reload_data else {}
+        data = {username: entry['data'] for username, entry in existing.items() if 'data' in entry}
+        return UserDirectory(version=directory.version if directory else 0, users=_entries(users, {**fetched, **data}),
+                             cognito_refreshed_at=mk_timestamp())
+
+    directory = _write_directory(s3_client, bucket, kind, change)
+    logger.info(f'Refreshed Cognito fields of {len(users)} user(s) in {kind} directory, '
+                f'read S3 data of {len(missing)}')
+    return directory
+
+
+def _change_entry(s3_client, bucket, kind: str, username: str, change: Callable[[Optional[dict]], Optional[dict]]):
+    """Applies change to the user's entry (None when there is none, return None to remove it)"""
+    try:
+        current = read_user_directory(s3_client, bucket, kind)
+        if current is None:
+            return
+        if change(current.users.get(username)) == current.users.get(username):
+            return  # nothing changed, skip the write
+
+        def change_directory(directory):
+            if directory is None:
+                raise _DirectoryMissing()
+            entry = change(directory.users.get(username))
+            if entry is None:
+                directory.users.pop(username, None)
+            else:
+                directory.users[username] = entry
+            return directory
+
+        _write_directory(s3_client, bucket, kind, change_directory)
+    except _DirectoryMissing:
+        pass
+    except Exception:
+        # The profile itself was written; the entry catches up on the user's next update or a rebuild
+        logger.exception(f'Error updating {username} in {kind} directory')
+
+
+def update_directory_entry(s3_client, bucket, kind: str, username: str, data: Optional[dict] = None,
+                           cognito: Optional[dict] = None):
+    """
+    Replaces the user's S3 data with data, the whole document as written,
+    and/or their Cognito record with cognito, e.g. the User of AdminCreateUser
+    """
+    def change(entry):
+        entry = dict(entry or {})
+        if data is not None:
+            entry['data'] = copy.deepcopy(data)
+        if cognito is not None:
+            entry['cognito'] = _cognito_record(cognito)
+        return entry
+
+    _change_entry(s3_client, bucket, kind, username, change)
+
+
+def remove_directory_entry(s3_client, bucket, kind: str, username: str):
+    _change_entry(s3_client, bucket, kind, username, lambda entry: None)
+
+
+def rebuild_user_directory(cognito_client, s3_client, pool_id, bucket, kind: str) -> int:
+    """Rebuilds the directory from Cognito and every user's S3 document, returning the number of users"""
+    return len(refresh_user_directory(cognito_client, s3_client, pool_id, bucket, kind, reload_data=True).users)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m rctools.directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebuild = commands.add_parser('rebuild', help='rebuild a user directory from Cognito and S3')
+    rebuild.add_argument('--kind', choices=KINDS, required=True)
+    rebuild.add_argument('--user-pool-id', required=True)
+    rebuild.add_argument('--bucket', required=True, help='the user data bucket')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    count = rebuild_user_directory(get_client('cognito-idp'), get_client('s3'), args.user_pool_id, args.bucket, args.kind)
+    print(f'Rebuilt {args.kind} directory with {count} user(s)')
+
+
+if __name__ == '__main__':
+    main()
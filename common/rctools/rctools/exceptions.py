@@ -33,3 +33,37 @@ class UserNotAuthorizedToListTickets(Exception):
 class UserNotAuthorizedToEditInstaller(Exception):
     """Base class for other exceptions"""
     pass
+
+
+class BatchRequestIncomplete(Exception):
+    """Raised when a batch request still has unprocessed keys or items after retrying"""
+    pass
+
+
+class RecordAlreadyExists(Exception):
+    """Raised when a conditional put finds an item already stored under its key"""
+    pass
+
+
+class ConditionalWriteConflict(Exception):
+    """Raised when an optimistically locked write keeps losing to concurrent writers"""
+    pass
+
+
+class TransactionCancelled(Exception):
+    """Raised when DynamoDB cancels a transaction. reasons holds its CancellationReasons, one per item"""
+    def __init__(self, *args, reasons=None):
+        super().__init__(*args)
+        self.reasons = reasons or []
+
+
+class QueryDeadlineExceeded(Exception):
+    """Raised when a query fan-out runs past its deadline. results holds the partitions that were read"""
+    def __init__(self, *args, results=None):
+        super().__init__(*args)
+        self.results = results or {}
+
+
+class InvalidUpload(Exception):
+    """Raised when a direct upload is requested or completed with an unsupported type, bad ID or missing object"""
+    pass
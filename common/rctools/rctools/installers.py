@@ -2,7 +2,7 @@
 import json
 import logging
 import os
-from typing import List
+from typing import Dict, List, Optional
 
 from boto3.dynamodb.conditions import Key
 
@@ -11,12 +11,14 @@ from rctools.aws.cognito import (create_user_in_user_pool,
                                  get_user_from_user_pool, get_user_groups,
                                  list_users_from_user_pool, merge_user_data,
                                  update_user_attributes)
-from rctools.aws.dynamodb import (KEY_COND_EQ, DynamoPrimaryKey, delete_dynamo_record,
-                                  create_dynamo_record, fetch_items_by_gsi,
-                                  fetch_items_by_pk, update_dynamo_record)
-from rctools.aws.s3 import get_object_from_s3, put_object_into_s3
-from rctools.models.users import Installer, InstallerUser
+from rctools.aws.dynamodb import (KEY_COND_EQ, DynamoPrimaryKey, batch_get, batch_write,
+                                  iter_query, update_versioned_dynamo_record)
+from rctools.aws.s3 import get_object_from_s3, get_objects_from_s3, put_object_into_s3, update_object_in_s3
+from rctools.directory import (INSTALLERS, get_user_directory, list_directory_users, remove_directory_entry,
+                               seed_user_directory, update_directory_entry)
+from rctools.models.users import Installer, InstallerImage, InstallerUser, PresignedUpload
 from rctools.models.jobs import JobTicket
+from rctools.uploads import complete_upload, create_upload, download_url
 from rctools.users import get_admin_user_data_from_s3
 from rctools.utils import mk_timestamp
 from rctools.zip_codes import get_zip_codes_in_radius
@@ -32,6 +34,7 @@ def create_installer(cognito_client, s3_client, pool_id, bucket, data) -> str:
     """Creates a full installer, returning the newly created user ID"""
     cognito_resp = create_installer_user(cognito_client, pool_id, data)
     user_id = cognito_resp['User']['Username']
+    update_directory_entry(s3_client, bucket, INSTALLERS, user_id, cognito=cognito_resp['User'])
     put_installer_data_into_s3(s3_client, bucket, user_id, data)
     return user_id
 
@@ -54,10 +57,10 @@ def get_installer(cognito_client, s3_client, pool_id, bucket, user_id) -> dict:
 
 def get_installers_for_company(cognito_client, s3_client, pool_id, bucket, company_id):
     installer_users = list_users_from_user_pool(cognito_client, pool_id)
+    installers_data = get_installers_data_from_s3(s3_client, bucket, [user['Username'] for user in installer_users])
     data = []
     for user in installer_users:
-        uid = user['Username']
-        user_data = get_installer_data_from_s3(s3_client, bucket, uid)
+        user_data = installers_data[user['Username']]
         if company_id:
             if user_data.get('company_id') == company_id:
                 data.append(merge_user_data(user, user_data))
@@ -66,7 +69,22 @@ def get_installers_for_company(cognito_client, s3_client, pool_id, bucket, compa
 
 def get_installer_data_from_s3(s3_client, bucket, user_id):
     """Returns extra installer user data stored in S3"""
-    return get_object_from_s3(s3_client, bucket, f'installers/{user_id}.json', {})
+    return get_object_from_s3(s3_client, bucket, f'installers/{user_id}.json', {}, cache=True)
+
+
+def get_installers_by_id(cognito_client, s3_client, pool_id, bucket, user_ids: List[str]) -> List[dict]:
+    """
+    Returns the given installers from the installer directory, looking up the
+    ones that aren't in it with get_installer
+    """
+    directory = get_user_directory(s3_client, bucket, INSTALLERS) or {}
+    return [directory.get(user_id) or get_installer(cognito_client, s3_client, pool_id, bucket, user_id) for user_id in user_ids]
+
+
+def get_installers_data_from_s3(s3_client, bucket, user_ids: List[str]) -> Dict[str, dict]:
+    """Returns the S3 data of many installers at once, keyed by user ID"""
+    objects = get_objects_from_s3(s3_client, bucket, [f'installers/{user_id}.json' for user_id in user_ids], {}, cache=True)
+    return {user_id: objects[f'installers/{user_id}.json'] for user_id in user_ids}
 
 
 def get_pool_attributes(pool_res, user):
@@ -106,25 +124,36 @@ def put_installer_data_into_s3(s3_client, bucket, user_id, data):
     """Updates installer user data in S3"""
     InstallerUser.strip_cognito_fields(data)
     logger.info(f'Updating installer user {user_id} with {data}')
-    return put_object_into_s3(s3_client, bucket, f'installers/{user_id}.json', json.dumps(data))
+    resp = put_object_into_s3(s3_client, bucket, f'installers/{user_id}.json', json.dumps(data))
+    if resp is not None:  # put_object_into_s3 logs and swallows errors
+        update_directory_entry(s3_client, bucket, INSTALLERS, user_id, data=data)
+    return resp
 
 
 def update_installer_data_in_s3(s3_client, bucket, user_id, data):
     """Updates an existing installer user data object in S3 with new data"""
-    user_data = get_installer_data_from_s3(s3_client, bucket, user_id)
-    user_data.update(data)
-    put_installer_data_into_s3(s3_client, bucket, user_id, user_data)
+    def apply(user_data):
+        user_data.update(data)
+        InstallerUser.strip_cognito_fields(user_data)
+        return user_data
+
+    logger.info(f'Updating installer user {user_id} with {data}')
+    user_data = update_object_in_s3(s3_client, bucket, f'installers/{user_id}.json', apply, default={})
+    update_directory_entry(s3_client, bucket, INSTALLERS, user_id, data=user_data)
+    return user_data
 
 
 def update_installer_job_data_in_s3(s3_client, bucket, user_id, job_data):
     """Appends the new installer job data to user data object in S3"""
-    user_data = get_installer_data_from_s3(s3_client, bucket, user_id)
-    if user_data.get('jobs') is not None:
+    def apply(user_data):
+        if user_data.get('jobs') is None:
+            user_data['jobs'] = []
         user_data['jobs'].append(job_data) # XXX list or dict or?
-        return put_installer_data_into_s3(s3_client, bucket, user_id, user_data)
-    user_data['jobs'] = []
-    user_data['jobs'].append(job_data) 
-    put_installer_data_into_s3(s3_client, bucket, user_id, user_data)
+        return user_data
+
+    user_data = update_object_in_s3(s3_client, bucket, f'installers/{user_id}.json', apply, default={})
+    update_directory_entry(s3_client, bucket, INSTALLERS, user_id, data=user_data)
+    return user_data
 
 
 def update_installer_service_area(s3_client, service_area_table, zip_bucket, installer_id, zip_code, radius):
@@ -135,23 +164,14 @@ def update_installer_service_area(s3_client, service_area_table, zip_bucket, ins
     # Delete old rows
     pk = DynamoPrimaryKey()
     pk.partition = {'installer_id': installer_id}
-    pagination_token = None
-    logger.info('Deleting old service area entries')
-    while True:
-        items, cursor_token = fetch_items_by_gsi(service_area_table, pk, 'gsiInstallerIndex', cursor_token=pagination_token)
-        logger.info(f'Deleting {len(items)}')
-        for i in items:
-            row_pk = {'zip_code': i['zip_code'], 'ts': i['ts']}
-            delete_dynamo_record(service_area_table, row_pk)
-        pagination_token = cursor_token
-        if not pagination_token:
-            break
+    old_rows = [{'zip_code': i['zip_code'], 'ts': i['ts']} for i in iter_query(service_area_table, pk, index='gsiInstallerIndex')]
+    logger.info(f'Deleting {len(old_rows)} old service area entries')
     # Fetch pre-calculated zip codes from bucket
     zips = get_zip_codes_in_radius(s3_client, zip_bucket, zip_code, radius)
     logger.info(f'Found {len(zips)} zips')
-    for idx, z in enumerate(zips):
-        ts = mk_timestamp() + idx  # ensure unique ts for dynamo key
-        create_dynamo_record(service_area_table, {'zip_code': z, 'installer_id': installer_id, 'ts': ts})
+    ts = mk_timestamp()
+    new_rows = [{'zip_code': z, 'installer_id': installer_id, 'ts': ts + idx} for idx, z in enumerate(zips)]  # ensure unique ts for dynamo key
+    batch_write(service_area_table, puts=new_rows, deletes=old_rows)
 
 
 def get_user_company(s3_client, bucket, username):
@@ -191,44 +211,46 @@ def in_installer_scope(installer_service, tier):
 
 # TODO utilize pagination tokens in React Admin instead of start/end, which doesn't really work for cognito/dynamo
 def get_all_installers(cognito_client, s3_client, pool_id, bucket, pagination_token=None, limit=20) -> List[Installer]:
+    """
+    Returns every installer from the installer directory. Until the directory
+    exists they are read from Cognito and S3 and used to seed it.
+    """
+    installers = list_directory_users(cognito_client, s3_client, pool_id, bucket, INSTALLERS)
+    if installers is not None:
+        return installers
     installers = list_users_from_user_pool(cognito_client, pool_id)
+    installers_data = get_installers_data_from_s3(s3_client, bucket, [installer['Username'] for installer in installers])
+    seed_user_directory(s3_client, bucket, INSTALLERS, installers, installers_data)
     for installer in installers:
-        user_data = get_installer_data_from_s3(s3_client, bucket, installer['Username'])
-        installer = merge_user_data(installer, user_data)
+        merge_user_data(installer, installers_data[installer['Username']])
     return installers
 
 
+def remove_installer_from_directory(s3_client, bucket, user_id):
+    """Drops a disabled or deleted installer from the installer directory"""
+    remove_directory_entry(s3_client, bucket, INSTALLERS, user_id)
+
+
 def get_installer_zip(s3_client, bucket, user_id):
     """Fetches installer s3 data and returns installer zip code"""
-    data = get_object_from_s3(s3_client, bucket, f'installers/{user_id}.json', {})
+    data = get_object_from_s3(s3_client, bucket, f'installers/{user_id}.json', {}, cache=True)
     logger.info(f'installer data for zip is {data}')
     return data.get('zip')
 
 
-def get_installer_jobs_from_dynamo(jobs_table, installer_id, limit=20):
+def get_installer_jobs_from_dynamo(jobs_table, installer_id, limit: Optional[int] = None):
     """
-    Queries a dyanmo table for any jobs assigned to the installer
+    Queries a dyanmo table for any jobs assigned to the installer, at most limit of them if given
     """
     logger.info(f'Checking for jobs for user {installer_id}')
     pk = DynamoPrimaryKey()
     pk.partition = {'installer_id': installer_id}
     
-    jobs, pagination_token = [], None
-    while True:
-        # Query the customer's tickets using the jobs table
-        items, cursor_token = fetch_items_by_gsi(jobs_table, pk, 'installer_id', cursor_token=pagination_token)
-        # Then pull the whole ticket
-        for i in items:
-            job_pk = DynamoPrimaryKey()
-            job_pk.partition = {'ticket_id': i['ticket_id']}
-            logger.info(f'Fetching ticket_id {i["ticket_id"]}')
-            job_items, _ = fetch_items_by_pk(jobs_table, job_pk)
-            jobs += job_items
-        pagination_token = cursor_token
-        if len(items) > limit:
-            break
-        if not pagination_token:
-            break
+    # Query the installer's ticket keys using the jobs table index
+    keys = [{'ticket_id': i['ticket_id'], 'ts': i['ts']}
+            for i in iter_query(jobs_table, pk, index='installer_id', fast=True, max_items=limit)]
+    # Then pull the whole tickets
+    jobs = batch_get(jobs_table, keys, fast=True)
     logger.info(f'Returning {len(jobs)} job(s)')
     return jobs
 
@@ -237,8 +259,8 @@ def update_installer_job(table, data, id):
     """Update exiting job ticket in jobs table"""
     logger.info(f'Attaching data {data} to {id}')
     job_ticket = get_installer_job(table, id)
-    update_data = {**job_ticket, **data}
-    update_dynamo_record(table, {'ticket_id': update_data.pop('ticket_id'), 'ts': update_data.pop('ts')}, update_data)
+    update_versioned_dynamo_record(table, {'ticket_id': job_ticket['ticket_id'], 'ts': job_ticket['ts']},
+                                   lambda current: {**current, **data}, current=job_ticket)
     return job_ticket
 
 
@@ -254,10 +276,46 @@ def get_installer_job(table, id):
 
 def add_photo_to_installer_data(s3_client, bucket, user_id, data):
     """Adds image_id to installer"""
-    user_data = get_installer_data_from_s3(s3_client, bucket, user_id)
-    if user_data.get('images') == None:
-        user_data['images'] = []
+    image = {'type': data['type'], 'image_id': data['image_id']}  # Only saving the image_id and type to the installer
+
+    def apply(user_data):
+        if user_data.get('images') is None:
+            user_data['images'] = []
+        if image not in user_data['images']:
+            user_data['images'].append(image)
+        return user_data
+
+    user_data = update_object_in_s3(s3_client, bucket, f'installers/{user_id}.json', apply, default={})
+    update_directory_entry(s3_client, bucket, INSTALLERS, user_id, data=user_data)
+
+
+def installer_image_prefix(user_id, type) -> str:
+    return f'installers/{user_id}/images/{type}'
+
+
+def create_installer_image_upload(s3_client, bucket, user_id, type, content_type) -> PresignedUpload:
+    """Returns a presigned upload for a new image of the given type, see rctools.uploads"""
+    return create_upload(s3_client, bucket, installer_image_prefix(user_id, type), content_type)
+
+
+def complete_installer_image_upload(s3_client, bucket, user_id, type, image_id) -> InstallerImage:
+    """Records a finished image upload next to the image and in the installer's data"""
+    prefix = installer_image_prefix(user_id, type)
+    uploaded = complete_upload(s3_client, bucket, prefix, image_id)
+    image = InstallerImage(image_id=image_id, uid=user_id, type=type, **uploaded.dict())
+    put_object_into_s3(s3_client, bucket, f'{prefix}/{image_id}.json', json.dumps(image.dict()))
+    add_photo_to_installer_data(s3_client, bucket, user_id, image.dict())
+    image.uri = download_url(s3_client, bucket, image.key)
+    return image
 
-    user_data['images'].append({data.type, data.image_id}) # Only saving the image_id and type to the installer
 
-    update_installer_data_in_s3(s3_client, bucket, user_id, user_data)
+def get_installer_image(s3_client, bucket, user_id, type) -> Optional[dict]:
+    """Returns the installer's latest image of the type, with a presigned GET URL as the uri if it was uploaded directly"""
+    images = get_installer_data_from_s3(s3_client, bucket, user_id).get('images') or []
+    image_id = next((i['image_id'] for i in reversed(images) if isinstance(i, dict) and i.get('type') == type), None)
+    if image_id is None:
+        return None
+    image = get_object_from_s3(s3_client, bucket, f'{installer_image_prefix(user_id, type)}/{image_id}.json')
+    if image and image.get('key'):
+        image['uri'] = download_url(s3_client, bucket, image['key'])
+    return image
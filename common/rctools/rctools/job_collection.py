@@ -0,0 +1,270 @@
+"""
+Optional item-collection layout for job aggregates.
+
+The collection table keeps a copy of everything that makes up a job under the
+ticket's partition key, so a single query hydrates the whole aggregate:
+
+    ticket_id   sk                    item
+    t1          ticket                the job ticket (carries conversation_id)
+    t1          conversation          pointer to the conversation, for tickets without conversation_id
+    t1          reservation#<id>      reservations made for the ticket
+    t1          schedule#<ts>         the job schedule row
+
+The source tables stay the system of record. While the collection is enabled
+the write helpers (put_new_job, update_job_ticket, create_reservation,
+add_job_to_schedule) mirror what they write into it, in the same transaction
+when they are given one. Reads only use it once reads are switched on, which
+should happen after the existing jobs have been copied over:
+
+    python -m rctools.job_collection migrate --collection-table ... --jobs-table ... \\
+        --job-schedule-table ... --reservations-table ... [--messages-table ...]
+
+Apps set it up at startup from JOB_COLLECTION_TABLE and JOB_COLLECTION_READS
+(see enable_job_collection_from_env).
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import List, Optional
+
+from botocore.exceptions import ClientError
+from pydantic import BaseModel
+
+from rctools.aws.clients import get_resource
+from rctools.aws.dynamodb import (DEFAULT_BATCH_WORKERS, VERSION_ATTRIBUTE, Attr, DynamoPrimaryKey, DynamoTransaction,
+                                  create_dynamo_record_if_absent, is_conditional_check_failure, iter_parallel_scan,
+                                  iter_query, mk_dynamo_record)
+from rctools.aws.metrics import with_context
+from rctools.exceptions import RecordAlreadyExists
+from rctools.messages import find_conversation
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+JOB_COLLECTION_SORT_KEY = 'sk'
+TICKET_SK = 'ticket'
+CONVERSATION_SK = 'conversation'
+RESERVATION_SK_PREFIX = 'reservation#'
+SCHEDULE_SK_PREFIX = 'schedule#'
+MIGRATION_CHUNKS_PER_WORKER = 25  # items the migration has in flight per worker
+
+
+class JobCollection:
+    """Where job aggregates are mirrored to and whether reads use them; off until enabled"""
+    def __init__(self):
+        self.table = None
+        self.reads = False
+
+    def enable(self, table, reads: bool = False):
+        self.table = table
+        self.reads = reads
+
+    def disable(self):
+        self.table = None
+        self.reads = False
+
+
+job_collection = JobCollection()
+
+
+def enable_job_collection_from_env(dynamodb):
+    """Enables mirroring if JOB_COLLECTION_TABLE is set, and reads if JOB_COLLECTION_READS is 'true' too"""
+    table_name = os.environ.get('JOB_COLLECTION_TABLE')
+    if table_name:
+        job_collection.enable(dynamodb.Table(table_name), reads=os.environ.get('JOB_COLLECTION_READS') == 'true')
+
+
+class JobAggregate(BaseModel):
+    """A job ticket with its schedule, reservations and conversation, as read from the collection"""
+    ticket: dict
+    schedule: Optional[dict]
+    reservations: List[dict] = []
+    conversation_id: Optional[str]
+
+    def reservation(self, reservation_id: str) -> Optional[dict]:
+        return next((r for r in self.reservations if r['id'] == reservation_id), None)
+
+
+class JobCollectionMigration(BaseModel):
+    """Counts of items copied into the collection by migrate_job_collection"""
+    tickets: int = 0
+    schedules: int = 0
+    reservations: int = 0
+    conversations: int = 0
+    skipped: int = 0  # already in the collection (tickets: at the same or a later version)
+    seconds: float = 0
+
+
+def mk_collection_item(ticket_id: str, sk: str, item: dict) -> dict:
+    return {**item, 'ticket_id': ticket_id, JOB_COLLECTION_SORT_KEY: sk}
+
+
+def _ticket_item(ticket: dict) -> dict:
+    return mk_collection_item(ticket['ticket_id'], TICKET_SK, ticket)
+
+
+def _reservation_item(reservation: dict) -> dict:
+    return mk_collection_item(reservation['ticket_id'], f'{RESERVATION_SK_PREFIX}{reservation["id"]}', reservation)
+
+
+def _schedule_item(schedule: dict) -> dict:
+    return mk_collection_item(schedule['ticket_id'], f'{SCHEDULE_SK_PREFIX}{schedule["ts"]}', schedule)
+
+
+def _conversation_item(ticket: dict, conversation_id: str) -> dict:
+    return mk_collection_item(ticket['ticket_id'], CONVERSATION_SK, {
+        'conversation_id': conversation_id,
+        'installer_id': ticket.get('installer_id'),
+        'customer_id': ticket.get('customer_id'),
+    })
+
+
+def _mirror(item: dict, transaction: Optional[DynamoTransaction] = None, condition=None):
+    if transaction is not None:
+        transaction.put(job_collection.table, item, condition=condition)
+        return
+    args = {'Item': mk_dynamo_record(item)}
+    if condition is not None:
+        args['ConditionExpression'] = condition
+    try:
+        job_collection.table.put_item(**args)
+    except ClientError as e:
+        # The source write already happened, so this only logs; the next write or a migration run fixes the copy
+        if is_conditional_check_failure(e):
+            logger.info(f'Newer copy of {item["ticket_id"]} {item[JOB_COLLECTION_SORT_KEY]} already in the collection')
+        else:
+            logger.exception(f'Failed to mirror {item["ticket_id"]} {item[JOB_COLLECTION_SORT_KEY]} into the job collection')
+
+
+def mirror_ticket(ticket: dict, transaction: Optional[DynamoTransaction] = None):
+    """
+    Copies a job ticket into the collection, unless a later version of it is
+    already there. ticket must carry the version it was written with.
+    """
+    if job_collection.table is None:
+        return
+    version = ticket.get(VERSION_ATTRIBUTE) or 0
+    condition = Attr(VERSION_ATTRIBUTE).not_exists() | Attr(VERSION_ATTRIBUTE).lte(version)
+    _mirror(_ticket_item(ticket), transaction, condition)
+
+
+def mirror_reservation(reservation: dict, transaction: Optional[DynamoTransaction] = None):
+    if job_collection.table is None or not reservation.get('ticket_id'):
+        return
+    _mirror(_reservation_item(reservation), transaction)
+
+
+def mirror_schedule(schedule: dict, transaction: Optional[DynamoTransaction] = None):
+    if job_collection.table is None:
+        return
+    _mirror(_schedule_item(schedule), transaction)
+
+
+def get_job_aggregate(ticket_id: str) -> Optional[JobAggregate]:
+    """
+    Reads the ticket and everything stored with it in one query. Returns None
+    if collection reads are off or the ticket isn't in the collection, in which
+    case callers read the source tables as before. Expired reservations are
+    left out.
+    """
+    if job_collection.table is None or not job_collection.reads:
+        return None
+    pk = DynamoPrimaryKey()
+    pk.partition = {'ticket_id': ticket_id}
+    ticket, schedule, reservations, conversation_id = None, None, [], None
+    for item in iter_query(job_collection.table, pk, exclude_expired=True):
+        sk = item.pop(JOB_COLLECTION_SORT_KEY)
+        if sk == TICKET_SK:
+            ticket = item
+        elif sk == CONVERSATION_SK:
+            conversation_id = item['conversation_id']
+        elif sk.startswith(RESERVATION_SK_PREFIX):
+            reservations.append(item)
+        elif sk.startswith(SCHEDULE_SK_PREFIX) and schedule is None:
+            schedule = item
+    if ticket is None:
+        logger.info(f'Job {ticket_id} is not in the job collection')
+        return None
+    return JobAggregate(ticket=ticket, schedule=schedule, reservations=reservations,
+                        conversation_id=ticket.get('conversation_id') or conversation_id)
+
+
+def migrate_job_collection(collection_table, jobs_table, job_schedule_table, reservations_table, messages_table=None,
+                           max_workers=DEFAULT_BATCH_WORKERS) -> JobCollectionMigration:
+    """
+    Copies every job ticket, schedule row and ticket reservation into the
+    collection. Items already there are left alone, since mirrored writes keep
+    them current, so it is safe to run while mirroring is on and to re-run.
+    The exception is a ticket copy with an older version than the jobs table,
+    left behind by a mirrored write that failed, which is overwritten.
+
+    With messages_table, tickets without a conversation_id get a conversation
+    pointer, looked up the way fill_out_job_ticket does.
+    """
+    started = time.monotonic()
+    stats = JobCollectionMigration()
+
+    def copy(args):
+        kind, item = args
+        condition = None
+        if kind == 'tickets':
+            condition = Attr(VERSION_ATTRIBUTE).lt(item.get(VERSION_ATTRIBUTE) or 0)
+        try:
+            create_dynamo_record_if_absent(collection_table, item, JOB_COLLECTION_SORT_KEY, condition=condition)
+            return kind
+        except RecordAlreadyExists:
+            return 'skipped'
+
+    def items():
+        for ticket in iter_parallel_scan(jobs_table):
+            yield 'tickets', _ticket_item(ticket)
+            if messages_table is not None and not ticket.get('conversation_id') and ticket.get('installer_id'):
+                conversation_id = find_conversation(messages_table, ticket['installer_id'], ticket.get('customer_id'))
+                if conversation_id:
+                    yield 'conversations', _conversation_item(ticket, conversation_id)
+        for schedule in iter_parallel_scan(job_schedule_table):
+            yield 'schedules', _schedule_item(schedule)
+        for reservation in iter_parallel_scan(reservations_table):
+            if reservation.get('ticket_id'):
+                yield 'reservations', _reservation_item(reservation)
+
+    # executor.map would submit the whole scan up front, so copy it a chunk at a time
+    pending, chunk_size = items(), max_workers * MIGRATION_CHUNKS_PER_WORKER
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            chunk = list(islice(pending, chunk_size))
+            if not chunk:
+                break
+            for kind in executor.map(with_context(copy), chunk):
+                setattr(stats, kind, getattr(stats, kind) + 1)
+    stats.seconds = time.monotonic() - started
+    logger.info(f'Migrated jobs into {collection_table.name}: {stats.dict()}')
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m rctools.job_collection')
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate = commands.add_parser('migrate', help='copy the existing jobs into the collection table')
+    for name in ('collection', 'jobs', 'job-schedule', 'reservations'):
+        migrate.add_argument(f'--{name}-table', required=True)
+    migrate.add_argument('--messages-table', help='also add conversation pointers for tickets without one')
+    migrate.add_argument('--workers', type=int, default=DEFAULT_BATCH_WORKERS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    dynamodb = get_resource('dynamodb')
+    stats = migrate_job_collection(
+        dynamodb.Table(args.collection_table), dynamodb.Table(args.jobs_table), dynamodb.Table(args.job_schedule_table),
+        dynamodb.Table(args.reservations_table),
+        messages_table=dynamodb.Table(args.messages_table) if args.messages_table else None,
+        max_workers=args.workers,
+    )
+    print(stats.json())
+
+
+if __name__ == '__main__':
+    main()
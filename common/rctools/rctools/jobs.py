@@ -2,22 +2,28 @@ import json
 import logging
 import random
 
-from rctools.aws.s3 import get_object_from_s3, put_object_into_s3
+from rctools.aws.s3 import get_object_from_s3, get_objects_from_s3, put_object_into_s3
 
 from mergedeep import merge, Strategy
 from pydantic import ValidationError
-from typing import List
-from rctools.aws.dynamodb import create_dynamo_record, Key, scan_by_attributes, update_dynamo_record
+from typing import List, Optional
+from rctools.aws.cache import get_cached_item
+from rctools.aws.dynamodb import (DEFAULT_SCAN_SEGMENTS, VERSION_ATTRIBUTE, DynamoTransaction, create_dynamo_record, Key,
+                                  scan_by_attributes, update_versioned_dynamo_record)
 from rctools.customers import get_customer
 from rctools.exceptions import CustomerNotAuthorizedToEditTicket
+from rctools.job_collection import mirror_ticket
 from rctools.messages import find_conversation
+from rctools.uploads import complete_upload, create_upload, download_url
 
-from rctools.models import JobTicket, JobTier
+from rctools.models import JobPhoto, JobTicket, JobTier, PresignedUpload
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Attributes needed by list views that don't render the job scope
+JOB_TICKET_SUMMARY_ATTRIBUTES = ['ticket_id', 'ts', 'installer_id', 'customer_id']
 
 BI_1 = JobTier(
     name='BI-1',
@@ -118,7 +124,7 @@ AI80_3 = JobTier(
 
 def add_photo_to_s3(s3_client, bucket, id, data):
     s3_path = f"photos/{id}/{data.photo_id}.json"
-    put_object_into_s3(s3_client, bucket, s3_path, json.dumps(data))
+    put_object_into_s3(s3_client, bucket, s3_path, json.dumps(data.dict()))
 
 
 def add_note_to_s3(s3_client, bucket, id, data):
@@ -134,51 +140,84 @@ def get_job_notes(s3_client, bucket, ticket_id, note_ids):
     return notes
 
 
-def get_job_photos(s3_client, bucket, ticket_id, photo_ids):
+def get_job_photos(s3_client, bucket, ticket_id, photo_ids) -> List[dict]:
+    """Returns the photos' metadata, with a presigned GET URL as the uri of directly uploaded ones"""
+    objects = get_objects_from_s3(s3_client, bucket, [f"photos/{ticket_id}/{id}.json" for id in photo_ids])
     photos = []
-    for id in photo_ids:
-        s3_path = f"notes/{ticket_id}/{id}.json"
-        photos.append(get_object_from_s3(s3_client, bucket, s3_path))
+    for photo in objects.values():
+        if photo is None:
+            continue
+        if photo.get('key'):
+            photo['uri'] = download_url(s3_client, bucket, photo['key'])
+        photos.append(photo)
     return photos
 
 
+def create_job_photo_upload(table, s3_client, bucket, ticket_id, customer_id, content_type) -> PresignedUpload:
+    """Returns a presigned upload for a new photo of the customer's job, see rctools.uploads"""
+    job = get_job_ticket(table, ticket_id)
+    if job['customer_id'] != customer_id:
+        raise CustomerNotAuthorizedToEditTicket()
+    return create_upload(s3_client, bucket, f'photos/{ticket_id}', content_type)
+
+
+def complete_job_photo_upload(table, s3_client, bucket, ticket_id, customer_id, photo_id, caption=None) -> JobPhoto:
+    """Records a finished photo upload on the job ticket and in the photo bucket"""
+    uploaded = complete_upload(s3_client, bucket, f'photos/{ticket_id}', photo_id)
+    photo = JobPhoto(photo_id=photo_id, uid=customer_id, ticket_id=ticket_id, caption=caption, **uploaded.dict())
+    add_photo_to_job_ticket(table, photo_id, ticket_id, customer_id)
+    add_photo_to_s3(s3_client, bucket, ticket_id, photo)
+    photo.uri = download_url(s3_client, bucket, photo.key)
+    return photo
+
+
 def add_note_to_job_ticket(table, note_id, ticket_id, customer_id):
     """Adds note_id to job ticket"""
     job = get_job_ticket(table, ticket_id)
-    if job.customer_id != customer_id:
+    if job['customer_id'] != customer_id:
         raise CustomerNotAuthorizedToEditTicket()
-    job_ticket = job.dict()
-    if not job_ticket.get('notes'):
-        job.notes = []
-    job.notes.append(note_id)
-    update_job_ticket(table, job.dict(), ticket_id, customer_id)
+    notes = (job.get('notes') or []) + [note_id]
+    update_job_ticket(table, {'notes': notes}, ticket_id, customer_id, job_ticket=job)
 
 
 def add_photo_to_job_ticket(table, photo_id, ticket_id, customer_id):
     """Adds photo_id to job ticket"""
     job = get_job_ticket(table, ticket_id)
-    if job.customer_id != customer_id:
+    if job['customer_id'] != customer_id:
         raise CustomerNotAuthorizedToEditTicket()
-    job_ticket = job.dict()
-    if not job_ticket.get('photos'):
-        job.photos = []
-    job.photos.append(photo_id)
-    update_job_ticket(table, job.dict(), ticket_id, customer_id)
+    if photo_id in (job.get('photos') or []):
+        return  # already added, e.g. an upload completed twice
+    photos = (job.get('photos') or []) + [photo_id]
+    update_job_ticket(table, {'photos': photos}, ticket_id, customer_id, job_ticket=job)
 
 
 # def get_job_ticket(table, id) -> JobTicket:  # XXX returning a di
-def get_job_ticket(table, id) -> dict:
-    response = table.query(KeyConditionExpression=Key('ticket_id').eq(id))
+def get_job_ticket(table, id, consistent: bool = False) -> dict:
+    """
+    Returns the job ticket, served from the item cache while it is fresh, or
+    with a consistent read straight from the table when consistent is set,
+    e.g. when the ticket is the version base of a conditional write
+    """
+    if consistent:
+        item = _query_job_ticket(table, id, consistent=True)
+    else:
+        item = get_cached_item(table, {'ticket_id': id}, lambda: _query_job_ticket(table, id))
+    if item is None:
+        logger.warn('No job ticket found.')
+    return item
+
+
+def _query_job_ticket(table, id, consistent: bool = False) -> Optional[dict]:
+    response = table.query(KeyConditionExpression=Key('ticket_id').eq(id), ConsistentRead=consistent)
     items = response.get('Items', None)
     if items:
         logger.info(f'Returning job ticket from dynamo {items[0]}')
         return items[0]
-    logger.warn('No job ticket found.')
 
 
 # def get_job_tickets(table) -> List[JobTicket]:
-def get_job_tickets(table) -> List[dict]: 
-    items, _ = scan_by_attributes(table)
+def get_job_tickets(table, attributes: Optional[List[str]] = None) -> List[dict]: 
+    items, _ = scan_by_attributes(table, total_segments=DEFAULT_SCAN_SEGMENTS, attributes=attributes, fast=True)
     tickets = []
     if items:
         for i in items:
@@ -214,20 +253,36 @@ def put_new_job(table, data) -> dict:
     job = JobTicket(**data).dict()
     resp = create_dynamo_record(table, job)
     logger.info(f'Results from dynamo {resp}')
+    mirror_ticket(job)
     return job['ticket_id']
 
 
-def update_job_ticket(table, data, id, customer_id) -> str:
-    """Update existing job ticket in jobs table"""
+def update_job_ticket(table, data, id, customer_id, job_ticket: Optional[dict] = None,
+                      transaction: Optional[DynamoTransaction] = None) -> str:
+    """
+    Update existing job ticket in jobs table
+
+    Pass the ticket as job_ticket if it was already read to save a round trip.
+    If a transaction is given the update is staged into it, conditional on the
+    ticket not having changed since it was read, instead of being retried.
+    """
     logger.info(f'Attaching data {data} to {id}')
-    job_ticket = get_job_ticket(table, id)
-    if job_ticket['customer_id'] != customer_id:
-        raise CustomerNotAuthorizedToEditTicket()
- 
-    logger.info(f'Before job ticket {job_ticket["job_scope"]}')
-    updated_ticket = JobTicket(**merge({}, job_ticket, data))  # validate new object
-    update_data = updated_ticket.dict()
-    logger.info(f'New job ticket {update_data["job_scope"]}')
-    update_dynamo_record(table, {'ticket_id': update_data.pop('ticket_id'), 'ts': update_data.pop('ts')}, update_data)
-    
-    return updated_ticket.ticket_id
+    job_ticket = job_ticket or get_job_ticket(table, id)
+
+    def apply(current):
+        if current['customer_id'] != customer_id:
+            raise CustomerNotAuthorizedToEditTicket()
+        logger.info(f'Before job ticket {current["job_scope"]}')
+        updated_ticket = JobTicket(**merge({}, current, data))  # validate new object
+        logger.info(f'New job ticket {updated_ticket.job_scope}')
+        return updated_ticket.dict()
+
+    pk = {'ticket_id': job_ticket['ticket_id'], 'ts': job_ticket['ts']}
+    if transaction is not None:
+        new = apply(job_ticket)
+        version = transaction.update_versioned(table, pk, job_ticket, new)
+        if version is not None:
+            mirror_ticket({**new, VERSION_ATTRIBUTE: version}, transaction=transaction)
+    else:
+        mirror_ticket(update_versioned_dynamo_record(table, pk, apply, current=job_ticket))
+    return job_ticket['ticket_id']
@@ -3,8 +3,8 @@ from typing import List, Literal, Optional
 from uuid import uuid4
 from rctools.alerts import create_new_message_alert
 
-from rctools.aws.dynamodb import (KEY_COND_GTE, DynamoPrimaryKey,
-                                  create_dynamo_record, fetch_items_by_pk)
+from rctools.aws.dynamodb import (KEY_COND_BETWEEN, KEY_COND_GTE, KEY_COND_LT, DynamoPrimaryKey, DynamoTransaction,
+                                  create_dynamo_record, fetch_items_by_pk, query_partitions)
 from rctools.models import Message
 from rctools.models.users import Installer
 from rctools.utils import mk_timestamp
@@ -45,17 +45,33 @@ def get_latest_message(table: str, conversation_id: str) -> Message:
     return items[0]
 
 
-def get_messages_for_conversation(table: str, conversation_id: str, ts: Optional[int] = 0, cursor_token: Optional[str] = None, limit: Optional[int] = None) -> List[Message]:
+def get_latest_messages(table: str, conversation_ids: List[str]) -> List[Message]:
+    """
+    Returns the latest message of each conversation, in the order given. The
+    conversations are queried concurrently.
+    """
+    logger.info(f'Fetching latest messages for {len(conversation_ids)} conversation(s)')
+    latest = query_partitions(table, 'conversation_id', conversation_ids, max_items_per_key=1, ScanIndexForward=False)
+    return [items[0] for items in latest.values() if items]
+
+
+def get_messages_for_conversation(table: str, conversation_id: str, ts: Optional[int] = 0, cursor_token: Optional[str] = None, limit: Optional[int] = None, before: Optional[int] = None) -> List[Message]:
     """
     Returns messages for a given conversation. Either returns all messages or messages
-    after a given timestamp (ts)
+    after a given timestamp (ts) and/or before another timestamp (before)
     """
     logger.info(f'Fetching messages for conversation {conversation_id}')
     pk = DynamoPrimaryKey()
     pk.partition = {'conversation_id': conversation_id}
-    if ts:
+    if ts and before:
+        pk.sort = {'ts': (ts, before - 1)}
+        pk.sort.comparator = KEY_COND_BETWEEN
+    elif ts:
         pk.sort = {'ts': ts}
         pk.sort.comparator = KEY_COND_GTE
+    elif before:
+        pk.sort = {'ts': before}
+        pk.sort.comparator = KEY_COND_LT
     messages, pagination_token = [], cursor_token
     while True:
         items, new_cursor_token = fetch_items_by_pk(table, pk, cursor_token=pagination_token, limit=limit, ScanIndexForward=False)
@@ -75,38 +91,46 @@ def find_conversation(table: str, installer_id: str, customer_id: str) -> str:
             return c['conversation_id']
 
 
-def post_message_to_conversation(table: str, message: Message) -> Message:
+def post_message_to_conversation(table: str, message: Message, transaction: Optional[DynamoTransaction] = None) -> Message:
     """
     Adds a message to a given conversation
     """
     logger.info(f'Posting message to conversation {message}')
-    create_dynamo_record(table, message.dict())
+    put = transaction.put if transaction is not None else create_dynamo_record
+    put(table, message.dict())
     return message
 
 
-def start_conversation(table: str, installer_data: dict, installer_id: str, customer_id: str) -> str:
+def start_conversation(table: str, installer_data: dict, installer_id: str, customer_id: str,
+                       transaction: Optional[DynamoTransaction] = None) -> str:
     """
     Creates conversation-start indexes for both installer and customer users. Returns
     the newly created conversation_id
+
+    If a transaction is given the writes are staged into it instead.
     """
     logger.info(f'Starting conversation between installer {installer_id} and customer {customer_id}')
+    put = transaction.put if transaction is not None else create_dynamo_record
     conversation_id = str(uuid4())
     # Start conversation
-    create_dynamo_record(table,  Message(**{
+    start = Message(**{
         'conversation_id': conversation_id,
         'conversation_start': 1, 
         'installer_id': installer_id, 
         'customer_id': customer_id,
-    }).dict())
+    })
+    put(table, start.dict())
 
     # Add automated message
     installer = Installer(**installer_data)
     txt = f'Hi, I\'m {installer.get_first_name()}. I am your certified installer. I am receiving all of the job information now and will follow up with you soon if I have any questions.'
-    post_message_to_conversation(table, Message(**{
+    message = Message(**{
         'conversation_id': conversation_id,
         'installer_id': installer_id,
         'text': txt
-    }))
+    })
+    message.ts = max(message.ts, start.ts + 1)  # same key as the conversation start if created in the same ms
+    post_message_to_conversation(table, message, transaction=transaction)
     # With customer message alert
     create_new_message_alert(customer_id, txt)
     return conversation_id
@@ -1,10 +1,10 @@
 from enum import Enum
 from typing import List, Optional
 
-from rctools.models.base import IdMixin, ReadiChargeBaseModel, TimestampMixin
+from rctools.models.base import ExpiryMixin, IdMixin, ReadiChargeBaseModel, TimestampMixin
 
 
-class Alert(IdMixin, TimestampMixin, ReadiChargeBaseModel):
+class Alert(IdMixin, TimestampMixin, ExpiryMixin, ReadiChargeBaseModel):
     class AlertTypes(str, Enum):
         message = 'message'   # icon: chat bubble
         notification = 'notification'  # icon: bell
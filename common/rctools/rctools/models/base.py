@@ -30,6 +30,11 @@ class TimestampMixin(BaseModel):
         return value or mk_timestamp()
 
 
+class ExpiryMixin(BaseModel):
+    """For items DynamoDB deletes once expired; TimeToLive is epoch seconds (see rctools.aws.dynamodb.mk_ttl)"""
+    TimeToLive: Optional[int]
+
+
 class ReadiChargeBaseModel(DateTimeModelMixin, BaseModel):
     """BaseModel superclass that will always fail if extra attributes are included"""
     class Config:
@@ -2,7 +2,7 @@ from typing import List, Optional
 from uuid import uuid4
 from pydantic import Extra
 
-from rctools.models.base import IdMixin, TimestampMixin, ReadiChargeBaseModel
+from rctools.models.base import ExpiryMixin, IdMixin, TimestampMixin, ReadiChargeBaseModel
 
 from .users import SupportRequest
 
@@ -23,9 +23,12 @@ class JobNote(ReadiChargeBaseModel):
 class JobPhoto(ReadiChargeBaseModel):
     photo_id: Optional[str] # TODO, change to just id
     uid: str
-    uri: str
+    uri: Optional[str]  # for direct uploads, a presigned GET URL added when the photo is read
     ticket_id: str
     caption: Optional[str]
+    key: Optional[str]  # where a direct upload is stored in the photo bucket, see rctools.uploads
+    content_type: Optional[str]
+    size: Optional[int]
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -160,6 +163,7 @@ class JobTicket(TimestampMixin, ReadiChargeBaseModel):
     support_request: Optional[SupportRequest]
     completed: Optional[bool]
     reschedule: Optional[bool]
+    version: Optional[int]  # optimistic locking, see update_versioned_dynamo_record
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -171,7 +175,7 @@ class JobsResponse(ReadiChargeBaseModel):
     jobs: Optional[List[JobTicket]] = []
 
 
-class Reservation(IdMixin, TimestampMixin, ReadiChargeBaseModel):
+class Reservation(IdMixin, TimestampMixin, ExpiryMixin, ReadiChargeBaseModel):
     installer_id: Optional[str]
     customer_id: Optional[str]
     start_time: Optional[str]
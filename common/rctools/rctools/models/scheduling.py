@@ -4,8 +4,7 @@ import logging
 from datetime import datetime
 from typing import Dict, List, Optional
 
-from rctools.aws.dynamodb import DynamoPrimaryKey, fetch_items_by_gsi
-from rctools.exceptions import ReservationConflict
+from rctools.aws.dynamodb import KEY_COND_GTE, DynamoPrimaryKey, iter_query, query_partitions
 from rctools.installers import (in_installer_scope, in_service_area)
 from rctools.models.base import ReadiChargeBaseModel
 from rctools.models.jobs import Reservation
@@ -19,6 +18,7 @@ logger.setLevel(logging.INFO)
 DATE_FORMAT = '%Y-%m-%d'
 
 RESERVATION_EXPIRATION_TIME = 90 * 60 * 1000 # 1.5 hours to ms
+RESERVATION_INSTALLER_INDEX = 'installer_id_ttl'  # projects reservation_date and TimeToLive
 STRATEGY__FIRST_AVAILABLE = 'strategy__first_available'
 STRATEGY__PRIORITIZE_RATINGS = 'strategy__prioritize_ratings'
 
@@ -112,49 +112,53 @@ class StrategyFirstAvailable(Strategy):
 
     def get_available_installers(self, current_day: Day, installers: List[Installer], job_tier: Dict, job_zip: str, reservations_table) -> List[Installer]:
         """Returns the list of installers available for a given day"""
-        available = []
+        candidates = []
         for installer in installers:
-            uid = installer['Username']
             # if i.rating < self.min_rating:
             #     continue
-            try:
-                current_time = mk_timestamp()
-                if installer.get('scheduling') and installer.get('service_options') and installer.get('zip'):  # XXX for bad users, maybe check finished onboarding
-                    # check if they are willing to do this type of job and close enough to qualify
-                    if in_installer_scope(installer['service_options'], job_tier['name']) and in_service_area(installer['zip'], job_zip):
-                        # assuming an installer cannot have two reservations in the same day
-                        reservations = get_installer_reservations(reservations_table, uid)
-                        for res in reservations: 
-                           if res['reservation_date'] == current_day and current_time - res['ts'] <= RESERVATION_EXPIRATION_TIME:
-                                print('found resevation for date', res)
-                                raise ReservationConflict()
-
-                        installer['Username'] = uid
-                        available.append(installer)
-
-            except ReservationConflict:
-                logger.info(f'Found reservation {res} for day {current_day}')
+            if installer.get('scheduling') and installer.get('service_options') and installer.get('zip'):  # XXX for bad users, maybe check finished onboarding
+                # check if they are willing to do this type of job and close enough to qualify
+                if in_installer_scope(installer['service_options'], job_tier['name']) and in_service_area(installer['zip'], job_zip):
+                    candidates.append(installer)
+
+        current_time = mk_timestamp()
+        reservations = get_reservations_for_installers(reservations_table, [i['Username'] for i in candidates],
+                                                       since=current_time - RESERVATION_EXPIRATION_TIME)
+        available = []
+        for installer in candidates:
+            # assuming an installer cannot have two reservations in the same day
+            conflicts = [res for res in reservations[installer['Username']] if res.get('reservation_date') == current_day.ts]
+            if conflicts:
+                logger.info(f'Found reservation {conflicts[0]} for day {current_day}')
                 continue
-           
+            available.append(installer)
         return available
 
 
-def get_installer_reservations(jobs_table, installer_id) -> List[Reservation]:
+def get_installer_reservations(jobs_table, installer_id, since: Optional[int] = None) -> List[Reservation]:
     """
-    Queries a dyanmo table for any reservations assigned to the installer after the
-    given timestamp
+    Queries a dyanmo table for any unexpired reservations assigned to the installer
+    after the given timestamp. Expired ones are filtered out server-side, which
+    needs TimeToLive projected into RESERVATION_INSTALLER_INDEX along with reservation_date.
     """
     logger.info(f'Checking for reservations for installer {installer_id}')
     pk = DynamoPrimaryKey()
     pk.partition = {'installer_id': installer_id}
-    # pk.sort = {'ts': ts}   # TODO use a reasonable GTE time so we don't pull _everything_
-    # pk.sort.comparator = KEY_COND_GTE 
-    reservations, pagination_token = [], None
-    while True:
-        items, cursor_token = fetch_items_by_gsi(jobs_table, pk, 'installer_id', cursor_token=pagination_token)
-        pagination_token = cursor_token
-        if not pagination_token:
-            break
-        reservations += items
+    if since:
+        pk.sort = {'ts': since}
+        pk.sort.comparator = KEY_COND_GTE
+    reservations = list(iter_query(jobs_table, pk, index=RESERVATION_INSTALLER_INDEX, exclude_expired=True))
     logger.info(f'Returning {len(reservations)} reservations(s)')
     return reservations
+
+
+def get_reservations_for_installers(reservations_table, installer_ids: List[str], since: Optional[int] = None) -> Dict[str, List[Reservation]]:
+    """
+    Same as get_installer_reservations for several installers at once, keyed by
+    installer ID. The installers are queried concurrently.
+    """
+    sort = None
+    if since:
+        sort = DynamoPrimaryKey.KeyQuery(key='ts', value=since, comparator=KEY_COND_GTE)
+    return query_partitions(reservations_table, 'installer_id', installer_ids, sort=sort,
+                            index=RESERVATION_INSTALLER_INDEX, exclude_expired=True)
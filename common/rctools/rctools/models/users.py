@@ -222,11 +222,36 @@ class FileUploadResponse(ReadiChargeBaseModel):
     path: str
 
 
+class UploadRequest(ReadiChargeBaseModel):
+    """What an app is about to upload directly to S3"""
+    content_type: str
+
+
+class PresignedUpload(ReadiChargeBaseModel):
+    """
+    Where to upload a file directly to S3: POST url as multipart/form-data with
+    fields, then the file, before expires_at
+    """
+    upload_id: str
+    key: str
+    url: str
+    fields: Dict[str, str]
+    expires_at: int
+
+
 class InstallerImage(ReadiChargeBaseModel):
-    image_id: str = str(uuid4())
+    image_id: Optional[str]
     uid: str
-    uri: str
+    uri: Optional[str]  # for direct uploads, a presigned GET URL added when the image is read
     type: str
+    key: Optional[str]  # where a direct upload is stored in the user data bucket, see rctools.uploads
+    content_type: Optional[str]
+    size: Optional[int]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if not self.image_id:
+            self.image_id = str(uuid4())
 
 class NewCustomerResponse(ReadiChargeBaseModel):
     user_id: Optional[str]
@@ -1,16 +1,20 @@
 import logging
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from pydantic import ValidationError
 
-from rctools.aws.dynamodb import (KEY_COND_GTE, DynamoPrimaryKey, Key,
-                                  create_dynamo_record, fetch_items_by_gsi, fetch_items_by_pk,
-                                  scan_by_attributes)
+from rctools.aws.cache import get_cached_item
+from rctools.aws.dynamodb import (DEFAULT_SCAN_SEGMENTS, KEY_COND_BETWEEN, KEY_COND_GTE, KEY_COND_LTE, Attr, DynamoPrimaryKey,
+                                  DynamoTransaction, Key, batch_get, create_dynamo_record, create_dynamo_record_if_absent,
+                                  iter_query, mk_ttl, scan_by_attributes)
+from rctools.exceptions import RecordAlreadyExists, ReservationConflict
+from rctools.job_collection import mirror_reservation, mirror_schedule
 from rctools.models.users import Installer
 from rctools.models.jobs import JobSchedule, Reservation
-from rctools.models.scheduling import Day, Job, Strategy, StrategyFirstAvailable
+from rctools.models.scheduling import RESERVATION_EXPIRATION_TIME, RESERVATION_INSTALLER_INDEX, Day, Job, Strategy, StrategyFirstAvailable
+from rctools.utils import mk_timestamp
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -29,6 +33,8 @@ TOTAL_NUMBER_OF_DAYS_TO_OFFER = 28  # number of days to calculate available time
 WEEKLY_MINIMUM_RATING_DECAY = .75  # the amount
 MINIMUM_START_TIME = '0000' # minimum start time a job can be scheduled
 MAXIMUM_END_TIME = '2300'# maximum end time a job can be scheduled
+RESERVATION_SLOT_PREFIX = 'slot#'  # id prefix of the lock items that hold an installer's day
+RESERVATION_SLOT_TS = 0
 
 
 # have to approximate drive time between jobs
@@ -161,25 +167,60 @@ def get_organized_schedule(scheduled_jobs: List[Job]):
     return organized
 
 
+def claim_reservation_slot(reservations_table, reservation: dict):
+    """
+    Holds the installer's reservation day with a conditional put on a lock item,
+    which only succeeds if the day is free or the previous hold has expired.
+    Raises ReservationConflict otherwise.
+
+    The lock item carries no installer_id so it stays out of the installer_id index,
+    and expires with the reservation.
+    """
+    now = mk_timestamp()
+    slot = {
+        'id': f'{RESERVATION_SLOT_PREFIX}{reservation["installer_id"]}#{reservation["reservation_date"]}',
+        'ts': RESERVATION_SLOT_TS,
+        'reservation_id': reservation['id'],
+        'expires_at': reservation['ts'] + RESERVATION_EXPIRATION_TIME,
+        'TimeToLive': reservation['TimeToLive'],
+    }
+    try:
+        create_dynamo_record_if_absent(reservations_table, slot, 'id', condition=Attr('expires_at').lt(now))
+    except RecordAlreadyExists as e:
+        raise ReservationConflict(f'{slot["id"]} is already reserved') from e
+
+
 def create_reservation(reservations_table, data):
-    """Posts a new reservation in the reservations table"""
+    """
+    Posts a new reservation in the reservations table, raising ReservationConflict
+    if the slot is taken. DynamoDB deletes it once RESERVATION_EXPIRATION_TIME passes.
+    """
     logger.info(f'Creating reservation with {data}')
-    reservation = Reservation(**data).dict()
+    reservation = Reservation(**data)
+    reservation.TimeToLive = mk_ttl(RESERVATION_EXPIRATION_TIME / 1000, since=reservation.ts)
+    reservation = reservation.dict()
+    claim_reservation_slot(reservations_table, reservation)
     resp = create_dynamo_record(reservations_table, reservation)
     logger.info(f'Results from dynamo {resp}')
+    mirror_reservation(reservation)
     reservation_id = reservation['id']
     logger.info(f'reservation {reservation_id} created!')
     return reservation_id
 
 
-def add_job_to_schedule(job_schedule_table, data, ticket_id):
-    """Posts a new job schedule in JobScheduleTable from reservation data"""
+def add_job_to_schedule(job_schedule_table, data, ticket_id, transaction: Optional[DynamoTransaction] = None):
+    """
+    Posts a new job schedule in JobScheduleTable from reservation data, or stages
+    it into the given transaction
+    """
     logger.info(f'Creating job schedule with {data}')
     reservations_date = data.pop('reservation_date')
     job_schedule = JobSchedule(**data).dict()
     job_schedule['job_schedule_date'] = reservations_date
     job_schedule['ticket_id'] = ticket_id
-    resp = create_dynamo_record(job_schedule_table, job_schedule)
+    put = transaction.put if transaction is not None else create_dynamo_record
+    resp = put(job_schedule_table, job_schedule)
+    mirror_schedule(job_schedule, transaction=transaction)
 
     logger.info(f'Results from dynamo {resp}')
     job_schedule_id = job_schedule['job_schedule_id']
@@ -188,18 +229,26 @@ def add_job_to_schedule(job_schedule_table, data, ticket_id):
 
 
 def get_reservation_by_id(table, id) -> dict:
+    item = get_cached_item(table, {'id': id}, lambda: _query_reservation(table, id))
+    if item is None:
+        logger.warn('No reservation found.')
+    return item
+
+
+def _query_reservation(table, id) -> Optional[dict]:
     response = table.query(KeyConditionExpression=Key('id').eq(id))
     items = response.get('Items', None)
     if items:
         return items[0]
-    logger.warn('No reservation found.')
 
 
 def get_reservations(table) -> List[dict]: 
-    items, _ = scan_by_attributes(table)
+    items, _ = scan_by_attributes(table, total_segments=DEFAULT_SCAN_SEGMENTS)
     reservations = []
     if items:
         for i in items:
+            if i['id'].startswith(RESERVATION_SLOT_PREFIX):
+                continue
             try:
                 reservations.append(Reservation(**i))
             except ValidationError:
@@ -207,24 +256,24 @@ def get_reservations(table) -> List[dict]:
     return reservations
 
 
-def get_installer_reservations_by_id(table, installer_id) -> List[Reservation]:
+def get_installer_reservations_by_id(table, installer_id, since: Optional[int] = None, until: Optional[int] = None) -> List[Reservation]:
     """
-    Queries a dyanmo table for any reservations assigned to the installer after the
-    given timestamp
+    Queries a dyanmo table for any unexpired reservations assigned to the installer
+    after the given timestamp, and optionally up to a second timestamp (inclusive)
     """
     logger.info(f'Checking for reservations for installer {installer_id}')
     pk = DynamoPrimaryKey()
     pk.partition = {'installer_id': installer_id}
-    # pk.sort = {'ts': ts}
-    # pk.sort.comparator = KEY_COND_GTE
-    reservations, pagination_token = [], None
-    while True:
-        items, cursor_token = fetch_items_by_pk(table, pk, cursor_token=pagination_token)
-        reservations += items
-        pagination_token = cursor_token
-        if not pagination_token:
-            break
-    return reservations
+    if since and until:
+        pk.sort = {'ts': (since, until)}
+        pk.sort.comparator = KEY_COND_BETWEEN
+    elif since:
+        pk.sort = {'ts': since}
+        pk.sort.comparator = KEY_COND_GTE
+    elif until:
+        pk.sort = {'ts': until}
+        pk.sort.comparator = KEY_COND_LTE
+    return list(iter_query(table, pk, index=RESERVATION_INSTALLER_INDEX, exclude_expired=True))
 
 
 def get_scheduled_job(table, id) -> dict:
@@ -236,30 +285,19 @@ def get_scheduled_job(table, id) -> dict:
     logger.warn('No job ticket found.')
 
 
-def get_customer_scheduled_jobs_from_dynamo(job_schedule_table, installer_id, limit=20):
+def get_customer_scheduled_jobs_from_dynamo(job_schedule_table, installer_id, limit: Optional[int] = None):
     """
-    Queries a dyanmo table for any jobs assigned to the customer
+    Queries a dyanmo table for any jobs assigned to the customer, at most limit of them if given
     """
     logger.info(f'Checking for jobs for user {installer_id}')
     pk = DynamoPrimaryKey()
     pk.partition = {'installer_id': installer_id}
     # pk.sort = {'ts': mk_timestamp()}
     
-    scheduled_jobs, pagination_token = [], None
-    while True:
-        # Query the customer's tickets using the jobs table
-        items, cursor_token = fetch_items_by_gsi(job_schedule_table, pk, 'installer_id', cursor_token=pagination_token)
-        # Then pull the whole ticket
-        for i in items:
-            schedule_pk = DynamoPrimaryKey()
-            schedule_pk.partition = {'ticket_id': i['ticket_id']}
-            logger.info(f'Fetching ticket_id {i["ticket_id"]}')
-            job_items, _ = fetch_items_by_pk(job_schedule_table, schedule_pk)
-            scheduled_jobs += job_items
-        pagination_token = cursor_token
-        if len(items) > limit:
-            break
-        if not pagination_token:
-            break
+    # Query the scheduled job keys using the job schedule table index
+    keys = [{'ticket_id': i['ticket_id'], 'ts': i['ts']}
+            for i in iter_query(job_schedule_table, pk, index='installer_id', max_items=limit)]
+    # Then pull the whole schedule rows
+    scheduled_jobs = batch_get(job_schedule_table, keys)
     logger.info(f'Returning {len(scheduled_jobs)} job(s)')
     return scheduled_jobs
\ No newline at end of file
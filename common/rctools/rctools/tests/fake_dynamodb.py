@@ -0,0 +1,1144 @@
+"""
+In-memory stand-in for DynamoDB, for tests and offline benchmarks.
+
+FakeDynamoDB keeps tables with real key and GSI semantics and serves the
+Table resource and client calls the rctools helpers make: get_item,
+put_item, update_item, delete_item, query, scan (including Segment and
+TotalSegments), batch_get_item, batch_write_item, transact_get_items and
+transact_write_items. Limit/ExclusiveStartKey paging, the 1MB page limit,
+condition, update and projection expressions and DynamoDB's errors
+(ConditionalCheckFailedException, TransactionCanceledException, ...) behave
+like the real service.
+
+Every call is charged capacity the way DynamoDB charges it (4KB read units,
+halved for eventually consistent reads, 1KB write units plus index writes,
+transactions at double cost) and a simulated latency. The charges are kept
+in a RequestMetrics (see rctools.aws.metrics), and in the open
+collect_dynamodb_metrics block if there is one, so the cost of a helper can
+be measured deterministically:
+
+    fake = FakeDynamoDB()
+    jobs = fake.create_table('jobs', ('ticket_id', 'ts'), indexes={'customer_id': ('customer_id', 'ts', 'KEYS_ONLY')})
+    get_customer_jobs_from_dynamo(jobs, 'c1')
+    fake.metrics.summary(), fake.clock
+
+Reads made with fast=True go through the tables' meta.low_level_client,
+which serves them from the same data. It lives with the tests, so it isn't
+shipped in the rctools package.
+"""
+import bisect
+import copy
+import math
+import re
+import threading
+import time
+import zlib
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+from rctools.aws.metrics import RequestMetrics, current_dynamodb_metrics
+
+READ_UNIT_BYTES = 4096
+WRITE_UNIT_BYTES = 1024
+MAX_PAGE_BYTES = 1024 * 1024
+MAX_BATCH_GET_KEYS = 100
+MAX_BATCH_WRITE_ITEMS = 25
+MAX_TRANSACT_ITEMS = 100
+
+# Simulated latency of a call: a fixed round trip plus a cost per KB read or written
+DEFAULT_CALL_LATENCY = 0.004
+DEFAULT_KB_LATENCY = 0.00002
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+_MISSING = object()
+
+
+def _error(operation: str, code: str, message: str, **extra) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': message}, **extra}, operation)
+
+
+def _validation_error(operation: str, message: str) -> ClientError:
+    return _error(operation, 'ValidationException', message)
+
+
+# Sizes, as DynamoDB counts them for capacity
+
+def attribute_size(value) -> int:
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, Decimal)):
+        digits = str(abs(value)).replace('.', '').strip('0')
+        return 1 + (len(digits) + 1) // 2
+    if isinstance(value, Binary):
+        return len(value.value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (set, frozenset)):
+        return sum(attribute_size(v) for v in value)
+    if isinstance(value, list):
+        return 3 + sum(1 + attribute_size(v) for v in value)
+    if isinstance(value, dict):
+        return 3 + sum(1 + len(k.encode('utf-8')) + attribute_size(v) for k, v in value.items())
+    raise TypeError(f'Unsupported type {type(value)}')
+
+
+def item_size(item: dict) -> int:
+    return sum(len(name.encode('utf-8')) + attribute_size(value) for name, value in item.items())
+
+
+def _normalize(item: dict) -> dict:
+    """Round trips an item through boto3's serializer, as a real write and read would"""
+    return {k: _deserializer.deserialize(_serializer.serialize(v)) for k, v in item.items()}
+
+
+def _type_code(value) -> str:
+    return next(iter(_serializer.serialize(value)))
+
+
+# Expressions
+
+_TOKEN = re.compile(r'\s*(?:(<>|<=|>=|[=<>(),.\[\]+\-])|([#:]?[A-Za-z0-9_]+))')
+_COMPARATORS = {'=', '<>', '<', '<=', '>', '>='}
+_FUNCTIONS = {'attribute_exists', 'attribute_not_exists', 'attribute_type', 'begins_with', 'contains'}
+
+
+def _tokenize(expression: str) -> List[str]:
+    tokens, pos = [], 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _TOKEN.match(expression, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f'Invalid expression near {expression[pos:]!r}')
+        tokens.append(match.group(1) or match.group(2))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser for condition, key condition, update and projection expressions"""
+    def __init__(self, expression: str, names: dict, values: dict):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+        self.used_names = set()
+        self.used_values = set()
+
+    def peek(self, offset=0) -> Optional[str]:
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.peek()
+        if token is None:
+            raise ValueError('Unexpected end of expression')
+        self.pos += 1
+        return token
+
+    def expect(self, token: str):
+        found = self.take()
+        if found != token:
+            raise ValueError(f'Expected {token!r} but found {found!r}')
+
+    def keyword(self, word: str) -> bool:
+        token = self.peek()
+        if token is not None and token.upper() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def done(self) -> bool:
+        return self.pos >= len(self.tokens)
+
+    def name(self) -> str:
+        token = self.take()
+        if token.startswith('#'):
+            if token not in self.names:
+                raise ValueError(f'Unknown attribute name placeholder {token}')
+            self.used_names.add(token)
+            return self.names[token]
+        if token.startswith(':') or not re.match(r'[A-Za-z_]', token):
+            raise ValueError(f'Invalid attribute name {token!r}')
+        return token
+
+    def path(self) -> list:
+        path = [self.name()]
+        while self.peek() in ('.', '['):
+            if self.take() == '.':
+                path.append(self.name())
+            else:
+                path.append(int(self.take()))
+                self.expect(']')
+        return path
+
+    def value(self):
+        token = self.take()
+        if token not in self.values:
+            raise ValueError(f'Unknown attribute value placeholder {token}')
+        self.used_values.add(token)
+        return self.values[token]
+
+    def operand(self) -> tuple:
+        token = self.peek()
+        if token is not None and token.startswith(':'):
+            return 'value', self.value()
+        if token is not None and token.lower() == 'size' and self.peek(1) == '(':
+            self.pos += 2
+            path = self.path()
+            self.expect(')')
+            return 'size', path
+        return 'path', self.path()
+
+    def condition(self) -> tuple:
+        node = self.conjunction()
+        while self.keyword('OR'):
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self) -> tuple:
+        node = self.negation()
+        while self.keyword('AND'):
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self) -> tuple:
+        if self.keyword('NOT'):
+            return 'not', self.negation()
+        return self.predicate()
+
+    def predicate(self) -> tuple:
+        if self.peek() == '(':
+            self.take()
+            node = self.condition()
+            self.expect(')')
+            return node
+        token = self.peek()
+        if token is not None and token in _FUNCTIONS and self.peek(1) == '(':
+            self.pos += 2
+            args = [self.operand()]
+            while self.peek() == ',':
+                self.take()
+                args.append(self.operand())
+            self.expect(')')
+            return 'function', token, args
+        left = self.operand()
+        if self.keyword('BETWEEN'):
+            low = self.operand()
+            if not self.keyword('AND'):
+                raise ValueError('BETWEEN needs AND')
+            return 'between', left, low, self.operand()
+        if self.keyword('IN'):
+            self.expect('(')
+            options = [self.operand()]
+            while self.peek() == ',':
+                self.take()
+                options.append(self.operand())
+            self.expect(')')
+            return 'in', left, options
+        comparator = self.take()
+        if comparator not in _COMPARATORS:
+            raise ValueError(f'Invalid comparator {comparator!r}')
+        return 'compare', comparator, left, self.operand()
+
+    def set_value(self) -> tuple:
+        node = self.set_term()
+        if self.peek() in ('+', '-'):
+            return ('plus' if self.take() == '+' else 'minus'), node, self.set_term()
+        return node
+
+    def set_term(self) -> tuple:
+        token = self.peek()
+        if token in ('if_not_exists', 'list_append') and self.peek(1) == '(':
+            self.pos += 2
+            first = self.operand()
+            self.expect(',')
+            second = self.operand()
+            self.expect(')')
+            return token, first, second
+        return self.operand()
+
+    def update(self) -> List[tuple]:
+        actions = []
+        while not self.done():
+            clause = self.take().upper()
+            if clause not in ('SET', 'REMOVE', 'ADD', 'DELETE'):
+                raise ValueError(f'Invalid update clause {clause!r}')
+            while True:
+                path = self.path()
+                if clause == 'SET':
+                    self.expect('=')
+                    actions.append(('set', path, self.set_value()))
+                elif clause == 'REMOVE':
+                    actions.append(('remove', path))
+                else:
+                    actions.append((clause.lower(), path, self.value()))
+                if self.peek() != ',':
+                    break
+                self.take()
+        return actions
+
+    def projection(self) -> List[list]:
+        paths = [self.path()]
+        while self.peek() == ',':
+            self.take()
+            paths.append(self.path())
+        return paths
+
+    def finish(self):
+        if not self.done():
+            raise ValueError(f'Unexpected {self.peek()!r} in expression')
+
+
+def _get_path(item, path: list):
+    value = item
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(value, list) or part >= len(value):
+                return _MISSING
+            value = value[part]
+        else:
+            if not isinstance(value, dict) or part not in value:
+                return _MISSING
+            value = value[part]
+    return value
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, Decimal)) and not isinstance(value, bool)
+
+
+def _comparable(a, b) -> bool:
+    return (_is_number(a) and _is_number(b)) or (type(a) is type(b) and isinstance(a, (str, bytes, Binary)))
+
+
+def _size(value) -> Union[int, object]:
+    if isinstance(value, Binary):
+        return len(value.value)
+    if isinstance(value, (str, bytes, list, dict, set, frozenset)):
+        return len(value)
+    return _MISSING
+
+
+def _operand(node: tuple, item: dict):
+    kind, arg = node
+    if kind == 'value':
+        return arg
+    value = _get_path(item, arg)
+    if kind == 'size':
+        return _MISSING if value is _MISSING else _size(value)
+    return value
+
+
+def _compare(comparator: str, a, b) -> bool:
+    if a is _MISSING or b is _MISSING:
+        return comparator == '<>'
+    if comparator in ('=', '<>'):
+        equal = (a == b) if (_comparable(a, b) or type(a) is type(b)) else False
+        return equal if comparator == '=' else not equal
+    if not _comparable(a, b):
+        return False
+    return {'<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b}[comparator]
+
+
+def _evaluate(node: tuple, item: dict) -> bool:
+    kind = node[0]
+    if kind == 'or':
+        return _evaluate(node[1], item) or _evaluate(node[2], item)
+    if kind == 'and':
+        return _evaluate(node[1], item) and _evaluate(node[2], item)
+    if kind == 'not':
+        return not _evaluate(node[1], item)
+    if kind == 'compare':
+        return _compare(node[1], _operand(node[2], item), _operand(node[3], item))
+    if kind == 'between':
+        value, low, high = (_operand(n, item) for n in node[1:])
+        return _compare('>=', value, low) and _compare('<=', value, high)
+    if kind == 'in':
+        value = _operand(node[1], item)
+        return any(_compare('=', value, _operand(option, item)) for option in node[2])
+    name, args = node[1], node[2]
+    value = _operand(args[0], item)
+    if name == 'attribute_exists':
+        return value is not _MISSING
+    if name == 'attribute_not_exists':
+        return value is _MISSING
+    other = _operand(args[1], item)
+    if value is _MISSING or other is _MISSING:
+        return False
+    if name == 'attribute_type':
+        return _type_code(value) == other
+    if name == 'begins_with':
+        return isinstance(value, (str, bytes)) and type(value) is type(other) and value.startswith(other)
+    if isinstance(value, str):
+        return isinstance(other, str) and other in value
+    if isinstance(value, (set, frozenset, list)):
+        return other in value
+    return False
+
+
+def _set_path(item: dict, path: list, value, operation: str):
+    parent = _get_path(item, path[:-1]) if len(path) > 1 else item
+    last = path[-1]
+    if isinstance(last, int):
+        if not isinstance(parent, list):
+            raise _validation_error(operation, 'The document path provided in the update expression is invalid for update')
+        if last >= len(parent):
+            parent.append(value)
+        else:
+            parent[last] = value
+        return
+    if not isinstance(parent, dict):
+        raise _validation_error(operation, 'The document path provided in the update expression is invalid for update')
+    parent[last] = value
+
+
+def _remove_path(item: dict, path: list):
+    parent = _get_path(item, path[:-1]) if len(path) > 1 else item
+    last = path[-1]
+    if isinstance(last, int) and isinstance(parent, list) and last < len(parent):
+        parent.pop(last)
+    elif isinstance(parent, dict):
+        parent.pop(last, None)
+
+
+def _set_value(node: tuple, item: dict, operation: str):
+    kind = node[0]
+    if kind in ('plus', 'minus'):
+        a, b = _set_value(node[1], item, operation), _set_value(node[2], item, operation)
+        if not (_is_number(a) and _is_number(b)):
+            raise _validation_error(operation, 'An operand in the update expression has an incorrect data type')
+        return Decimal(a) + Decimal(b) if kind == 'plus' else Decimal(a) - Decimal(b)
+    if kind == 'if_not_exists':
+        value = _operand(node[1], item)
+        return _set_value(node[2], item, operation) if value is _MISSING else value
+    if kind == 'list_append':
+        a, b = _set_value(node[1], item, operation), _set_value(node[2], item, operation)
+        if not (isinstance(a, list) and isinstance(b, list)):
+            raise _validation_error(operation, 'An operand in the update expression has an incorrect data type')
+        return a + b
+    value = _operand(node, item)
+    if value is _MISSING:
+        raise _validation_error(operation, 'The provided expression refers to an attribute that does not exist in the item')
+    return value
+
+
+def _apply_update(item: dict, actions: List[tuple], operation: str) -> dict:
+    """Returns a copy of item with the actions applied; right-hand sides see the item as it was"""
+    updated = copy.deepcopy(item)
+    values = [_set_value(a[2], item, operation) if a[0] == 'set' else None for a in actions]
+    for action, value in zip(actions, values):
+        kind, path = action[0], action[1]
+        if kind == 'set':
+            _set_path(updated, path, _normalize({'v': value})['v'], operation)
+        elif kind == 'remove':
+            _remove_path(updated, path)
+        else:
+            current, amount = _get_path(updated, path), action[2]
+            if kind == 'add' and _is_number(amount):
+                if current is not _MISSING and not _is_number(current):
+                    raise _validation_error(operation, 'An operand in the update expression has an incorrect data type')
+                _set_path(updated, path, Decimal(amount) + (current if current is not _MISSING else 0), operation)
+            elif isinstance(amount, (set, frozenset)):
+                current = set(current) if current is not _MISSING else set()
+                current = current | set(amount) if kind == 'add' else current - set(amount)
+                if current:
+                    _set_path(updated, path, _normalize({'v': current})['v'], operation)
+                else:
+                    _remove_path(updated, path)
+            else:
+                raise _validation_error(operation, f'{kind.upper()} only supports numbers and sets')
+    return updated
+
+
+def _project(item: dict, paths: Optional[List[list]]) -> dict:
+    """Returns a copy of item with only paths, so callers can't change what is stored"""
+    if paths is None:
+        return copy.deepcopy(item)
+    projected = {}
+    for path in paths:
+        value = _get_path(item, path)
+        if value is _MISSING:
+            continue
+        target = projected
+        for part, next_part in zip(path[:-1], path[1:]):
+            if isinstance(target, list):
+                target.append({} if not isinstance(next_part, int) else [])
+                target = target[-1]
+            else:
+                target = target.setdefault(part, [] if isinstance(next_part, int) else {})
+        if isinstance(target, list):
+            target.append(copy.deepcopy(value))
+        else:
+            target[path[-1]] = copy.deepcopy(value)
+    return projected
+
+
+class _Expressions:
+    """Builds the parsed expressions of one request, accepting strings or boto3 condition objects"""
+    def __init__(self, operation: str, params: dict):
+        self.operation = operation
+        self.names = dict(params.get('ExpressionAttributeNames') or {})
+        self.values = dict(params.get('ExpressionAttributeValues') or {})
+        self.builder = ConditionExpressionBuilder()
+
+    def _parser(self, expression) -> _Parser:
+        return _Parser(expression, self.names, self.values)
+
+    def _text(self, expression, is_key_condition=False) -> str:
+        if isinstance(expression, ConditionBase):
+            built = self.builder.build_expression(expression, is_key_condition=is_key_condition)
+            self.names.update(built.attribute_name_placeholders)
+            self.values.update(built.attribute_value_placeholders)
+            return built.condition_expression
+        return expression
+
+    def condition(self, expression, is_key_condition=False) -> Optional[tuple]:
+        if expression is None:
+            return None
+        try:
+            parser = self._parser(self._text(expression, is_key_condition))
+            node = parser.condition()
+            parser.finish()
+        except ValueError as e:
+            raise _validation_error(self.operation, f'Invalid expression: {e}')
+        return node
+
+    def update(self, expression: str) -> List[tuple]:
+        try:
+            parser = self._parser(expression)
+            actions = parser.update()
+        except ValueError as e:
+            raise _validation_error(self.operation, f'Invalid UpdateExpression: {e}')
+        paths = [tuple(a[1]) for a in actions]
+        if len(set(paths)) != len(paths):
+            raise _validation_error(self.operation, 'Two document paths overlap in the update expression')
+        return actions
+
+    def projection(self, expression: Optional[str]) -> Optional[List[list]]:
+        if not expression:
+            return None
+        try:
+            parser = self._parser(expression)
+            paths = parser.projection()
+            parser.finish()
+        except ValueError as e:
+            raise _validation_error(self.operation, f'Invalid ProjectionExpression: {e}')
+        return paths
+
+
+# Storage
+
+class _Partitions:
+    """Items grouped by partition key and kept sorted by sort key within each partition"""
+    def __init__(self):
+        self.partitions: Dict[object, Tuple[dict, list]] = {}
+
+    def put(self, partition, sort: tuple, item: dict):
+        items, order = self.partitions.setdefault(partition, ({}, []))
+        if sort not in items:
+            bisect.insort(order, sort)
+        items[sort] = item
+
+    def remove(self, partition, sort: tuple):
+        items, order = self.partitions.get(partition, ({}, []))
+        if items.pop(sort, None) is not None:
+            order.pop(bisect.bisect_left(order, sort))
+
+    def get(self, partition, sort: tuple) -> Optional[dict]:
+        return self.partitions.get(partition, ({}, []))[0].get(sort)
+
+    def iter_partition(self, partition, forward=True, after: Optional[tuple] = None) -> Iterator[dict]:
+        items, order = self.partitions.get(partition, ({}, []))
+        if forward:
+            start = 0 if after is None else bisect.bisect_right(order, after)
+            keys = order[start:]
+        else:
+            end = len(order) if after is None else bisect.bisect_left(order, after)
+            keys = reversed(order[:end])
+        for sort in list(keys):
+            yield items[sort]
+
+    def iter_all(self, after: Optional[Tuple[object, tuple]] = None, segment=None) -> Iterator[dict]:
+        started = after is None
+        for partition in list(self.partitions):
+            if segment is not None and zlib.crc32(repr(partition).encode()) % segment[1] != segment[0]:
+                continue
+            if not started:
+                if partition != after[0]:
+                    continue
+                started = True
+                yield from self.iter_partition(partition, after=after[1])
+                continue
+            yield from self.iter_partition(partition)
+
+
+class _Index:
+    def __init__(self, name: str, hash_key: str, range_key: Optional[str], projection: Union[str, List[str]]):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.projection = projection
+        self.items = _Partitions()
+
+
+class FakeTableData:
+    """One table's items and indexes"""
+    def __init__(self, name: str, hash_key: str, range_key: Optional[str] = None, indexes: Optional[dict] = None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.items = _Partitions()
+        self.indexes: Dict[str, _Index] = {}
+        for index_name, schema in (indexes or {}).items():
+            index_hash, index_range, projection = (tuple(schema) + (None, 'ALL'))[:3]
+            self.indexes[index_name] = _Index(index_name, index_hash, index_range, projection or 'ALL')
+
+    @property
+    def key_names(self) -> List[str]:
+        return [self.hash_key] + ([self.range_key] if self.range_key else [])
+
+    def key_of(self, item: dict, operation: str) -> dict:
+        key = {}
+        for name in self.key_names:
+            value = item.get(name)
+            if value is None:
+                raise _validation_error(operation, 'One of the required keys was not given a value')
+            if not isinstance(value, (str, bytes, Binary)) and not _is_number(value):
+                raise _validation_error(operation, f'Type mismatch for key {name}')
+            key[name] = value
+        return key
+
+    def check_key(self, key: dict, operation: str) -> dict:
+        if set(key) != set(self.key_names):
+            raise _validation_error(operation, 'The provided key element does not match the schema')
+        return self.key_of(_normalize(key), operation)
+
+    def _sort(self, item: dict) -> tuple:
+        return (item[self.range_key],) if self.range_key else ()
+
+    def get(self, key: dict) -> Optional[dict]:
+        return self.items.get(key[self.hash_key], self._sort(key))
+
+    def index_entry(self, index: _Index, item: Optional[dict]) -> Optional[dict]:
+        """The item as it appears in the index, or None if it has no index key"""
+        if item is None or index.hash_key not in item or (index.range_key and index.range_key not in item):
+            return None
+        keys = set(self.key_names) | {index.hash_key} | ({index.range_key} if index.range_key else set())
+        if index.projection == 'ALL':
+            return item
+        if index.projection == 'KEYS_ONLY':
+            return {k: v for k, v in item.items() if k in keys}
+        return {k: v for k, v in item.items() if k in keys or k in index.projection}
+
+    def _index_sort(self, index: _Index, item: dict) -> tuple:
+        return ((item[index.range_key],) if index.range_key else ()) + (item[self.hash_key],) + self._sort(item)
+
+    def write(self, key: dict, item: Optional[dict]) -> Tuple[Optional[dict], Dict[str, int]]:
+        """
+        Stores item under key (deleting it if None). Returns the old item and
+        the write units charged per index for keeping the indexes in step
+        """
+        old = self.get(key)
+        if old is not None:
+            self.items.remove(key[self.hash_key], self._sort(key))
+        if item is not None:
+            self.items.put(key[self.hash_key], self._sort(key), item)
+        index_units = {}
+        for index in self.indexes.values():
+            before, after = self.index_entry(index, old), self.index_entry(index, item)
+            if before is not None:
+                index.items.remove(before[index.hash_key], self._index_sort(index, before))
+            if after is not None:
+                index.items.put(after[index.hash_key], self._index_sort(index, after), after)
+            units = 0
+            if before is not None and after is not None and before[index.hash_key] == after[index.hash_key] \
+                    and self._index_sort(index, before) == self._index_sort(index, after):
+                if before != after:
+                    units = _write_units(max(item_size(before), item_size(after)))
+            else:
+                units = sum(_write_units(item_size(e)) for e in (before, after) if e is not None)
+            if units:
+                index_units[index.name] = units
+        return old, index_units
+
+
+def _read_units(size: int, consistent: bool) -> float:
+    units = max(1, math.ceil(size / READ_UNIT_BYTES))
+    return units if consistent else units / 2
+
+
+def _write_units(size: int) -> int:
+    return max(1, math.ceil(size / WRITE_UNIT_BYTES))
+
+
+class _Charge:
+    """Capacity and bytes used by one call, per table and index"""
+    def __init__(self):
+        self.tables: Dict[str, Dict[Optional[str], float]] = {}
+        self.bytes = 0
+
+    def add(self, table: str, units: float, index: Optional[str] = None, size: int = 0):
+        entry = self.tables.setdefault(table, {})
+        entry[index] = entry.get(index, 0) + units
+        self.bytes += size
+
+    def consumed(self, mode: Optional[str], is_read: bool) -> List[dict]:
+        consumed = []
+        kind = 'ReadCapacityUnits' if is_read else 'WriteCapacityUnits'
+        for table, parts in self.tables.items():
+            total = sum(parts.values())
+            capacity = {'TableName': table, 'CapacityUnits': total, kind: total}
+            if mode == 'INDEXES':
+                table_units = parts.get(None, 0)
+                capacity['Table'] = {'CapacityUnits': table_units, kind: table_units}
+                indexes = {i: {'CapacityUnits': u, kind: u} for i, u in parts.items() if i is not None}
+                if indexes:
+                    capacity['GlobalSecondaryIndexes'] = indexes
+            consumed.append(capacity)
+        return consumed
+
+
+class FakeDynamoDB:
+    """
+    A set of in-memory tables plus the client that serves them. clock is the
+    simulated time spent in calls so far; with sleep the calls also really
+    take that long, for wall clock benchmarks.
+    """
+    def __init__(self, call_latency: float = DEFAULT_CALL_LATENCY, kb_latency: float = DEFAULT_KB_LATENCY,
+                 sleep: bool = False):
+        self.tables: Dict[str, FakeTableData] = {}
+        self.call_latency = call_latency
+        self.kb_latency = kb_latency
+        self.sleep = sleep
+        self.clock = 0.0
+        self.metrics = RequestMetrics()
+        self.client = FakeClient(self)
+        self._lock = threading.RLock()
+
+    def create_table(self, name: str, key: Union[str, Tuple[str, str]], indexes: Optional[dict] = None) -> 'FakeTable':
+        """
+        key is the partition key name or a (partition, sort) pair. indexes maps
+        GSI names to (partition, sort[, projection]) where projection is
+        'ALL' (the default), 'KEYS_ONLY' or a list of included attributes.
+        """
+        hash_key, range_key = (key, None) if isinstance(key, str) else key
+        self.tables[name] = FakeTableData(name, hash_key, range_key, indexes)
+        return self.Table(name)
+
+    def Table(self, name: str) -> 'FakeTable':
+        return FakeTable(self, name)
+
+    def low_level_client(self) -> 'FakeLowLevelClient':
+        return FakeLowLevelClient(self.client)
+
+    def reset_metrics(self):
+        with self._lock:
+            self.metrics = RequestMetrics()
+            self.clock = 0.0
+
+    def table_data(self, name: str, operation: str) -> FakeTableData:
+        if name not in self.tables:
+            raise _error(operation, 'ResourceNotFoundException', f'Requested resource not found: Table: {name} not found')
+        return self.tables[name]
+
+    def charge(self, operation: str, params: dict, response: dict, charge: _Charge, pages: int = 1):
+        is_read = operation in ('GetItem', 'Query', 'Scan', 'BatchGetItem', 'TransactGetItems')
+        consumed = charge.consumed('INDEXES', is_read)
+        seconds = self.call_latency * pages + charge.bytes / 1024 * self.kb_latency
+        self.clock += seconds
+        parsed = {**response, 'ConsumedCapacity': consumed if len(consumed) != 1 or operation.startswith(('Batch', 'Transact'))
+                  else consumed[0]}
+        self.metrics.record(operation, params, parsed, seconds)
+        request_metrics = current_dynamodb_metrics()
+        if request_metrics is not None:
+            request_metrics.record(operation, params, parsed, seconds)
+        mode = params.get('ReturnConsumedCapacity')
+        if mode in ('TOTAL', 'INDEXES'):
+            consumed = charge.consumed(mode, is_read)
+            batched = operation.startswith(('Batch', 'Transact'))
+            response['ConsumedCapacity'] = consumed if batched else (consumed[0] if consumed else {})
+        if self.sleep:
+            time.sleep(seconds)
+        return response
+
+
+class FakeClient:
+    """Serves the calls of the Table resource's client: Python values in and out"""
+    def __init__(self, dynamodb: FakeDynamoDB):
+        self.dynamodb = dynamodb
+
+    def _check_condition(self, operation: str, expressions: _Expressions, condition, item: Optional[dict]):
+        node = expressions.condition(condition)
+        if node is not None and not _evaluate(node, item or {}):
+            raise _error(operation, 'ConditionalCheckFailedException', 'The conditional request failed')
+
+    def get_item(self, TableName, Key, ConsistentRead=False, ProjectionExpression=None, **params):
+        with self.dynamodb._lock:
+            table = self.dynamodb.table_data(TableName, 'GetItem')
+            expressions = _Expressions('GetItem', params)
+            projection = expressions.projection(ProjectionExpression)
+            item = table.get(table.check_key(Key, 'GetItem'))
+            charge = _Charge()
+            size = item_size(item) if item else 0
+            charge.add(TableName, _read_units(size, ConsistentRead), size=size)
+            response = {'Item': _project(item, projection)} if item else {}
+            return self.dynamodb.charge('GetItem', {'TableName': TableName, **params}, response, charge)
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ReturnValues='NONE', **params):
+        with self.dynamodb._lock:
+            table = self.dynamodb.table_data(TableName, 'PutItem')
+            item = _normalize(Item)
+            key = table.key_of(item, 'PutItem')
+            old = table.get(key)
+            self._check_condition('PutItem', _Expressions('PutItem', params), ConditionExpression, old)
+            old, index_units = table.write(key, item)
+            charge = _Charge()
+            size = max(item_size(item), item_size(old) if old else 0)
+            charge.add(TableName, _write_units(size), size=size)
+            for index, units in index_units.items():
+                charge.add(TableName, units, index)
+            response = {'Attributes': old} if ReturnValues == 'ALL_OLD' and old else {}
+            return self.dynamodb.charge('PutItem', {'TableName': TableName, **params}, response, charge)
+
+    def update_item(self, TableName, Key, UpdateExpression=None, ConditionExpression=None, ReturnValues='NONE',
+                    **params):
+        with self.dynamodb._lock:
+            table = self.dynamodb.table_data(TableName, 'UpdateItem')
+            key = table.check_key(Key, 'UpdateItem')
+            expressions = _Expressions('UpdateItem', params)
+            old = table.get(key)
+            self._check_condition('UpdateItem', expressions, ConditionExpression, old)
+            actions = expressions.update(UpdateExpression) if UpdateExpression else []
+            if any(a[1][0] in key for a in actions):
+                raise _validation_error('UpdateItem', 'Cannot update attribute that is part of the key')
+            item = _apply_update({**(old or {}), **key}, actions, 'UpdateItem')
+            _, index_units = table.write(key, item)
+            charge = _Charge()
+            size = max(item_size(item), item_size(old) if old else 0)
+            charge.add(TableName, _write_units(size), size=size)
+            for index, units in index_units.items():
+                charge.add(TableName, units, index)
+            response = {}
+            updated = {a[1][0] for a in actions}
+            if ReturnValues == 'ALL_NEW':
+                response['Attributes'] = item
+            elif ReturnValues == 'ALL_OLD' and old:
+                response['Attributes'] = old
+            elif ReturnValues == 'UPDATED_NEW':
+                response['Attributes'] = {k: v for k, v in item.items() if k in updated}
+            elif ReturnValues == 'UPDATED_OLD' and old:
+                response['Attributes'] = {k: v for k, v in old.items() if k in updated}
+            return self.dynamodb.charge('UpdateItem', {'TableName': TableName, **params}, response, charge)
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ReturnValues='NONE', **params):
+        with self.dynamodb._lock:
+            table = self.dynamodb.table_data(TableName, 'DeleteItem')
+            key = table.check_key(Key, 'DeleteItem')
+            old = table.get(key)
+            self._check_condition('DeleteItem', _Expressions('DeleteItem', params), ConditionExpression, old)
+            _, index_units = table.write(key, None)
+            charge = _Charge()
+            size = item_size(old) if old else 0
+            charge.add(TableName, _write_units(size), size=size)
+            for index, units in index_units.items():
+                charge.add(TableName, units, index)
+            response = {'Attributes': old} if ReturnValues == 'ALL_OLD' and old else {}
+            return self.dynamodb.charge('DeleteItem', {'TableName': TableName, **params}, response, charge)
+
+    def _source(self, table: FakeTableData, index_name: Optional[str], operation: str):
+        if index_name is None:
+            return None, table.items, table.key_names
+        if index_name not in table.indexes:
+            raise _validation_error(operation, f'The table does not have the specified index: {index_name}')
+        index = table.indexes[index_name]
+        key_names = [index.hash_key] + ([index.range_key] if index.range_key else [])
+        return index, index.items, key_names + [k for k in table.key_names if k not in key_names]
+
+    def _page(self, operation: str, table: FakeTableData, items: Iterator[dict], key_names: List[str],
+              expressions: _Expressions, params: dict, consistent: bool, index_name: Optional[str]) -> dict:
+        """Reads one page from items, applying Limit, the 1MB limit, the filter and the projection"""
+        limit = params.get('Limit')
+        node = expressions.condition(params.get('FilterExpression'))
+        projection = expressions.projection(params.get('ProjectionExpression'))
+        found, scanned, size, last = [], 0, 0, None
+        for item in items:
+            scanned += 1
+            size += item_size(item)
+            if node is None or _evaluate(node, item):
+                found.append(_project(item, projection))
+            if (limit and scanned >= limit) or size >= MAX_PAGE_BYTES:
+                last = {k: item[k] for k in key_names}
+                break
+        response = {'Count': len(found), 'ScannedCount': scanned}
+        if params.get('Select') != 'COUNT':
+            response['Items'] = found
+        if last is not None:
+            response['LastEvaluatedKey'] = last
+        charge = _Charge()
+        charge.add(table.name, _read_units(size, consistent), index_name, size)
+        return self.dynamodb.charge(operation, {'TableName': table.name, **params}, response, charge)
+
+    def query(self, TableName, KeyConditionExpression, IndexName=None, ScanIndexForward=True, ExclusiveStartKey=None,
+              ConsistentRead=False, **params):
+        with self.dynamodb._lock:
+            table = self.dynamodb.table_data(TableName, 'Query')
+            index, source, key_names = self._source(table, IndexName, 'Query')
+            if index is not None and ConsistentRead:
+                raise _validation_error('Query', 'Consistent reads are not supported on global secondary indexes')
+            expressions = _Expressions('Query', params)
+            node = expressions.condition(KeyConditionExpression, is_key_condition=True)
+            hash_key = index.hash_key if index else table.hash_key
+            partition, sort_conditions = _split_key_condition(node, hash_key, 'Query')
+            after = None
+            if ExclusiveStartKey:
+                start = _normalize(ExclusiveStartKey)
+                after = table._index_sort(index, start) if index else table._sort(start)
+            items = (item for item in source.iter_partition(partition, ScanIndexForward, after)
+                     if all(_evaluate(c, item) for c in sort_conditions))
+            if IndexName:
+                params['IndexName'] = IndexName
+            return self._page('Query', table, items, key_names, expressions, params, ConsistentRead, IndexName)
+
+    def scan(self, TableName, IndexName=None, ExclusiveStartKey=None, Segment=None, TotalSegments=None,
+             ConsistentRead=False, **params):
+        with self.dynamodb._lock:
+            table = self.dynamodb.table_data(TableName, 'Scan')
+            index, source, key_names = self._source(table, IndexName, 'Scan')
+            after = None
+            if ExclusiveStartKey:
+                start = _normalize(ExclusiveStartKey)
+                hash_key = index.hash_key if index else table.hash_key
+                after = (start[hash_key], table._index_sort(index, start) if index else table._sort(start))
+            segment = (Segment, TotalSegments) if TotalSegments else None
+            items = source.iter_all(after, segment)
+            expressions = _Expressions('Scan', params)
+            if IndexName:
+                params['IndexName'] = IndexName
+            return self._page('Scan', table, items, key_names, expressions, params, ConsistentRead, IndexName)
+
+    def batch_get_item(self, RequestItems, **params):
+        with self.dynamodb._lock:
+            if sum(len(r['Keys']) for r in RequestItems.values()) > MAX_BATCH_GET_KEYS:
+                raise _validation_error('BatchGetItem', 'Too many items requested for the BatchGetItem call')
+            responses, charge = {}, _Charge()
+            for name, request in RequestItems.items():
+                table = self.dynamodb.table_data(name, 'BatchGetItem')
+                expressions = _Expressions('BatchGetItem', request)
+                projection = expressions.projection(request.get('ProjectionExpression'))
+                consistent = request.get('ConsistentRead', False)
+                keys = [table.check_key(k, 'BatchGetItem') for k in request['Keys']]
+                if len({tuple(sorted(k.items())) for k in keys}) != len(keys):
+                    raise _validation_error('BatchGetItem', 'Provided list of item keys contains duplicates')
+                found = []
+                for key in keys:
+                    item = table.get(key)
+                    size = item_size(item) if item else 0
+                    charge.add(name, _read_units(size, consistent), size=size)
+                    if item:
+                        found.append(_project(item, projection))
+                responses[name] = found
+            response = {'Responses': responses, 'UnprocessedKeys': {}}
+            return self.dynamodb.charge('BatchGetItem', {'RequestItems': RequestItems, **params}, response, charge)
+
+    def batch_write_item(self, RequestItems, **params):
+        with self.dynamodb._lock:
+            if sum(len(r) for r in RequestItems.values()) > MAX_BATCH_WRITE_ITEMS:
+                raise _validation_error('BatchWriteItem', 'Too many items requested for the BatchWriteItem call')
+            writes = []
+            for name, requests in RequestItems.items():
+                table = self.dynamodb.table_data(name, 'BatchWriteItem')
+                seen = set()
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = _normalize(request['PutRequest']['Item'])
+                        key = table.key_of(item, 'BatchWriteItem')
+                    else:
+                        item, key = None, table.check_key(request['DeleteRequest']['Key'], 'BatchWriteItem')
+                    key_id = tuple(sorted(key.items()))
+                    if key_id in seen:
+                        raise _validation_error('BatchWriteItem', 'Provided list of item keys contains duplicates')
+                    seen.add(key_id)
+                    writes.append((table, key, item))
+            charge = _Charge()
+            for table, key, item in writes:
+                old, index_units = table.write(key, item)
+                size = max(item_size(item) if item else 0, item_size(old) if old else 0)
+                charge.add(table.name, _write_units(size), size=size)
+                for index, units in index_units.items():
+                    charge.add(table.name, units, index)
+            response = {'UnprocessedItems': {}}
+            return self.dynamodb.charge('BatchWriteItem', {'RequestItems': RequestItems, **params}, response, charge)
+
+    def transact_get_items(self, TransactItems, **params):
+        with self.dynamodb._lock:
+            if len(TransactItems) > MAX_TRANSACT_ITEMS:
+                raise _validation_error('TransactGetItems', 'Member must have length less than or equal to 100')
+            responses, charge = [], _Charge()
+            for request in TransactItems:
+                get = request['Get']
+                table = self.dynamodb.table_data(get['TableName'], 'TransactGetItems')
+                item = table.get(table.check_key(get['Key'], 'TransactGetItems'))
+                projection = _Expressions('TransactGetItems', get).projection(get.get('ProjectionExpression'))
+                size = item_size(item) if item else 0
+                charge.add(table.name, 2 * _read_units(size, True), size=size)
+                responses.append({'Item': _project(item, projection)} if item else {})
+            response = {'Responses': responses}
+            return self.dynamodb.charge('TransactGetItems', {'TransactItems': TransactItems, **params}, response, charge)
+
+    def transact_write_items(self, TransactItems, ClientRequestToken=None, **params):
+        with self.dynamodb._lock:
+            if len(TransactItems) > MAX_TRANSACT_ITEMS:
+                raise _validation_error('TransactWriteItems', 'Member must have length less than or equal to 100')
+            planned, reasons, seen = [], [], set()
+            for request in TransactItems:
+                (action, op), = request.items()
+                table = self.dynamodb.table_data(op['TableName'], 'TransactWriteItems')
+                expressions = _Expressions('TransactWriteItems', op)
+                if action == 'Put':
+                    item = _normalize(op['Item'])
+                    key = table.key_of(item, 'TransactWriteItems')
+                else:
+                    item, key = None, table.check_key(op['Key'], 'TransactWriteItems')
+                key_id = (table.name, tuple(sorted(key.items())))
+                if key_id in seen:
+                    raise _validation_error('TransactWriteItems',
+                                            'Transaction request cannot include multiple operations on one item')
+                seen.add(key_id)
+                old = table.get(key)
+                node = expressions.condition(op.get('ConditionExpression'))
+                if node is not None and not _evaluate(node, old or {}):
+                    reasons.append({'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+                else:
+                    reasons.append({'Code': 'None'})
+                if action == 'Update':
+                    actions = expressions.update(op['UpdateExpression'])
+                    item = _apply_update({**(old or {}), **key}, actions, 'TransactWriteItems')
+                planned.append((action, table, key, item, old))
+            if any(r['Code'] != 'None' for r in reasons):
+                raise _error('TransactWriteItems', 'TransactionCanceledException',
+                             'Transaction cancelled, please refer cancellation reasons for specific reasons '
+                             f'[{", ".join(r["Code"] for r in reasons)}]', CancellationReasons=reasons)
+            charge = _Charge()
+            for action, table, key, item, old in planned:
+                if action == 'ConditionCheck':
+                    size = item_size(old) if old else 0
+                    charge.add(table.name, 2 * _read_units(size, True), size=size)
+                    continue
+                _, index_units = table.write(key, item)
+                size = max(item_size(item) if item else 0, item_size(old) if old else 0)
+                charge.add(table.name, 2 * _write_units(size), size=size)
+                for index, units in index_units.items():
+                    charge.add(table.name, 2 * units, index)
+            return self.dynamodb.charge('TransactWriteItems', {'TransactItems': TransactItems, **params}, {}, charge)
+
+
+def _split_key_condition(node: tuple, hash_key: str, operation: str) -> Tuple[object, List[tuple]]:
+    """Splits a key condition into the partition key value and the conditions on the sort key"""
+    parts, stack = [], [node]
+    while stack:
+        part = stack.pop()
+        if part[0] == 'and':
+            stack += [part[2], part[1]]
+        elif part[0] in ('compare', 'between', 'function'):
+            parts.append(part)
+        else:
+            raise _validation_error(operation, 'Invalid operator used in KeyConditionExpression')
+    partition, sort_conditions = _MISSING, []
+    for part in parts:
+        if part[0] == 'compare' and part[1] == '=' and part[2] == ('path', [hash_key]) and part[3][0] == 'value':
+            partition = part[3][1]
+        else:
+            sort_conditions.append(part)
+    if partition is _MISSING:
+        raise _validation_error(operation, f'Query condition missed key schema element: {hash_key}')
+    return _normalize({'v': partition})['v'], sort_conditions
+
+
+class FakeTable:
+    """Stand-in for a boto3 Table resource"""
+    def __init__(self, dynamodb: FakeDynamoDB, name: str):
+        self.name = name
+        self.table_name = name
+        self.meta = type('Meta', (), {'client': dynamodb.client, 'low_level_client': dynamodb.low_level_client()})()
+        self._client = dynamodb.client
+        self._dynamodb = dynamodb
+
+    @property
+    def key_schema(self) -> List[dict]:
+        key_names = self._dynamodb.table_data(self.name, 'DescribeTable').key_names
+        return [{'AttributeName': name, 'KeyType': key_type} for name, key_type in zip(key_names, ('HASH', 'RANGE'))]
+
+    def get_item(self, **kwargs):
+        return self._client.get_item(TableName=self.name, **kwargs)
+
+    def put_item(self, **kwargs):
+        return self._client.put_item(TableName=self.name, **kwargs)
+
+    def update_item(self, **kwargs):
+        return self._client.update_item(TableName=self.name, **kwargs)
+
+    def delete_item(self, **kwargs):
+        return self._client.delete_item(TableName=self.name, **kwargs)
+
+    def query(self, **kwargs):
+        return self._client.query(TableName=self.name, **kwargs)
+
+    def scan(self, **kwargs):
+        return self._client.scan(TableName=self.name, **kwargs)
+
+
+def _serialize_item(item: dict) -> dict:
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+
+def _deserialize_item(item: dict) -> dict:
+    return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+
+class FakeLowLevelClient:
+    """Serves the reads fast_call makes, with DynamoDB's typed values in and out"""
+    def __init__(self, client: FakeClient):
+        self.client = client
+
+    def _args(self, kwargs: dict) -> dict:
+        kwargs = dict(kwargs)
+        if 'ExpressionAttributeValues' in kwargs:
+            kwargs['ExpressionAttributeValues'] = _deserialize_item(kwargs['ExpressionAttributeValues'])
+        for name in ('Key', 'ExclusiveStartKey'):
+            if name in kwargs:
+                kwargs[name] = _deserialize_item(kwargs[name])
+        return kwargs
+
+    def _response(self, response: dict) -> dict:
+        response = dict(response)
+        if 'Items' in response:
+            response['Items'] = [_serialize_item(i) for i in response['Items']]
+        for name in ('Item', 'LastEvaluatedKey'):
+            if name in response:
+                response[name] = _serialize_item(response[name])
+        if 'Responses' in response:
+            response['Responses'] = {t: [_serialize_item(i) for i in items] for t, items in response['Responses'].items()}
+        return response
+
+    def get_item(self, **kwargs):
+        return self._response(self.client.get_item(**self._args(kwargs)))
+
+    def query(self, **kwargs):
+        return self._response(self.client.query(**self._args(kwargs)))
+
+    def scan(self, **kwargs):
+        return self._response(self.client.scan(**self._args(kwargs)))
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        request_items = {
+            table: {**request, 'Keys': [_deserialize_item(k) for k in request['Keys']]}
+            for table, request in RequestItems.items()
+        }
+        return self._response(self.client.batch_get_item(RequestItems=request_items, **kwargs))
@@ -1,7 +1,19 @@
+from rctools.alerts.api import ALERT_TTL, add_user_alert, check_for_user_alerts
 from rctools.alerts.customer import create_customer_new_job_alert
+from rctools.aws.dynamodb import mk_ttl
+from rctools.tests.fake_dynamodb import FakeDynamoDB
 
 
 def test__create_customer_new_job_alert():
     alert = create_customer_new_job_alert('foo', 'Test Content')
     assert alert.uid == 'foo'
     assert alert.content == 'Test Content'
+
+
+def test__expired_alerts_are_filtered_out():
+    alerts_table = FakeDynamoDB().create_table('alerts', ('uid', 'ts'))
+    add_user_alert(alerts_table, 'foo', create_customer_new_job_alert('foo'))
+    add_user_alert(alerts_table, 'foo', create_customer_new_job_alert('foo', 'Old').copy(update={'TimeToLive': 1, 'ts': 1}))
+    alerts = check_for_user_alerts(alerts_table, 'foo')
+    assert len(alerts) == 1
+    assert alerts[0]['TimeToLive'] == mk_ttl(ALERT_TTL, since=alerts[0]['ts'])
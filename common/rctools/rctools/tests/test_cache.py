@@ -0,0 +1,63 @@
+import pytest
+
+from rctools.aws import cache
+from rctools.aws.cache import ItemCache, get_cached_item, item_cache_stats
+from rctools.aws.dynamodb import update_dynamo_record
+
+
+class CountingTable:
+    name = 'jobs'
+
+    def __init__(self):
+        self.queries = 0
+        self.updates = []
+
+    def load(self):
+        self.queries += 1
+        return {'ticket_id': 't1', 'ts': 1, 'notes': ['a']}
+
+    def update_item(self, **kwargs):
+        self.updates.append(kwargs)
+        return {}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(cache, 'item_cache', ItemCache())
+
+
+def test__repeated_lookups_hit_the_cache():
+    table = CountingTable()
+    first = get_cached_item(table, {'ticket_id': 't1'}, table.load)
+    first['notes'].append('b')
+    second = get_cached_item(table, {'ticket_id': 't1'}, table.load)
+    assert table.queries == 1
+    assert second['notes'] == ['a']
+    assert item_cache_stats()['jobs'].dict(include={'hits', 'misses'}) == {'hits': 1, 'misses': 1}
+
+
+def test__writes_invalidate_lookups_by_partition():
+    table = CountingTable()
+    get_cached_item(table, {'ticket_id': 't1'}, table.load)
+    get_cached_item(table, {'ticket_id': 't2'}, table.load)
+    update_dynamo_record(table, {'ticket_id': 't1', 'ts': 1}, {'status': 'done'})
+    get_cached_item(table, {'ticket_id': 't1'}, table.load)
+    get_cached_item(table, {'ticket_id': 't2'}, table.load)
+    assert table.queries == 3
+    assert item_cache_stats()['jobs'].invalidations == 1
+
+
+def test__entries_expire_and_are_evicted(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('rctools.aws.cache.time.monotonic', lambda: now[0])
+    items = ItemCache(max_items=2, default_ttl=5)
+    items.set_ttl('codes', 60)
+    items.put('jobs', {'ticket_id': 't1'}, {'ticket_id': 't1'})
+    items.put('codes', {'code': 'abc'}, {'code': 'abc'})
+    now[0] += 10
+    assert items.get('jobs', {'ticket_id': 't1'}) is None
+    assert items.get('codes', {'code': 'abc'}) == {'code': 'abc'}
+    items.put('codes', {'code': 'def'}, {'code': 'def'})
+    items.put('codes', {'code': 'ghi'}, {'code': 'ghi'})
+    assert items.get('codes', {'code': 'abc'}) is None
+    assert items.stats().dict(include={'expired', 'evictions'}) == {'expired': 1, 'evictions': 1}
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+from botocore.awsrequest import AWSResponse
+
+from rctools.aws import clients
+from rctools.aws.clients import RateLimiter, get_client, throttle_counts
+
+
+class RawBody:
+    def __init__(self, body: dict):
+        self.body = json.dumps(body).encode()
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+@pytest.fixture
+def cognito(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    monkeypatch.setattr(clients, '_clients', {})
+    monkeypatch.setattr(clients, '_throttles', {})
+    monkeypatch.setattr('botocore.retries.standard.ExponentialBackoff.delay_amount', lambda self, context: 0)
+    monkeypatch.setattr('botocore.retries.bucket.TokenBucket.acquire', lambda self, amount=1, block=True: True)
+    return get_client('cognito-idp')
+
+
+def test__throttles_are_retried_and_counted(cognito):
+    responses = [
+        AWSResponse('https://cognito', 400, {}, RawBody({'__type': 'TooManyRequestsException'})),
+        AWSResponse('https://cognito', 200, {}, RawBody({'Users': []})),
+    ]
+    cognito.meta.events.register('before-send.cognito-idp', lambda **kwargs: responses.pop(0))
+    assert cognito.list_users(UserPoolId='us-east-1_test')['Users'] == []
+    assert throttle_counts() == {'cognito-idp.ListUsers': 1}
+
+
+def test__lambda_invokes_are_not_retried(cognito):
+    lambda_client = get_client('lambda')
+    sent = []
+    lambda_client.meta.events.register('before-send.lambda', lambda **kwargs: sent.append(1) or AWSResponse(
+        'https://lambda', 429, {}, RawBody({'__type': 'TooManyRequestsException'})))
+    with pytest.raises(lambda_client.exceptions.TooManyRequestsException):
+        lambda_client.invoke(FunctionName='alerts', InvocationType='Event', Payload=b'{}')
+    assert len(sent) == 1
+
+
+def test__clients_are_shared(cognito):
+    assert get_client('cognito-idp') is cognito
+
+
+def test__rate_limiter_spaces_out_calls(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr('rctools.aws.clients.time.sleep', sleeps.append)
+    limiter = RateLimiter(rate=10, burst=2)
+    for _ in range(4):
+        limiter.acquire()
+    assert len(sleeps) == 2
+    assert sleeps[-1] == pytest.approx(0.2, abs=0.01)
@@ -0,0 +1,31 @@
+import pytest
+
+from rctools.company import INSTALLER_CODE_ATTEMPTS, INSTALLER_CODE_TS, put_company_installer_code
+from rctools.exceptions import RecordAlreadyExists
+from rctools.tests.fake_dynamodb import FakeDynamoDB
+
+INSTALLER = {'company_id': 'co1', 'first_name': 'Ada', 'last_name': 'Lee', 'email': 'ada@example.com',
+             'phone_number': '+15555550100'}
+
+
+def test__installer_codes_skip_codes_stored_under_their_creation_time(monkeypatch):
+    table = FakeDynamoDB().create_table('installer_codes', ('code', 'ts'))
+    table.put_item(Item={**INSTALLER, 'code': 'abc123', 'ts': 1650000000000})  # stored before the fixed sort key
+    table.put_item(Item={**INSTALLER, 'code': 'def456', 'ts': INSTALLER_CODE_TS})
+    codes = iter(['abc123', 'def456', 'ghi789'])
+    monkeypatch.setattr('rctools.company.create_new_installer_code', lambda: next(codes))
+
+    assert put_company_installer_code(table, dict(INSTALLER)) == 'ghi789'
+    assert table.get_item(Key={'code': 'abc123', 'ts': 1650000000000})['Item']['ts'] == 1650000000000
+    assert table.get_item(Key={'code': 'ghi789', 'ts': INSTALLER_CODE_TS})['Item']['email'] == INSTALLER['email']
+
+
+def test__installer_codes_give_up_after_a_few_attempts(monkeypatch):
+    table = FakeDynamoDB().create_table('installer_codes', ('code', 'ts'))
+    table.put_item(Item={**INSTALLER, 'code': 'abc123', 'ts': INSTALLER_CODE_TS})
+    attempts = []
+    monkeypatch.setattr('rctools.company.create_new_installer_code', lambda: attempts.append(1) or 'abc123')
+
+    with pytest.raises(RecordAlreadyExists):
+        put_company_installer_code(table, dict(INSTALLER))
+    assert len(attempts) == INSTALLER_CODE_ATTEMPTS
@@ -0,0 +1,114 @@
+import json
+from datetime import datetime
+
+from rctools import directory as directory_module
+from rctools.customers import get_all_customers, update_customer_data_in_s3
+from rctools.directory import INSTALLERS, directory_key
+from rctools.installers import (get_all_installers, get_installers_by_id, put_installer_data_into_s3,
+                                remove_installer_from_directory, update_installer_data_in_s3,
+                                update_installer_job_data_in_s3)
+from rctools.tests.test_s3 import SlowS3, fresh_cache  # noqa: F401
+
+
+class FakeCognito:
+    """Serves list_users from a list of users, one page at a time"""
+    def __init__(self, users, page_size=2):
+        self.users = users
+        self.page_size = page_size
+        self.calls = 0
+
+    def list_users(self, UserPoolId, PaginationToken=None):
+        self.calls += 1
+        start = int(PaginationToken or 0)
+        resp = {'Users': [dict(u) for u in self.users[start:start + self.page_size]]}
+        if start + self.page_size < len(self.users):
+            resp['PaginationToken'] = str(start + self.page_size)
+        return resp
+
+    def admin_get_user(self, UserPoolId, Username):
+        self.calls += 1
+        user = next(u for u in self.users if u['Username'] == Username)
+        return {'Username': Username, 'UserAttributes': user['Attributes'], 'UserStatus': user['UserStatus']}
+
+
+def cognito_user(username, name, status='CONFIRMED'):
+    return {'Username': username, 'Enabled': True, 'UserStatus': status, 'UserCreateDate': datetime(2022, 5, 1),
+            'Attributes': [{'Name': 'sub', 'Value': f'sub-{username}'}, {'Name': 'name', 'Value': name}]}
+
+
+def stored_directory(client, kind=INSTALLERS):
+    return json.loads(client.objects[directory_key(kind)])
+
+
+def test__listings_are_served_from_the_directory_once_seeded():
+    cognito = FakeCognito([cognito_user(f'i{n}', f'Installer {n}') for n in range(3)])
+    client = SlowS3({f'installers/i{n}.json': {'zip': '49341', 'company_id': 'co1'} for n in range(3)})
+
+    first = get_all_installers(cognito, client, 'pool', 'bucket')
+    assert first[0]['name'] == 'Installer 0' and first[0]['company_id'] == 'co1' and first[0]['id'] == 'sub-i0'
+    assert client.puts == 1 and stored_directory(client)['version'] == 1
+
+    calls, downloads = cognito.calls, client.downloads
+    for _ in range(3):
+        installers = get_all_installers(cognito, client, 'pool', 'bucket')
+    assert installers == [{**user, 'UserCreateDate': '2022-05-01T00:00:00'} for user in first]
+    assert cognito.calls == calls and client.downloads == downloads
+    assert client.puts == 1 and stored_directory(client)['version'] == 1  # listings never rewrite it
+
+    assert get_installers_by_id(cognito, client, 'pool', 'bucket', ['i2'])[0]['name'] == 'Installer 2'
+    assert cognito.calls == calls
+
+
+def test__cognito_fields_are_refreshed_after_the_interval(monkeypatch):
+    cognito = FakeCognito([cognito_user('c1', 'Customer 1', status='UNCONFIRMED'), cognito_user('c2', 'Customer 2')])
+    client = SlowS3({'customers/c1.json': {'zip': '49341'}, 'customers/c2.json': {}, 'customers/c3.json': {'zip': '1'}})
+    get_all_customers(cognito, client, 'pool', 'bucket')
+
+    cognito.users[0]['UserStatus'] = 'CONFIRMED'
+    cognito.users[1]['Enabled'] = False
+    cognito.users.append(cognito_user('c3', 'Customer 3'))
+    [customer, _] = get_all_customers(cognito, client, 'pool', 'bucket')
+    assert customer['UserStatus'] == 'UNCONFIRMED'
+
+    monkeypatch.setattr(directory_module, 'mk_timestamp', lambda: 2 ** 50)
+    downloads = client.downloads
+    customers = directory_module.list_directory_users(cognito, client, 'pool', 'bucket', 'customers', refresh_interval=0)
+    assert [(c['Username'], c['UserStatus'], c.get('zip')) for c in customers] == [('c1', 'CONFIRMED', '49341'),
+                                                                                  ('c3', 'CONFIRMED', '1')]
+    assert client.downloads == downloads + 1  # only the new customer's S3 data
+
+
+def test__profile_writes_keep_the_directory_current():
+    cognito = FakeCognito([cognito_user('i1', 'Installer 1'), cognito_user('i2', 'Installer 2'),
+                           cognito_user('i3', 'Installer 3')])
+    client = SlowS3({'installers/i1.json': {'zip': '49341'}, 'installers/i2.json': {'zip': '10001'}})
+    get_all_installers(cognito, client, 'pool', 'bucket')
+
+    update_installer_data_in_s3(client, 'bucket', 'i1', {'zip': '49342'})
+    puts = client.puts
+    update_installer_data_in_s3(client, 'bucket', 'i1', {'zip': '49342'})
+    assert client.puts == puts + 1  # only the installer document, the entry didn't change
+    update_installer_job_data_in_s3(client, 'bucket', 'i1', {'ticket_id': 't1'})
+    remove_installer_from_directory(client, 'bucket', 'i2')
+    put_installer_data_into_s3(client, 'bucket', 'i3', {'name': 'Installer 3', 'scheduling': {'mon': {}}})
+
+    users = stored_directory(client)['users']
+    assert users['i1']['data'] == {'zip': '49342', 'jobs': [{'ticket_id': 't1'}]}
+    assert 'i2' not in users and users['i3']['data'] == {'scheduling': {'mon': {}}}
+
+    installers = get_all_installers(cognito, client, 'pool', 'bucket')
+    assert [i['Username'] for i in installers] == ['i1', 'i3']
+    assert installers[1]['name'] == 'Installer 3' and installers[1]['scheduling'] == {'mon': {}}
+
+    # Installers missing from the directory are read from Cognito and S3
+    [installer] = get_installers_by_id(cognito, client, 'pool', 'bucket', ['i2'])
+    assert installer['name'] == 'Installer 2' and installer['zip'] == '10001'
+
+
+def test__customer_writes_keep_the_directory_current():
+    cognito = FakeCognito([cognito_user('c1', 'Customer 1')])
+    client = SlowS3({'customers/c1.json': {}})
+    get_all_customers(cognito, client, 'pool', 'bucket')
+    update_customer_data_in_s3(client, 'bucket', 'c1', {'zip': '49341'})
+    [customer] = get_all_customers(cognito, client, 'pool', 'bucket')
+    assert customer['zip'] == '49341' and cognito.calls == 1
@@ -1,4 +1,19 @@
-from rctools.aws.dynamodb import DynamoPrimaryKey
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import boto3
+import pytest
+from boto3.dynamodb.conditions import Attr, ConditionExpressionBuilder
+from botocore.exceptions import ClientError
+
+from rctools.aws.dynamodb import (JSON_ENCODERS, KEY_COND_BEGINS_WITH, KEY_COND_BETWEEN, KEY_COND_GTE, KEY_TYPE_STRING,
+                                  DynamoPrimaryKey, DynamoTransaction, batch_get, batch_write, create_dynamo_record_if_absent,
+                                  decode_item, iter_parallel_scan, iter_query, low_level_client, merge_partitions,
+                                  mk_dynamo_record, mk_key_condition_expression, mk_diff_update_expression, mk_projection_expression,
+                                  query_partitions, scan_by_attributes, update_versioned_dynamo_record)
+from rctools.exceptions import ConditionalWriteConflict, QueryDeadlineExceeded, RecordAlreadyExists, TransactionCancelled
+from rctools.tests.fake_dynamodb import FakeDynamoDB
 
 
 def test__only_partition_key():
@@ -17,3 +32,445 @@ def test__sort_is_int():
     pk = DynamoPrimaryKey()
     pk.sort = {'foo': 1}
     assert pk.sort.get_typed_value() == 1
+
+
+def build(pk):
+    return ConditionExpressionBuilder().build_expression(mk_key_condition_expression(pk), is_key_condition=True)
+
+
+def test__sort_between():
+    pk = DynamoPrimaryKey()
+    pk.partition = {'installer_id': 'abc'}
+    pk.sort = {'ts': ('100', 200)}
+    pk.sort.comparator = KEY_COND_BETWEEN
+    expression = build(pk)
+    assert expression.condition_expression == '(#n0 = :v0 AND #n1 BETWEEN :v1 AND :v2)'
+    assert list(expression.attribute_value_placeholders.values()) == ['abc', 100, 200]
+
+
+def test__string_sort_begins_with():
+    pk = DynamoPrimaryKey()
+    pk.partition = {'pk': 'job#1'}
+    pk.sort = DynamoPrimaryKey.KeyQuery(key='sk', value='schedule#', comparator=KEY_COND_BEGINS_WITH, value_type=KEY_TYPE_STRING)
+    expression = build(pk)
+    assert 'begins_with(#n1, :v1)' in expression.condition_expression
+    assert expression.attribute_value_placeholders[':v1'] == 'schedule#'
+
+
+def test__partition_only_supports_eq():
+    pk = DynamoPrimaryKey()
+    pk.partition = {'foo': 'bar'}
+    pk.partition.comparator = KEY_COND_GTE
+    with pytest.raises(ValueError):
+        mk_key_condition_expression(pk)
+
+
+class PagedTable:
+    """Minimal stand-in for a dynamo table that serves query results in pages"""
+    def __init__(self, items):
+        self.items = items
+        self.limits = []
+
+    def query(self, **kwargs):
+        start = kwargs.get('ExclusiveStartKey', {}).get('idx', 0)
+        limit = kwargs.get('Limit', len(self.items))
+        self.limits.append(limit)
+        page = self.items[start:start + limit]
+        response = {'Items': page}
+        if start + limit < len(self.items):
+            response['LastEvaluatedKey'] = {'idx': start + limit}
+        return response
+
+
+def test__iter_query_reads_every_page():
+    table = PagedTable([{'n': i} for i in range(10)])
+    pk = DynamoPrimaryKey()
+    pk.partition = {'foo': 'bar'}
+    items = list(iter_query(table, pk, page_size=3))
+    assert [i['n'] for i in items] == list(range(10))
+    assert table.limits == [3, 6, 12]
+
+
+def test__iter_query_stops_at_max_items():
+    table = PagedTable([{'n': i} for i in range(10)])
+    pk = DynamoPrimaryKey()
+    pk.partition = {'foo': 'bar'}
+    items = list(iter_query(table, pk, page_size=3, max_items=4))
+    assert len(items) == 4
+    assert table.limits == [3, 1]
+
+
+def test__iter_query_is_lazy():
+    table = PagedTable([{'n': i} for i in range(10)])
+    pk = DynamoPrimaryKey()
+    pk.partition = {'foo': 'bar'}
+    next(iter_query(table, pk, page_size=2))
+    assert len(table.limits) == 1
+
+
+def test__query_partitions_groups_and_merges():
+    table = FakeDynamoDB().create_table('reservations', ('id', 'ts'), indexes={'installer_id': ('installer_id', 'ts')})
+    batch_write(table, puts=[{'id': f'r{i}', 'ts': i, 'installer_id': f'i{i % 3}'} for i in range(12)])
+    sort = DynamoPrimaryKey.KeyQuery(key='ts', value=3, comparator=KEY_COND_GTE)
+    results = query_partitions(table, 'installer_id', ['i2', 'i0', 'nobody', 'i0'], sort=sort, index='installer_id',
+                               max_items_per_key=2)
+    assert list(results) == ['i2', 'i0', 'nobody']
+    assert [r['ts'] for r in results['i2']] == [5, 8]
+    assert [r['ts'] for r in results['i0']] == [3, 6]
+    assert results['nobody'] == []
+    assert [r['ts'] for r in merge_partitions(results, 'ts')] == [3, 5, 6, 8]
+
+
+class SlowTable:
+    """Answers every partition at once except 'slow'"""
+    name = 'slow'
+
+    def query(self, **kwargs):
+        expression = ConditionExpressionBuilder().build_expression(kwargs['KeyConditionExpression'], is_key_condition=True)
+        value = list(expression.attribute_value_placeholders.values())[0]
+        if value == 'slow':
+            time.sleep(1)
+        return {'Items': [{'pk': value}]}
+
+
+def test__query_partitions_deadline():
+    started = time.monotonic()
+    with pytest.raises(QueryDeadlineExceeded) as e:
+        query_partitions(SlowTable(), 'pk', ['a', 'slow', 'b'], deadline=0.2)
+    assert time.monotonic() - started < 0.9
+    assert e.value.results == {'a': [{'pk': 'a'}], 'b': [{'pk': 'b'}]}
+
+
+class SegmentedClient:
+    """Serves scan pages per segment, like the low-level dynamo client"""
+    def __init__(self, items, page_size=2):
+        self.items = items
+        self.page_size = page_size
+
+    def scan(self, **kwargs):
+        segment = [i for i in self.items if i['n'] % kwargs['TotalSegments'] == kwargs['Segment']]
+        start = kwargs.get('ExclusiveStartKey', {}).get('idx', 0)
+        page = segment[start:start + self.page_size]
+        response = {'Items': page, 'ScannedCount': len(page)}
+        if start + self.page_size < len(segment):
+            response['LastEvaluatedKey'] = {'idx': start + self.page_size}
+        return response
+
+
+class ScannableTable:
+    def __init__(self, items):
+        self.name = 'scannable'
+        self.meta = type('Meta', (), {'client': SegmentedClient(items)})()
+
+
+def test__parallel_scan_returns_whole_table():
+    table = ScannableTable([{'n': i} for i in range(25)])
+    progress = []
+    items = list(iter_parallel_scan(table, total_segments=3, on_progress=lambda p: progress.append(p.copy())))
+    assert sorted(i['n'] for i in items) == list(range(25))
+    assert progress[-1].segments_done == 3
+    assert progress[-1].items == 25
+
+
+def test__scan_by_attributes_with_segments():
+    table = ScannableTable([{'n': i} for i in range(7)])
+    items, cursor_token = scan_by_attributes(table, total_segments=2)
+    assert len(items) == 7
+    assert cursor_token is None
+
+
+class BatchClient:
+    """Serves batch_get_item, leaving the last key of each request unprocessed once"""
+    def __init__(self, items):
+        self.items = {i['id']: i for i in items}
+        self.requests = []
+        self.deferred = set()
+
+    def batch_get_item(self, RequestItems):
+        (name, request), = RequestItems.items()
+        self.requests.append(len(request['Keys']))
+        keys = request['Keys']
+        unprocessed = []
+        if keys[-1]['id'] not in self.deferred:
+            self.deferred.add(keys[-1]['id'])
+            keys, unprocessed = keys[:-1], keys[-1:]
+        response = {'Responses': {name: [self.items[k['id']] for k in keys if k['id'] in self.items]}}
+        if unprocessed:
+            response['UnprocessedKeys'] = {name: {'Keys': unprocessed}}
+        return response
+
+
+def test__batch_get_chunks_retries_and_keeps_order(monkeypatch):
+    monkeypatch.setattr('rctools.aws.dynamodb.backoff', lambda attempt: None)
+    client = BatchClient([{'id': i} for i in range(250)])
+    table = type('Table', (), {'name': 'jobs', 'meta': type('Meta', (), {'client': client})()})()
+    keys = [{'id': i} for i in reversed(range(260))] + [{'id': 3}]
+    items = batch_get(table, keys)
+    assert [i['id'] for i in items] == list(reversed(range(250)))
+    assert sorted(client.requests, reverse=True)[:3] == [100, 100, 60]
+
+
+class BatchWriteClient:
+    """Records batch_write_item calls, leaving the first item of each request unprocessed once"""
+    def __init__(self):
+        self.written = []
+        self.requests = []
+        self.deferred = False
+
+    def batch_write_item(self, RequestItems):
+        (name, chunk), = RequestItems.items()
+        self.requests.append(len(chunk))
+        response = {}
+        if not self.deferred:
+            self.deferred = True
+            chunk, response['UnprocessedItems'] = chunk[1:], {name: chunk[:1]}
+        self.written += chunk
+        return response
+
+
+def test__batch_write_chunks_and_retries(monkeypatch):
+    monkeypatch.setattr('rctools.aws.dynamodb.backoff', lambda attempt: None)
+    client = BatchWriteClient()
+    table = type('Table', (), {'name': 'areas', 'meta': type('Meta', (), {'client': client})()})()
+    puts = [{'zip_code': str(i), 'ts': i, 'lat': 1.5} for i in range(40)]
+    deletes = [{'zip_code': str(i), 'ts': i} for i in range(30, 60)]
+    stats = batch_write(table, puts=puts, deletes=deletes)
+    assert stats.puts == 40 and stats.deletes == 20
+    assert stats.retries == 1
+    assert len(client.written) == 60
+    assert max(client.requests) == 25
+
+
+def test__projection_expression_uses_placeholders():
+    expression, names = mk_projection_expression(['ticket_id', 'name', 'job_scope.chargers.purchased[0]', 'job_scope.tier'])
+    assert expression == '#p0, #p1, #p2.#p3.#p4[0], #p2.#p5'
+    assert names == {'#p0': 'ticket_id', '#p1': 'name', '#p2': 'job_scope', '#p3': 'chargers', '#p4': 'purchased', '#p5': 'tier'}
+
+
+class RecordingTable:
+    def query(self, **kwargs):
+        self.args = kwargs
+        return {'Items': []}
+
+
+def test__iter_query_forwards_projection():
+    table = RecordingTable()
+    pk = DynamoPrimaryKey()
+    pk.partition = {'foo': 'bar'}
+    list(iter_query(table, pk, attributes=['ticket_id', 'ts']))
+    assert table.args['ProjectionExpression'] == '#p0, #p1'
+    assert table.args['ExpressionAttributeNames'] == {'#p0': 'ticket_id', '#p1': 'ts'}
+
+
+def test__diff_update_only_writes_changes():
+    old = {
+        'ticket_id': 't1', 'ts': 1, 'completed': False, 'notes': ['a'],
+        'job_scope': {'home': {'year_built': 1970, 'rent_own': 'own'}, 'tier': {'price': Decimal('1500')}},
+    }
+    new = {
+        'ticket_id': 't1', 'ts': 1, 'completed': False, 'notes': ['a', 'b'], 'installer_id': None,
+        'job_scope': {'home': {'year_built': 1971, 'rent_own': 'own'}, 'tier': {'price': 1500.0}, 'measurement': None},
+        'reschedule': None,
+    }
+    old['job_scope']['measurement'] = {'height': '1'}
+    expression, names, values = mk_diff_update_expression(old, new, exclude=('ticket_id', 'ts'))
+    assert expression == 'SET #u0 = :u0, #u1.#u2.#u3 = :u1 REMOVE #u1.#u4'
+    assert names == {'#u0': 'notes', '#u1': 'job_scope', '#u2': 'home', '#u3': 'year_built', '#u4': 'measurement'}
+    assert list(values.values()) == [['a', 'b'], 1971]
+
+
+def test__diff_update_without_changes():
+    expression, _, _ = mk_diff_update_expression({'a': 1, 'b': {'c': 2}}, {'a': 1, 'b': {'c': 2}})
+    assert expression is None
+
+
+def conditional_check_failed():
+    return ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+
+
+class VersionedTable:
+    """Single-item table that enforces ConditionExpressions on a version attribute"""
+    name = 'versioned'
+
+    def __init__(self, item):
+        self.item = item
+        self.updates = []
+        self.gets = 0
+
+    def put_item(self, Item, ConditionExpression):
+        if self.item is not None:
+            raise conditional_check_failed()
+        self.item = Item
+
+    def get_item(self, Key, ConsistentRead):
+        self.gets += 1
+        return {'Item': dict(self.item)}
+
+    def update_item(self, **kwargs):
+        self.updates.append(kwargs)
+        expected = kwargs['ExpressionAttributeValues'].get(':ver')
+        if self.item.get('version') != expected:
+            raise conditional_check_failed()
+        self.item['version'] = kwargs['ExpressionAttributeValues'][':ver_next']
+
+
+def test__create_if_absent_raises_when_taken():
+    table = VersionedTable(None)
+    create_dynamo_record_if_absent(table, {'code': 'abc', 'ts': 1}, 'code')
+    with pytest.raises(RecordAlreadyExists):
+        create_dynamo_record_if_absent(table, {'code': 'abc', 'ts': 1}, 'code')
+
+
+def test__versioned_update_uses_held_item_in_one_write(monkeypatch):
+    backoffs = []
+    monkeypatch.setattr('rctools.aws.dynamodb.backoff', backoffs.append)
+    table = VersionedTable({'ticket_id': 't1', 'ts': 1, 'notes': ['a']})
+    current = dict(table.item)
+    new = update_versioned_dynamo_record(table, {'ticket_id': 't1', 'ts': 1},
+                                         lambda item: {**item, 'notes': ['a', 'b']}, current=current)
+    assert backoffs == []  # a write that succeeds first time never sleeps
+    assert table.gets == 0
+    assert len(table.updates) == 1
+    assert table.updates[0]['ConditionExpression'] == 'attribute_not_exists(#ver)'
+    assert table.updates[0]['UpdateExpression'] == 'SET #ver = :ver_next, #u0 = :u0'
+    assert new['version'] == table.item['version'] == 1
+
+
+def test__versioned_update_retries_on_stale_version(monkeypatch):
+    monkeypatch.setattr('rctools.aws.dynamodb.backoff', lambda attempt: None)
+    table = VersionedTable({'ticket_id': 't1', 'ts': 1, 'notes': ['a'], 'version': 3})
+    stale = {**table.item, 'version': 2}
+    update_versioned_dynamo_record(table, {'ticket_id': 't1', 'ts': 1},
+                                   lambda item: {**item, 'notes': ['a', 'b']}, current=stale)
+    assert table.gets == 1
+    assert [u['ExpressionAttributeValues'][':ver'] for u in table.updates] == [2, 3]
+    assert table.item['version'] == 4
+
+
+class ContendedTable(VersionedTable):
+    def update_item(self, **kwargs):
+        raise conditional_check_failed()
+
+
+def test__versioned_update_gives_up(monkeypatch):
+    backoffs = []
+    monkeypatch.setattr('rctools.aws.dynamodb.backoff', backoffs.append)
+    table = ContendedTable({'ticket_id': 't1', 'ts': 1, 'version': 1})
+    with pytest.raises(ConditionalWriteConflict):
+        update_versioned_dynamo_record(table, {'ticket_id': 't1', 'ts': 1}, lambda item: {**item, 'a': 1}, max_retries=2)
+    assert table.gets == 3
+    assert backoffs == [0, 1]  # no sleep before giving up
+
+
+class TransactClient:
+    def __init__(self, cancel=False):
+        self.cancel = cancel
+        self.calls = []
+
+    def transact_write_items(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.cancel:
+            raise ClientError({'Error': {'Code': 'TransactionCanceledException'},
+                               'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}]}, 'TransactWriteItems')
+        return {}
+
+
+def mk_table(name, client):
+    return type('Table', (), {'name': name, 'meta': type('Meta', (), {'client': client})()})()
+
+
+def test__transaction_commits_across_tables_in_one_call():
+    client = TransactClient()
+    jobs, alerts = mk_table('jobs', client), mk_table('alerts', client)
+    transaction = DynamoTransaction()
+    transaction.condition_check(jobs, {'ticket_id': 't1', 'ts': 1}, Attr('customer_id').eq('c1'))
+    transaction.update_versioned(jobs, {'ticket_id': 't1', 'ts': 1}, {'ticket_id': 't1', 'ts': 1, 'version': 2},
+                                 {'ticket_id': 't1', 'ts': 1, 'version': 2, 'installer_id': 'i1'})
+    transaction.put(alerts, {'uid': 'c1', 'ts': 5})
+    transaction.commit()
+
+    (call,) = client.calls
+    check, update, put = call['TransactItems']
+    assert check['ConditionCheck']['TableName'] == 'jobs'
+    assert check['ConditionCheck']['ConditionExpression'] == '#n0 = :v0'
+    assert check['ConditionCheck']['ExpressionAttributeValues'] == {':v0': 'c1'}
+    assert update['Update']['ConditionExpression'] == '#ver = :ver'
+    assert update['Update']['ExpressionAttributeValues'] == {':u0': 'i1', ':ver_next': 3, ':ver': 2}
+    assert put == {'Put': {'Item': {'uid': 'c1', 'ts': 5}, 'TableName': 'alerts'}}
+
+
+def test__transaction_cancellation_reasons():
+    transaction = DynamoTransaction()
+    transaction.put(mk_table('alerts', TransactClient(cancel=True)), {'uid': 'c1', 'ts': 5})
+    with pytest.raises(TransactionCancelled) as e:
+        transaction.commit()
+    assert e.value.reasons == [{'Code': 'ConditionalCheckFailed'}]
+
+
+def test__decode_item_numbers():
+    item = decode_item({
+        'ts': {'N': '1650000000000'},
+        'rating': {'N': '4.5'},
+        'ratio': {'N': '0.12345678901234567'},
+        'job_scope': {'M': {'tier': {'M': {'price': {'N': '1500'}, 'hours': {'L': [{'N': '4'}, {'N': '6'}]}}}}},
+        'notes': {'L': [{'S': 'a'}, {'NULL': True}, {'BOOL': False}]},
+    })
+    assert item['ts'] == 1650000000000 and type(item['ts']) is int
+    assert item['rating'] == 4.5 and type(item['rating']) is float
+    assert item['ratio'] == Decimal('0.12345678901234567')
+    assert item['job_scope']['tier'] == {'price': Decimal('1500'), 'hours': [4, 6]}
+    assert item['notes'] == ['a', None, False]
+
+
+def test__mk_dynamo_record_copies_and_converts():
+    obj = {
+        'rating': 4.5,
+        'created': datetime(2022, 4, 1, 9, 30, 5),
+        'photos': [{'size': 1.25, 'caption': None}, None],
+        'tags': {0.5, 'a'},
+        'skipped': None,
+    }
+    record = mk_dynamo_record(obj)
+    assert record == {
+        'rating': Decimal('4.5'),
+        'created': '2022-04-01T09:30:05Z',
+        'photos': [{'size': Decimal('1.25')}, ''],
+        'tags': {Decimal('0.5'), 'a'},
+    }
+    assert obj['photos'] == [{'size': 1.25, 'caption': None}, None]
+
+
+def test__decimals_are_encoded_for_responses():
+    encode = JSON_ENCODERS[Decimal]
+    assert [encode(Decimal('1500')), encode(Decimal('1500.00')), encode(Decimal('4.5'))] == [1500, 1500, 4.5]
+    assert type(encode(Decimal('1500'))) is int
+
+
+class FastClient:
+    def __init__(self):
+        self.calls = []
+
+    def batch_get_item(self, RequestItems):
+        self.calls.append(RequestItems)
+        (name, request), = RequestItems.items()
+        return {'Responses': {name: [{**k, 'price': {'N': '9.99'}, 'rating': {'N': '4.5'}} for k in request['Keys']]}}
+
+
+def test__batch_get_fast_path():
+    client = FastClient()
+    table = mk_table('jobs', None)
+    table.meta.low_level_client = client
+    items = batch_get(table, [{'ticket_id': 't1', 'ts': 1}, {'ticket_id': 't2', 'ts': 2.5}], fast=True,
+                      attributes=['price', 'rating'])
+    assert client.calls[0]['jobs']['Keys'] == [{'ticket_id': {'S': 't1'}, 'ts': {'N': '1'}},
+                                               {'ticket_id': {'S': 't2'}, 'ts': {'N': '2.5'}}]
+    assert items[0] == {'ticket_id': 't1', 'ts': 1, 'price': Decimal('9.99'), 'rating': 4.5}
+    assert [type(items[0][name]) for name in ('ts', 'price', 'rating')] == [int, Decimal, float]  # money stays Decimal
+
+
+def test__fast_reads_use_the_tables_region_and_endpoint():
+    resource = boto3.resource('dynamodb', region_name='eu-west-1', endpoint_url='http://localhost:8000',
+                              aws_access_key_id='AKIAEXAMPLE', aws_secret_access_key='secret')
+    client = low_level_client(resource.Table('jobs'))
+    assert client is not resource.meta.client
+    assert (client.meta.region_name, client.meta.endpoint_url) == ('eu-west-1', 'http://localhost:8000')
@@ -0,0 +1,114 @@
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from rctools.aws.dynamodb import (DynamoPrimaryKey, DynamoTransaction, batch_get, batch_write, create_dynamo_record_if_absent,
+                                  iter_parallel_scan, iter_query, update_versioned_dynamo_record)
+from rctools.aws.metrics import collect_dynamodb_metrics
+from rctools.aws.unit_of_work import open_unit_of_work
+from rctools.customers import get_customer_jobs_from_dynamo
+from rctools.exceptions import RecordAlreadyExists, TransactionCancelled
+from rctools.tests.fake_dynamodb import FakeDynamoDB
+
+
+@pytest.fixture
+def fake():
+    return FakeDynamoDB()
+
+
+@pytest.fixture
+def jobs(fake):
+    return fake.create_table('jobs', ('ticket_id', 'ts'), indexes={'customer_id': ('customer_id', 'ts', 'KEYS_ONLY')})
+
+
+def customer_key(customer_id):
+    pk = DynamoPrimaryKey()
+    pk.partition = {'customer_id': customer_id}
+    return pk
+
+
+def test__query_pages_through_a_keys_only_index(fake, jobs):
+    batch_write(jobs, puts=[{'ticket_id': f't{i}', 'ts': i, 'customer_id': f'c{i % 2}', 'notes': 'x'} for i in range(10)])
+    fake.reset_metrics()
+    items = list(iter_query(jobs, customer_key('c0'), index='customer_id', page_size=2, ScanIndexForward=False))
+    assert [i['ts'] for i in items] == [8, 6, 4, 2, 0]
+    assert items[0] == {'ticket_id': 't8', 'ts': 8, 'customer_id': 'c0'}
+    summary = fake.metrics.summary()
+    assert summary['calls'] == 2  # a page of 2, then the remaining 3 fit in a page of 4
+    assert summary['rcu'] == 1
+
+
+
+
+def test__batch_write_sends_the_last_put_of_a_key(fake, jobs):
+    puts = [{'ticket_id': 't1', 'ts': 1, 'notes': str(i)} for i in range(30)] + [{'ticket_id': 't2', 'ts': 1}]
+    stats = batch_write(jobs, puts=puts, deletes=[{'ticket_id': 't3', 'ts': 1}] * 2)
+    assert stats.puts == 2 and stats.deletes == 1
+    assert jobs.get_item(Key={'ticket_id': 't1', 'ts': 1})['Item']['notes'] == '29'
+
+    with open_unit_of_work() as uow:
+        uow.put(jobs, {'ticket_id': 't2', 'ts': 1, 'notes': 'a'})
+        uow.put(jobs, {'ticket_id': 't2', 'ts': 1, 'notes': 'b'})
+    assert jobs.get_item(Key={'ticket_id': 't2', 'ts': 1})['Item']['notes'] == 'b'
+
+def test__customer_jobs_are_limited_in_the_index_query(fake, jobs):
+    batch_write(jobs, puts=[{'ticket_id': f't{i}', 'ts': i, 'customer_id': 'c1'} for i in range(30)])
+    assert len(get_customer_jobs_from_dynamo(jobs, 'c1')) == 30
+    fake.reset_metrics()
+    assert len(get_customer_jobs_from_dynamo(jobs, 'c1', limit=5)) == 5
+    assert fake.metrics.summary()['calls'] == 2  # one query page, one batch get
+
+def test__conditional_writes(jobs):
+    create_dynamo_record_if_absent(jobs, {'ticket_id': 't1', 'ts': 1, 'notes': ['a']}, 'ticket_id')
+    with pytest.raises(RecordAlreadyExists):
+        create_dynamo_record_if_absent(jobs, {'ticket_id': 't1', 'ts': 1}, 'ticket_id')
+    new = update_versioned_dynamo_record(jobs, {'ticket_id': 't1', 'ts': 1}, lambda item: {**item, 'notes': ['a', 'b']})
+    stored = jobs.get_item(Key={'ticket_id': 't1', 'ts': 1})['Item']
+    assert stored['notes'] == ['a', 'b'] and stored['version'] == new['version'] == 1
+    with pytest.raises(ClientError) as e:
+        jobs.update_item(Key={'ticket_id': 't1', 'ts': 1}, UpdateExpression='SET #v = :v',
+                         ExpressionAttributeNames={'#v': 'version'}, ExpressionAttributeValues={':v': 5},
+                         ConditionExpression=Attr('version').eq(0))
+    assert e.value.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+
+def test__transactions_are_atomic(fake, jobs):
+    jobs.put_item(Item={'ticket_id': 't1', 'ts': 1, 'count': 1})
+    transaction = DynamoTransaction()
+    transaction.put(jobs, {'ticket_id': 't2', 'ts': 1})
+    transaction.update(jobs, {'ticket_id': 't1', 'ts': 1}, {}, condition=Attr('count').gt(1), increment={'count': 2})
+    with pytest.raises(TransactionCancelled) as e:
+        transaction.commit()
+    assert [r['Code'] for r in e.value.reasons] == ['None', 'ConditionalCheckFailed']
+    assert 'Item' not in jobs.get_item(Key={'ticket_id': 't2', 'ts': 1})
+
+    transaction = DynamoTransaction()
+    transaction.put(jobs, {'ticket_id': 't2', 'ts': 1})
+    transaction.update(jobs, {'ticket_id': 't1', 'ts': 1}, {}, increment={'count': 2})
+    transaction.commit()
+    assert jobs.get_item(Key={'ticket_id': 't1', 'ts': 1})['Item']['count'] == Decimal(3)
+    assert len(batch_get(jobs, [{'ticket_id': 't1', 'ts': 1}, {'ticket_id': 't2', 'ts': 1}])) == 2
+
+
+def test__capacity_follows_item_size(fake, jobs):
+    with collect_dynamodb_metrics() as metrics:
+        jobs.put_item(Item={'ticket_id': 't1', 'ts': 1, 'customer_id': 'c1', 'notes': 'x' * 5000})
+        jobs.get_item(Key={'ticket_id': 't1', 'ts': 1})
+        jobs.get_item(Key={'ticket_id': 't1', 'ts': 1}, ConsistentRead=True)
+    summary = metrics.summary()
+    assert summary['wcu'] == 5 + 1  # the table plus the keys-only index entry
+    assert summary['rcu'] == 1 + 2
+    assert fake.clock > 0
+    response = jobs.put_item(Item={'ticket_id': 't2', 'ts': 1}, ReturnConsumedCapacity='INDEXES')
+    assert response['ConsumedCapacity'] == {'TableName': 'jobs', 'CapacityUnits': 1, 'WriteCapacityUnits': 1,
+                                            'Table': {'CapacityUnits': 1, 'WriteCapacityUnits': 1}}
+
+
+def test__parallel_scan_covers_every_segment(fake, jobs):
+    batch_write(jobs, puts=[{'ticket_id': f't{i}', 'ts': 0, 'amount': i} for i in range(40)])
+    items = list(iter_parallel_scan(jobs, total_segments=4, page_size=3))
+    assert sorted(i['amount'] for i in items) == list(range(40))
+    items = list(iter_parallel_scan(jobs, {'amount': 7}, total_segments=2, fast=True))
+    assert items == [{'ticket_id': 't7', 'ts': 0, 'amount': 7}]
@@ -0,0 +1,72 @@
+import pytest
+
+from rctools import job_collection as job_collection_module
+
+from rctools.aws.dynamodb import DynamoTransaction
+from rctools.job_collection import get_job_aggregate, job_collection, migrate_job_collection
+from rctools.jobs import put_new_job, update_job_ticket
+from rctools.scheduling import add_job_to_schedule, create_reservation, get_reservation_by_id
+from rctools.tests.fake_dynamodb import FakeDynamoDB
+
+
+@pytest.fixture
+def fake():
+    fake = FakeDynamoDB()
+    fake.create_table('jobs', ('ticket_id', 'ts'))
+    fake.create_table('job-schedule', ('ticket_id', 'ts'))
+    fake.create_table('reservations', ('id', 'ts'))
+    fake.create_table('job-collection', ('ticket_id', 'sk'))
+    yield fake
+    job_collection.disable()
+
+
+def book_job(fake) -> tuple:
+    jobs, reservations = fake.Table('jobs'), fake.Table('reservations')
+    ticket_id = put_new_job(jobs, {'customer_id': 'c1', 'job_scope': {'vehicles': []}})
+    reservation_id = create_reservation(reservations, {'installer_id': 'i1', 'customer_id': 'c1', 'ticket_id': ticket_id,
+                                                       'reservation_date': '2030-01-01', 'start_time': '09:00'})
+    job = jobs.query(KeyConditionExpression='ticket_id = :t', ExpressionAttributeValues={':t': ticket_id})['Items'][0]
+    transaction = DynamoTransaction()
+    update_job_ticket(jobs, {'installer_id': 'i1', 'conversation_id': 'conv1'}, ticket_id, 'c1', job_ticket=job,
+                      transaction=transaction)
+    add_job_to_schedule(fake.Table('job-schedule'), dict(get_reservation_by_id(reservations, reservation_id)), ticket_id,
+                        transaction=transaction)
+    transaction.commit()
+    return ticket_id, reservation_id
+
+
+def test__mirrored_writes_hydrate_the_aggregate_in_one_query(fake):
+    job_collection.enable(fake.Table('job-collection'), reads=True)
+    ticket_id, reservation_id = book_job(fake)
+    fake.reset_metrics()
+    aggregate = get_job_aggregate(ticket_id)
+    assert fake.metrics.calls == 1
+    assert aggregate.ticket['installer_id'] == 'i1' and aggregate.ticket['version'] == 1
+    assert aggregate.conversation_id == 'conv1'
+    assert aggregate.schedule['installer_id'] == 'i1'
+    assert aggregate.reservation(reservation_id)['start_time'] == '09:00'
+
+
+def test__migration_copies_existing_jobs_once(fake):
+    ticket_id, reservation_id = book_job(fake)
+    job_collection.enable(fake.Table('job-collection'), reads=True)
+    assert get_job_aggregate(ticket_id) is None
+
+    tables = [fake.Table(name) for name in ('job-collection', 'jobs', 'job-schedule', 'reservations')]
+    stats = migrate_job_collection(*tables)
+    assert (stats.tickets, stats.schedules, stats.reservations, stats.skipped) == (1, 1, 1, 0)
+    assert get_job_aggregate(ticket_id).reservation(reservation_id) is not None
+    assert migrate_job_collection(*tables).skipped == 3
+
+
+def test__migration_overwrites_stale_ticket_copies(fake, monkeypatch):
+    monkeypatch.setattr(job_collection_module, 'MIGRATION_CHUNKS_PER_WORKER', 1)
+    ticket_id, _ = book_job(fake)
+    tables = [fake.Table(name) for name in ('job-collection', 'jobs', 'job-schedule', 'reservations')]
+    collection = tables[0]
+    collection.put_item(Item={'ticket_id': ticket_id, 'sk': 'ticket', 'customer_id': 'c1', 'version': 0})
+
+    stats = migrate_job_collection(*tables, max_workers=1)
+    assert (stats.tickets, stats.schedules, stats.reservations, stats.skipped) == (1, 1, 1, 0)
+    copy = collection.get_item(Key={'ticket_id': ticket_id, 'sk': 'ticket'})['Item']
+    assert copy['version'] == 1 and copy['installer_id'] == 'i1'
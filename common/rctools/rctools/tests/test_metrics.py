@@ -0,0 +1,42 @@
+import boto3
+from botocore.stub import ANY, Stubber
+
+from rctools.aws.metrics import collect_dynamodb_metrics, instrument_dynamodb
+
+
+def mk_client():
+    client = boto3.client('dynamodb', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    return instrument_dynamodb(client)
+
+
+def test__records_capacity_and_counts_per_index():
+    client = mk_client()
+    with Stubber(client) as stubber, collect_dynamodb_metrics() as metrics:
+        stubber.add_response('query', {
+            'Items': [], 'Count': 2, 'ScannedCount': 5,
+            'ConsumedCapacity': {'TableName': 'jobs', 'CapacityUnits': 1.5,
+                                 'GlobalSecondaryIndexes': {'customer_id': {'CapacityUnits': 1.5}}},
+        }, {'TableName': 'jobs', 'IndexName': 'customer_id', 'KeyConditionExpression': ANY,
+            'ReturnConsumedCapacity': 'INDEXES'})
+        stubber.add_response('put_item', {'ConsumedCapacity': {'TableName': 'jobs', 'CapacityUnits': 1}})
+        client.query(TableName='jobs', IndexName='customer_id', KeyConditionExpression='customer_id = :c')
+        client.put_item(TableName='jobs', Item={'ticket_id': {'S': 't1'}})
+
+    summary = metrics.summary()
+    assert summary['calls'] == 2
+    assert summary['rcu'] == 3 and summary['wcu'] == 1
+    index = next(t for t in summary['tables'] if t['index'] == 'customer_id')
+    assert (index['pages'], index['items'], index['scanned'], index['rcu']) == (1, 2, 5, 1.5)
+    table = next(t for t in summary['tables'] if t['index'] is None)
+    assert table['operations'] == {'PutItem': 1}
+
+    (document, _) = metrics.to_emf(dimensions={'Path': '/jobs'})
+    assert document['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Path', 'Table', 'Index']]
+
+
+def test__nothing_requested_outside_a_collection():
+    client = mk_client()
+    with Stubber(client) as stubber:
+        stubber.add_response('get_item', {}, {'TableName': 'jobs', 'Key': {'ticket_id': {'S': 't1'}}})
+        client.get_item(TableName='jobs', Key={'ticket_id': {'S': 't1'}})
+        stubber.assert_no_pending_responses()
@@ -0,0 +1,125 @@
+import hashlib
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.exceptions import ClientError
+
+from rctools.aws import s3
+from rctools.aws.s3 import (ObjectCache, get_object_from_s3, get_objects_from_s3, object_cache_stats, put_object_into_s3,
+                            update_object_in_s3)
+from rctools.exceptions import ConditionalWriteConflict
+from rctools.installers import get_installers_data_from_s3, update_installer_job_data_in_s3
+
+
+class SlowS3:
+    """Serves JSON objects from a dict with ETags, taking delay seconds per GET"""
+    def __init__(self, objects, delay=0):
+        self.objects = {key: json.dumps(obj) for key, obj in objects.items()}
+        self.delay = delay
+        self.downloads = 0
+        self.puts = 0
+        self.lock = threading.Lock()
+
+    def etag(self, key):
+        return f'"{hashlib.md5(self.objects[key].encode()).hexdigest()}"'
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        time.sleep(self.delay)
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        if IfNoneMatch == self.etag(Key):
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'},
+                               'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        self.downloads += 1
+        return {'Body': io.BytesIO(self.objects[Key].encode('utf-8')), 'ETag': self.etag(Key)}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None):
+        with self.lock:
+            exists = Key in self.objects
+            if (IfNoneMatch == '*' and exists) or (IfMatch and (not exists or IfMatch != self.etag(Key))):
+                raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+            self.objects[Key] = Body
+            self.puts += 1
+            return {'ETag': self.etag(Key)}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(s3, 'object_cache', ObjectCache())
+    monkeypatch.setattr(s3, 'backoff', lambda attempt: None)
+
+
+def test__objects_are_fetched_concurrently_and_keyed():
+    client = SlowS3({f'k{i}': {'n': i} for i in range(10)}, delay=0.1)
+    started = time.monotonic()
+    objects = get_objects_from_s3(client, 'bucket', [f'k{i}' for i in reversed(range(10))] + ['missing'])
+    assert time.monotonic() - started < 0.5
+    assert list(objects) == [f'k{i}' for i in reversed(range(10))] + ['missing']
+    assert objects['k3'] == {'n': 3}
+    assert objects['missing'] is None
+
+
+def test__missing_objects_get_their_own_default():
+    client = SlowS3({'installers/i1.json': {'zip': '49341'}})
+    data = get_installers_data_from_s3(client, 'bucket', ['i1', 'i2', 'i3'])
+    assert data['i1'] == {'zip': '49341'}
+    data['i2']['jobs'] = []
+    assert data['i3'] == {}
+
+
+def test__cached_documents_are_revalidated_by_etag():
+    client = SlowS3({'installers/i1.json': {'zip': '49341', 'jobs': []}})
+    first = get_object_from_s3(client, 'bucket', 'installers/i1.json', {}, cache=True)
+    first['jobs'].append('t1')
+    second = get_object_from_s3(client, 'bucket', 'installers/i1.json', {}, cache=True)
+    assert second == {'zip': '49341', 'jobs': []}
+    assert client.downloads == 1
+    assert object_cache_stats().dict(include={'misses', 'not_modified'}) == {'misses': 1, 'not_modified': 1}
+
+    put_object_into_s3(client, 'bucket', 'installers/i1.json', json.dumps({'zip': '10001'}))
+    assert get_object_from_s3(client, 'bucket', 'installers/i1.json', {}, cache=True) == {'zip': '10001'}
+    assert client.downloads == 2
+
+
+def test__cached_documents_skip_requests_within_max_age():
+    client = SlowS3({'zips/49341.min.json': {'10': ['49341']}})
+    for _ in range(3):
+        assert get_object_from_s3(client, 'bucket', 'zips/49341.min.json', cache=True, max_age=60) == {'10': ['49341']}
+    client.objects['zips/49341.min.json'] = json.dumps({'10': []})  # changed behind the cache's back
+    assert get_object_from_s3(client, 'bucket', 'zips/49341.min.json', cache=True, max_age=60) == {'10': ['49341']}
+    assert object_cache_stats().hits == 3
+
+
+def test__concurrent_updates_are_not_lost():
+    client = SlowS3({})
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda n: update_installer_job_data_in_s3(client, 'bucket', 'i1', {'ticket_id': f't{n}'}), range(16)))
+    jobs = json.loads(client.objects['installers/i1.json'])['jobs']
+    assert sorted(j['ticket_id'] for j in jobs) == sorted(f't{n}' for n in range(16))
+
+
+def test__update_retries_when_the_document_changes_underneath(monkeypatch):
+    client = SlowS3({'customers/c1.json': {'count': 0}})
+
+    def apply(document):
+        if client.puts == 0:
+            client.put_object(Bucket='bucket', Key='customers/c1.json', Body=json.dumps({'count': 10}))
+        return {'count': document['count'] + 1}
+
+    assert update_object_in_s3(client, 'bucket', 'customers/c1.json', apply) == {'count': 11}
+    assert get_object_from_s3(client, 'bucket', 'customers/c1.json', cache=True) == {'count': 11}
+    assert client.downloads == 2  # the first read and the re-read after the conflict
+
+    def always_contended(document):
+        client.put_object(Bucket='bucket', Key='customers/c1.json', Body=json.dumps({'count': document['count'] + 100}))
+        return document
+
+    backoffs = []
+    monkeypatch.setattr(s3, 'backoff', backoffs.append)
+    with pytest.raises(ConditionalWriteConflict):
+        update_object_in_s3(client, 'bucket', 'customers/c1.json', always_contended, max_retries=2)
+    assert backoffs == [0, 1]  # no sleep before giving up
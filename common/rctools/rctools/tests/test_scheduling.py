@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from rctools.models.scheduling import (RESERVATION_EXPIRATION_TIME, RESERVATION_INSTALLER_INDEX, Day,
+                                      StrategyFirstAvailable, get_installer_reservations)
+from rctools.scheduling import create_reservation, get_installer_reservations_by_id
+from rctools.tests.fake_dynamodb import FakeDynamoDB
+from rctools.utils import mk_timestamp
+
+
+def test__expired_reservations_are_filtered_out():
+    reservations_table = FakeDynamoDB().create_table(
+        'reservations', ('id', 'ts'), indexes={RESERVATION_INSTALLER_INDEX: ('installer_id', 'ts', ['reservation_date', 'TimeToLive'])})
+    now = mk_timestamp()
+    create_reservation(reservations_table, {'installer_id': 'i1', 'reservation_date': '2030-01-01', 'ts': now})
+    create_reservation(reservations_table, {'installer_id': 'i1', 'reservation_date': '2030-01-02',
+                                            'ts': now - 2 * RESERVATION_EXPIRATION_TIME})
+    reservations = get_installer_reservations_by_id(reservations_table, 'i1')
+    assert [r['reservation_date'] for r in reservations] == ['2030-01-01']
+    assert get_installer_reservations(reservations_table, 'i1') == reservations
+
+
+def test__first_available_skips_installers_booked_that_day():
+    fake = FakeDynamoDB()
+    reservations_table = fake.create_table(
+        'reservations', ('id', 'ts'), indexes={RESERVATION_INSTALLER_INDEX: ('installer_id', 'ts', ['reservation_date', 'TimeToLive'])})
+    create_reservation(reservations_table, {'installer_id': 'i1', 'reservation_date': '2030-01-01'})
+    installers = [{'Username': uid, 'zip': '49341', 'scheduling': {}, 'service_options': {'basic': True}}
+                  for uid in ('i1', 'i2', 'i3')]
+    installers[0]['scheduling'] = installers[1]['scheduling'] = {'mon': {}}
+    fake.reset_metrics()
+    available = StrategyFirstAvailable().get_available_installers(
+        Day(dt=datetime(2030, 1, 1), idx=0), installers, {'name': 'BI-1'}, '49341', reservations_table)
+    assert [i['Username'] for i in available] == ['i2']
+    assert fake.metrics.calls == 2  # i3 has no schedule so isn't looked up
@@ -0,0 +1,81 @@
+from rctools.aws.streams import INSERT, REMOVE, StreamRouter, ViewBatch
+
+
+class StreamClient:
+    """Applies the checkpoint updates of each transaction so replays can be checked"""
+    def __init__(self):
+        self.checkpoints = {}
+        self.transactions = []
+
+    def batch_get_item(self, RequestItems):
+        (name, request), = RequestItems.items()
+        found = [{'id': k['id'], 'ts': 0, 'sequence_number': self.checkpoints[k['id']]}
+                 for k in request['Keys'] if k['id'] in self.checkpoints]
+        return {'Responses': {name: found}}
+
+    def transact_write_items(self, TransactItems):
+        self.transactions.append(TransactItems)
+        for item in TransactItems:
+            update = item.get('Update', {})
+            if update.get('TableName') == 'checkpoints':
+                self.checkpoints[update['Key']['id']] = update['ExpressionAttributeValues'][':u0']
+        return {}
+
+
+def mk_table(name, client):
+    return type('Table', (), {'name': name, 'meta': type('Meta', (), {'client': client})()})()
+
+
+def mk_record(event_name, ticket_id, installer_id, sequence_number):
+    image = {'ticket_id': {'S': ticket_id}, 'ts': {'N': '1'}, 'installer_id': {'S': installer_id}}
+    change = {'Keys': {'ticket_id': {'S': ticket_id}, 'ts': {'N': '1'}}, 'SequenceNumber': sequence_number}
+    change['OldImage' if event_name == REMOVE else 'NewImage'] = image
+    return {'eventID': sequence_number, 'eventName': event_name, 'dynamodb': change,
+            'eventSourceARN': 'arn:aws:dynamodb:us-east-2:1:table/jobs/stream/2022-01-01T00:00:00.000'}
+
+
+def mk_router(client):
+    counts = mk_table('counts', client)
+    streams = StreamRouter('dashboard', checkpoint_table=mk_table('checkpoints', client))
+
+    @streams.projector('jobs', events=[INSERT, REMOVE])
+    def count_installer_jobs(record, view):
+        change = 1 if record.event_name == INSERT else -1
+        view.increment(counts, {'id': record.image['installer_id'], 'ts': 0}, jobs=change)
+
+    return streams
+
+
+def test__records_are_projected_and_coalesced_in_one_transaction():
+    client = StreamClient()
+    event = {'Records': [mk_record(INSERT, 't1', 'i1', '100'), mk_record(INSERT, 't2', 'i1', '101'),
+                         mk_record(REMOVE, 't3', 'i2', '102')]}
+    mk_router(client).handle(event)
+    (transaction,) = client.transactions
+    counts = {u['Update']['Key']['id']: u['Update']['ExpressionAttributeValues'][':a0']
+              for u in transaction if u['Update']['TableName'] == 'counts'}
+    assert counts == {'i1': 2, 'i2': -1}
+    assert len(client.checkpoints) == 3
+
+
+def test__replayed_records_are_skipped():
+    client = StreamClient()
+    streams = mk_router(client)
+    streams.handle({'Records': [mk_record(INSERT, 't1', 'i1', '100')]})
+    streams.handle({'Records': [mk_record(INSERT, 't1', 'i1', '100'), mk_record(INSERT, 't2', 'i1', '99')]})
+    assert len(client.transactions) == 2
+    (update,) = [u['Update'] for u in client.transactions[1] if u['Update']['TableName'] == 'counts']
+    assert update['ExpressionAttributeValues'][':a0'] == 1
+
+
+def test__view_batch_folds_writes_per_item():
+    table = mk_table('views', None)
+    view = ViewBatch()
+    view.increment(table, {'id': 'c1'}, unread=1)
+    view.update(table, {'id': 'c1'}, preview='hi')
+    view.increment(table, {'id': 'c1'}, unread=2)
+    view.delete(table, {'id': 'c2'})
+    view.increment(table, {'id': 'c2'}, unread=1)
+    assert view.ops[('views', (('id', 'c1'),))] == {'action': 'update', 'key': {'id': 'c1'},
+                                                   'set': {'preview': 'hi'}, 'add': {'unread': 3}}
+    assert view.ops[('views', (('id', 'c2'),))]['item'] == {'id': 'c2', 'unread': 1}
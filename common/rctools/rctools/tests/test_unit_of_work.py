@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from rctools.aws import cache
+from rctools.aws.cache import ItemCache
+from rctools.aws.unit_of_work import UnitOfWorkMiddleware, current_unit_of_work, open_unit_of_work
+from rctools.exceptions import TransactionCancelled
+from rctools.jobs import get_job_ticket
+
+
+class Client:
+    def __init__(self):
+        self.transactions = []
+
+    def transact_write_items(self, **kwargs):
+        self.transactions.append(kwargs)
+        return {}
+
+
+class Table:
+    def __init__(self, name, client):
+        self.name = name
+        self.meta = type('Meta', (), {'client': client})()
+        self.queries = 0
+        self.consistent_queries = 0
+
+    def query(self, **kwargs):
+        self.queries += 1
+        self.consistent_queries += kwargs.get('ConsistentRead', False)
+        return {'Items': [{'ticket_id': 't1', 'ts': 1, 'notes': []}]}
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    monkeypatch.setattr(cache, 'item_cache', ItemCache(default_ttl=0))
+    calls = []
+    monkeypatch.setattr('rctools.aws.unit_of_work.batch_write', lambda table, puts: calls.append((table.name, puts)))
+    return calls
+
+
+def test__reads_resolve_once_per_unit(batches):
+    jobs = Table('jobs', Client())
+    with open_unit_of_work():
+        first = get_job_ticket(jobs, 't1')
+        first['notes'].append('n1')
+        second = get_job_ticket(jobs, 't1')
+    get_job_ticket(jobs, 't1')
+    assert jobs.queries == 2
+    assert second['notes'] == []
+
+
+def test__consistent_reads_bypass_the_cache(monkeypatch):
+    monkeypatch.setattr(cache, 'item_cache', ItemCache(default_ttl=60))
+    jobs = Table('jobs', Client())
+    get_job_ticket(jobs, 't1')
+    get_job_ticket(jobs, 't1')
+    assert jobs.queries == 1
+    with open_unit_of_work():
+        get_job_ticket(jobs, 't1', consistent=True)
+    assert jobs.queries == 2 and jobs.consistent_queries == 1
+
+
+def test__puts_are_batched_at_commit(batches):
+    client = Client()
+    alerts, messages = Table('alerts', client), Table('messages', client)
+    with open_unit_of_work() as uow:
+        uow.put(alerts, {'uid': 'u1', 'ts': 1})
+        uow.put(alerts, {'uid': 'u2', 'ts': 1})
+        uow.put(messages, {'conversation_id': 'c1', 'ts': 1})
+        assert batches == []
+    assert batches == [('alerts', [{'uid': 'u1', 'ts': 1}, {'uid': 'u2', 'ts': 1}]),
+                       ('messages', [{'conversation_id': 'c1', 'ts': 1}])]
+    assert client.transactions == []
+
+
+def test__updates_commit_as_one_transaction(batches):
+    client = Client()
+    jobs, alerts = Table('jobs', client), Table('alerts', client)
+    with open_unit_of_work() as uow:
+        uow.update(jobs, {'ticket_id': 't1', 'ts': 1}, {'status': 'booked'})
+        uow.put(alerts, {'uid': 'u1', 'ts': 1})
+    assert len(client.transactions) == 1 and len(client.transactions[0]['TransactItems']) == 2
+    assert batches == []
+
+
+def test__errors_drop_staged_writes(batches):
+    with pytest.raises(ValueError):
+        with open_unit_of_work() as uow:
+            uow.put(Table('alerts', Client()), {'uid': 'u1', 'ts': 1})
+            raise ValueError()
+    assert batches == []
+
+
+def handler(status: int, alerts):
+    """ASGI app that stages an alert on the request's unit of work and responds with status"""
+    async def app(scope, receive, send):
+        current_unit_of_work().put(alerts, {'uid': 'u1', 'ts': 1})
+        await send({'type': 'http.response.start', 'status': status, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'{}'})
+    return app
+
+
+def call(app, batches) -> list:
+    """Runs a request through the middleware, recording what was written by the time each message was sent"""
+    sent = []
+
+    async def send(message):
+        sent.append((message['type'], message.get('status'), len(batches)))
+
+    asyncio.run(UnitOfWorkMiddleware(app)({'type': 'http'}, None, send))
+    return sent
+
+
+def test__middleware_commits_before_a_successful_response(batches):
+    alerts = Table('alerts', Client())
+    assert call(handler(201, alerts), batches) == [('http.response.start', 201, 1), ('http.response.body', None, 1)]
+    assert batches == [('alerts', [{'uid': 'u1', 'ts': 1}])]
+
+
+def test__middleware_drops_writes_of_error_responses(batches):
+    assert call(handler(403, Table('alerts', Client())), batches)[0] == ('http.response.start', 403, 0)
+    assert batches == []
+
+
+def test__middleware_reports_failed_commits(monkeypatch, batches):
+    def cancelled(table, puts):
+        raise TransactionCancelled(reasons=[{'Code': 'ConditionalCheckFailed'}])
+    monkeypatch.setattr('rctools.aws.unit_of_work.batch_write', cancelled)
+    sent = call(handler(200, Table('alerts', Client())), batches)
+    assert [(kind, status) for kind, status, _ in sent] == [('http.response.start', 409), ('http.response.body', None)]
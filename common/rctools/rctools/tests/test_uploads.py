@@ -0,0 +1,83 @@
+import base64
+import json
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+from rctools.exceptions import CustomerNotAuthorizedToEditTicket, InvalidUpload
+from rctools.installers import complete_installer_image_upload, get_installer_image
+from rctools.jobs import complete_job_photo_upload, create_job_photo_upload, get_job_photos, get_job_ticket, put_new_job
+from rctools.tests.fake_dynamodb import FakeDynamoDB
+from rctools.tests.test_s3 import SlowS3, fresh_cache  # noqa: F401
+from rctools.uploads import MAX_UPLOAD_BYTES, create_upload
+
+
+class UploadS3(SlowS3):
+    """SlowS3 that can HEAD uploaded files and presigns with a real client, which needs no network"""
+    def __init__(self, objects):
+        super().__init__(objects)
+        self.uploads = {}
+        self.signer = boto3.client('s3', region_name='us-east-1', aws_access_key_id='AKIAEXAMPLE',
+                                   aws_secret_access_key='secret')
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.uploads:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return self.uploads[Key]
+
+    def generate_presigned_post(self, **kwargs):
+        return self.signer.generate_presigned_post(**kwargs)
+
+    def generate_presigned_url(self, *args, **kwargs):
+        return self.signer.generate_presigned_url(*args, **kwargs)
+
+
+def test__uploads_are_limited_to_their_key_type_and_size():
+    client = UploadS3({})
+    with pytest.raises(InvalidUpload):
+        create_upload(client, 'bucket', 'photos/t1', 'application/pdf')
+    upload = create_upload(client, 'bucket', 'photos/t1', 'image/jpeg')
+    assert upload.key == f'photos/t1/{upload.upload_id}' and upload.fields['key'] == upload.key
+    policy = json.loads(base64.b64decode(upload.fields['policy']))
+    assert {'Content-Type': 'image/jpeg'} in policy['conditions']
+    assert ['content-length-range', 1, MAX_UPLOAD_BYTES] in policy['conditions']
+
+
+def test__completed_job_photos_are_recorded_once():
+    fake = FakeDynamoDB()
+    fake.create_table('jobs', ('ticket_id', 'ts'))
+    jobs = fake.Table('jobs')
+    ticket_id = put_new_job(jobs, {'customer_id': 'c1', 'job_scope': {'vehicles': []}})
+    client = UploadS3({})
+
+    with pytest.raises(CustomerNotAuthorizedToEditTicket):
+        create_job_photo_upload(jobs, client, 'bucket', ticket_id, 'c2', 'image/png')
+    upload = create_job_photo_upload(jobs, client, 'bucket', ticket_id, 'c1', 'image/png')
+    with pytest.raises(InvalidUpload):
+        complete_job_photo_upload(jobs, client, 'bucket', ticket_id, 'c1', upload.upload_id)  # not uploaded yet
+    with pytest.raises(InvalidUpload):
+        complete_job_photo_upload(jobs, client, 'bucket', ticket_id, 'c1', f'{upload.upload_id}.json')
+
+    client.uploads[upload.key] = {'ContentType': 'image/png', 'ContentLength': 2048}
+    for _ in range(2):
+        photo = complete_job_photo_upload(jobs, client, 'bucket', ticket_id, 'c1', upload.upload_id, caption='Panel')
+    assert photo.size == 2048 and upload.key in photo.uri
+
+    photo_ids = get_job_ticket(jobs, ticket_id)['photos']
+    assert photo_ids == [upload.upload_id]
+    [stored] = get_job_photos(client, 'bucket', ticket_id, photo_ids)
+    assert stored['caption'] == 'Panel' and stored['key'] == upload.key and upload.key in stored['uri']
+
+
+def test__latest_installer_image_of_a_type_is_returned():
+    client = UploadS3({'installers/i1.json': {'zip': '49341'}})
+    assert get_installer_image(client, 'bucket', 'i1', 'profile') is None
+    for content_type in ('image/jpeg', 'image/webp'):
+        upload = create_upload(client, 'bucket', 'installers/i1/images/profile', content_type)
+        client.uploads[upload.key] = {'ContentType': content_type, 'ContentLength': 100}
+        complete_installer_image_upload(client, 'bucket', 'i1', 'profile', upload.upload_id)
+
+    image = get_installer_image(client, 'bucket', 'i1', 'profile')
+    assert image['image_id'] == upload.upload_id and image['content_type'] == 'image/webp'
+    assert len(json.loads(client.objects['installers/i1.json'])['images']) == 2
@@ -0,0 +1,79 @@
+"""
+Direct-to-S3 uploads for job photos and installer images, so the bytes never
+pass through API Gateway or the API Lambdas:
+
+    1. The app asks its API for an upload. The API checks the user may add
+       the file and returns create_upload(...): a presigned POST for a new key
+       under the prefix it chose, limited to UPLOAD_CONTENT_TYPES and
+       MAX_UPLOAD_BYTES.
+    2. The app POSTs the file to S3 with the returned url and fields.
+    3. The app tells the API the upload finished. complete_upload checks the
+       object is there, and the API records its metadata (key, content type,
+       size) in the JobPhoto or InstallerImage document.
+
+Readers get a short-lived GET URL for each file from download_url instead of
+the bytes themselves.
+"""
+import logging
+import time
+from uuid import UUID, uuid4
+
+from pydantic import BaseModel
+
+from rctools.aws.s3 import create_presigned_get_url, create_presigned_post, head_object_in_s3
+from rctools.exceptions import InvalidUpload
+from rctools.models.users import PresignedUpload
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+UPLOAD_CONTENT_TYPES = {'image/jpeg', 'image/png', 'image/heic', 'image/webp'}
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+UPLOAD_URL_EXPIRATION = 15 * 60  # seconds
+DOWNLOAD_URL_EXPIRATION = 60 * 60  # seconds
+
+
+class UploadedObject(BaseModel):
+    """A finished direct upload, as found by complete_upload"""
+    key: str
+    content_type: str
+    size: int
+
+
+def upload_key(prefix: str, upload_id: str) -> str:
+    """The key an upload is stored under. upload_id has to be a UUID so it can't name another object"""
+    try:
+        UUID(upload_id)
+    except (TypeError, ValueError):
+        raise InvalidUpload(f'Invalid upload ID {upload_id}')
+    return f'{prefix.rstrip("/")}/{upload_id}'
+
+
+def create_upload(s3_client, bucket, prefix: str, content_type: str) -> PresignedUpload:
+    """Returns a presigned POST for a new file of the given type under prefix"""
+    if content_type not in UPLOAD_CONTENT_TYPES:
+        raise InvalidUpload(f'Unsupported content type {content_type}')
+    upload_id = str(uuid4())
+    key = upload_key(prefix, upload_id)
+    post = create_presigned_post(s3_client, bucket, key, content_type, MAX_UPLOAD_BYTES, UPLOAD_URL_EXPIRATION)
+    logger.info(f'Created upload {key} in bucket {bucket}')
+    return PresignedUpload(upload_id=upload_id, key=key, url=post['url'], fields=post['fields'],
+                           expires_at=int(time.time()) + UPLOAD_URL_EXPIRATION)
+
+
+def complete_upload(s3_client, bucket, prefix: str, upload_id: str) -> UploadedObject:
+    """Returns the uploaded object, raising InvalidUpload if it isn't there or isn't an accepted file"""
+    key = upload_key(prefix, upload_id)
+    head = head_object_in_s3(s3_client, bucket, key)
+    if head is None:
+        raise InvalidUpload(f'Nothing was uploaded to {key}')
+    uploaded = UploadedObject(key=key, content_type=head.get('ContentType', ''), size=head['ContentLength'])
+    # The presigned POST enforces both, so this only fails for objects written some other way
+    if uploaded.content_type not in UPLOAD_CONTENT_TYPES or uploaded.size > MAX_UPLOAD_BYTES:
+        raise InvalidUpload(f'{key} is not an accepted upload ({uploaded.content_type}, {uploaded.size} bytes)')
+    logger.info(f'Upload {key} completed with {uploaded.size} bytes')
+    return uploaded
+
+
+def download_url(s3_client, bucket, key: str) -> str:
+    return create_presigned_get_url(s3_client, bucket, key, DOWNLOAD_URL_EXPIRATION)
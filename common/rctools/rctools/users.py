@@ -29,7 +29,7 @@ def get_admin_user(cognito_client, s3_client, pool_id, bucket, user_id) -> dict:
 
 def get_admin_user_data_from_s3(s3_client, bucket, user_id):
     """Returns extra installer user data stored in S3"""
-    return get_object_from_s3(s3_client, bucket, f'admins/{user_id}.json', {})
+    return get_object_from_s3(s3_client, bucket, f'admins/{user_id}.json', {}, cache=True)
 
 
 def get_user_pool_from_access_token(access_token: str):
@@ -1,7 +1,7 @@
 import logging
 
 from rctools.aws.s3 import get_object_from_s3
-from rctools.aws.dynamodb import fetch_items_by_pk, DynamoPrimaryKey
+from rctools.aws.dynamodb import iter_query, DynamoPrimaryKey
 from typing import Literal, Union
 
 
@@ -9,6 +9,9 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+# zips/*.min.json never change once generated, so cached copies are only rechecked this often
+ZIP_CODES_MAX_AGE = 60 * 60  # seconds
+
 ValidRadius = Union[Literal[10], Literal[25], Literal[50], Literal[75], Literal[100], Literal[200], Literal[500]]
 
 
@@ -17,15 +20,8 @@ def get_installers_by_zip(table, zip_code: str):
     Queries the service area table and returns all installer IDs that service that zip
     """
     pk = DynamoPrimaryKey()
-    pk = {'zip_code': zip_code}
-    items, pagination_token = [], None
-    while True:
-        rows, cursor_token = fetch_items_by_pk(table, pk, cursor_token=pagination_token)
-        items += rows
-        if not cursor_token:
-            break
-        pagination_token = cursor_token
-    return [r['installer_id'] for r in items]
+    pk.partition = {'zip_code': zip_code}
+    return [r['installer_id'] for r in iter_query(table, pk)]
     
 
 def get_zip_codes_in_radius(s3_client, bucket: str, zip_code: str, radius: ValidRadius):
@@ -35,7 +31,7 @@ def get_zip_codes_in_radius(s3_client, bucket: str, zip_code: str, radius: Valid
     result = []
     try:
         key = f'zips/{zip_code}.min.json'
-        zips = get_object_from_s3(s3_client, bucket, key)
+        zips = get_object_from_s3(s3_client, bucket, key, cache=True, max_age=ZIP_CODES_MAX_AGE)
         for r in zips.keys():
             if int(r) <= int(radius):
                 result += zips[r]
@@ -2,23 +2,24 @@ import logging
 import os
 from typing import Optional
 
-import boto3
 from botocore.exceptions import ClientError
 from fastapi import APIRouter, Header, status
 from fastapi.responses import JSONResponse
+from rctools.aws.clients import get_client
 from rctools.aws.cognito import get_user_with_access_token, merge_user_data
 from rctools.customers import (get_customer_data_from_s3, put_customer_data_into_s3,
                                update_customer_data_in_cognito)
 from rctools.models import Customer
+from utils import DecimalRoute
 
 USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 CUSTOMER_USER_POOL_ID = os.getenv('CUSTOMER_USER_POOL_ID')
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
 
 @router.put('/customer', status_code=status.HTTP_200_OK)
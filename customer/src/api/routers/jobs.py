@@ -2,22 +2,23 @@ import logging
 import os
 from typing import List, Optional
 
-import boto3
 from botocore.exceptions import ClientError
 from fastapi import APIRouter, Header, status
 from fastapi.responses import JSONResponse
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import get_user_with_access_token
-from rctools.aws.s3 import get_object_from_s3
 from rctools.customers import get_customer_jobs_from_dynamo
-from rctools.exceptions import CustomerNotAuthorizedToEditTicket
+from rctools.exceptions import CustomerNotAuthorizedToEditTicket, InvalidUpload
 from rctools.installers import get_installer
 from rctools.jobs import (add_note_to_job_ticket, add_note_to_s3,
                           add_photo_to_job_ticket, add_photo_to_s3,
-                          get_job_notes, get_job_ticket, get_job_tier,
+                          complete_job_photo_upload, create_job_photo_upload,
+                          get_job_notes, get_job_photos, get_job_ticket, get_job_tier,
                           put_new_job, update_job_ticket)
-from rctools.models import JobNote, JobsResponse
+from rctools.models import JobNote, JobsResponse, PresignedUpload, UploadRequest
 from rctools.models.jobs import JobPhoto, JobTier
 from rctools.models.users import Installer
+from utils import DecimalRoute
 
 JOBS_TABLE = os.environ.get('JOBS_TABLE')
 INSTALLER_USER_POOL_ID = os.environ.get('INSTALLER_USER_POOL_ID')
@@ -29,13 +30,13 @@ JOB_PHOTO_BUCKET = os.environ.get('JOB_PHOTO_BUCKET')
 
 ALERTS_TABLE = os.environ.get('ALERTS_TABLE')
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = get_resource('dynamodb')
 alerts_table = dynamodb.Table(ALERTS_TABLE)
 jobs_table = dynamodb.Table(JOBS_TABLE)
 message_table = dynamodb.Table(MESSAGES_TABLE)
@@ -195,11 +196,14 @@ def determine_job_scope(id: str, X_Amz_Access_Token: Optional[str] = Header(defa
 
 @router.post('/job/{id}/photo', response_model=JobPhoto, status_code=status.HTTP_201_CREATED)
 def post_job_photo(id: str, file: dict = None, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> JobPhoto:
-    """Uploads a file to use as the installer's profile image"""
+    """
+    Stores a photo sent in the request body. Prefer /job/{id}/photo/upload,
+    which sends the file straight to S3
+    """
     user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
     customer_id = user['Username']
-    new_job_photo['uid'] = customer_id
-    new_job_photo['ticket_id'] = id
+    file['uid'] = customer_id
+    file['ticket_id'] = id
     new_job_photo = JobPhoto(**file)
     try:
         add_photo_to_job_ticket(jobs_table, new_job_photo.photo_id, id, customer_id)
@@ -210,10 +214,56 @@ def post_job_photo(id: str, file: dict = None, X_Amz_Access_Token: Optional[str]
         return JSONResponse({'error': str(e)}, 400)
 
 
+@router.post('/job/{id}/photo/upload', response_model=PresignedUpload, status_code=status.HTTP_201_CREATED)
+def create_job_photo_upload_url(id: str, upload: UploadRequest, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> PresignedUpload:
+    """
+    Returns a presigned POST for uploading a job photo straight to S3. Once the
+    upload finishes, POST /job/{id}/photo/{upload_id} to add it to the job
+    """
+    user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
+    customer_id = user['Username']
+    try:
+        return create_job_photo_upload(jobs_table, s3_client, JOB_PHOTO_BUCKET, id, customer_id, upload.content_type)
+    except CustomerNotAuthorizedToEditTicket:
+        err = f'Customer {customer_id} is not authorized to add photos to job {id}'
+        logger.exception(err)
+        return JSONResponse({'error': err}, 403)
+    except (InvalidUpload, ClientError) as e:
+        logger.exception('Error creating job photo upload')
+        return JSONResponse({'error': str(e)}, 400)
+
+
+@router.post('/job/{id}/photo/{photo_id}', response_model=JobPhoto, status_code=status.HTTP_201_CREATED)
+def complete_job_photo(id: str, photo_id: str, photo: dict = None, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> JobPhoto:
+    """Adds a photo uploaded with /job/{id}/photo/upload to the job, with an optional caption"""
+    user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
+    customer_id = user['Username']
+    try:
+        return complete_job_photo_upload(jobs_table, s3_client, JOB_PHOTO_BUCKET, id, customer_id, photo_id,
+                                         caption=(photo or {}).get('caption'))
+    except CustomerNotAuthorizedToEditTicket:
+        err = f'Customer {customer_id} is not authorized to add photos to job {id}'
+        logger.exception(err)
+        return JSONResponse({'error': err}, 403)
+    except (InvalidUpload, ClientError) as e:
+        logger.exception('Error completing job photo upload')
+        return JSONResponse({'error': str(e)}, 400)
+
+
 @router.get('/job/{id}/photo', response_model=List[JobPhoto],  status_code=status.HTTP_200_OK)
 def get_job_photo(id: str, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> List[JobPhoto]:
-    """Fetches job images from s3"""
-    s3_path = f"photos/{id}"
-    photos = get_object_from_s3(s3_client, JOB_PHOTO_BUCKET, s3_path)
-    print(f'photos received {photos}')
-    return get_object_from_s3(s3_client, JOB_PHOTO_BUCKET, s3_path)
+    """Fetches the job's photos, with presigned URLs to download the uploaded files from"""
+    user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
+    customer_id = user['Username']
+    try:
+        job_ticket = get_job_ticket(jobs_table, id)
+        if job_ticket['customer_id'] != customer_id:
+            raise CustomerNotAuthorizedToEditTicket()
+        return get_job_photos(s3_client, JOB_PHOTO_BUCKET, id, job_ticket.get('photos') or [])
+    except CustomerNotAuthorizedToEditTicket:
+        err = f'Customer {customer_id} is not authorized to get photos of job {id}'
+        logger.exception(err)
+        return JSONResponse({'error': err}, 403)
+    except ClientError as e:
+        logger.exception('Error getting job photos')
+        return JSONResponse({'error': str(e)}, 400)
@@ -2,22 +2,23 @@ import logging
 import os
 from typing import Optional
 
-import boto3
 from fastapi import APIRouter, Header, status
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import get_user_with_access_token
 from rctools.messages import check_for_conversations, get_messages_for_conversation, post_message_to_conversation
 from rctools.models import Message, MessagePostRequest, MessageResponse
+from utils import DecimalRoute
 
 
 MESSAGES_TABLE = os.environ.get('MESSAGES_TABLE')
 
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+dynamodb = get_resource('dynamodb')
+s3_client = get_client('s3')
 
 message_table = dynamodb.Table(MESSAGES_TABLE)
 
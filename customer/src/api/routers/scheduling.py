@@ -3,17 +3,20 @@ import os
 from datetime import datetime
 from typing import Optional, List
 
-import boto3
 from botocore.exceptions import ClientError
 from fastapi import APIRouter, Header, status
 from fastapi.responses import JSONResponse
 from rctools.alerts import add_user_alert
 from rctools.alerts.customer import create_customer_new_job_alert
 from rctools.alerts.installer import create_installer_new_job_alert
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import get_user_with_access_token 
+from rctools.aws.dynamodb import Attr, DynamoTransaction
 from rctools.exceptions import (CustomerNotAuthorizedToEditSchedule,
-                                CustomerNotAuthorizedToEditTicket)
-from rctools.installers import get_installer
+                                CustomerNotAuthorizedToEditTicket,
+                                ReservationConflict, TransactionCancelled)
+from rctools.installers import get_installer, get_installers_by_id
+from rctools.job_collection import get_job_aggregate
 from rctools.messages import start_conversation
 from rctools.jobs import get_job_ticket, update_job_ticket
 from rctools.scheduling import (add_job_to_schedule, get_scheduled_job,
@@ -21,6 +24,7 @@ from rctools.scheduling import (add_job_to_schedule, get_scheduled_job,
                                 get_available_times_for_day,
                                 get_reservation_by_id)
 from rctools.zip_codes import get_installers_by_zip
+from utils import DecimalRoute
 
 
 ALERTS_TABLE = os.environ.get('ALERTS_TABLE')
@@ -32,13 +36,13 @@ MESSAGES_TABLE = os.environ.get('MESSAGES_TABLE')
 RESERVATIONS_TABLE = os.environ.get('RESERVATIONS_TABLE')
 USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = get_resource('dynamodb')
 alerts_table = dynamodb.Table(ALERTS_TABLE)
 job_schedule_table = dynamodb.Table(JOB_SCHEDULE_TABLE)
 jobs_table = dynamodb.Table(JOBS_TABLE)
@@ -49,7 +53,7 @@ service_area_table = dynamodb.Table(INSTALLER_SERVICE_AREA_TABLE)
 
 def fetch_installers(installer_ids: List[str]):
     """Helper method to return list of all installers"""
-    return [get_installer(cognito_client, s3_client, INSTALLER_USER_POOL_ID, USER_DATA_BUCKET, i) for i in installer_ids]
+    return get_installers_by_id(cognito_client, s3_client, INSTALLER_USER_POOL_ID, USER_DATA_BUCKET, installer_ids)
 
 
 @router.get('/schedule/{ticket_id}/installers', status_code=status.HTTP_200_OK)
@@ -69,7 +73,7 @@ def get_installer_schedules(ticket_id: str, X_Amz_Access_Token: Optional[str] =
 
         zip_code = job['address']['zip']
         installer_ids = get_installers_by_zip(service_area_table, zip_code)
-        installers = [get_installer(cognito_client, s3_client, INSTALLER_USER_POOL_ID, USER_DATA_BUCKET, i) for i in installer_ids]
+        installers = fetch_installers(installer_ids)
         return get_available_times(None, installers, job['job_scope']['tier'], job['address']['zip'], reservations_table)
     except CustomerNotAuthorizedToEditTicket:
         err = f'Customer {customer_id} is not authorized to get installer dates for ticket {ticket_id}'
@@ -110,6 +114,10 @@ def post_customer_reservation(ticket_id: str, day: datetime, reservation_data: d
         err = f'Customer {customer_id} is not authorized to post reservations for ticket {ticket_id}'
         logger.exception(err)
         return JSONResponse({'error': err}, 403)
+    except ReservationConflict:
+        err = f'Time slot {reservation_data["start_time"]} on {day} was just reserved by someone else'
+        logger.exception(err)
+        return JSONResponse({'error': err}, 409)
     except ClientError as e:
         logger.exception(f'Error posting reservation')
         return JSONResponse({'error': str(e)}, 400) 
@@ -123,25 +131,34 @@ def post_customer_job_schedule(reservation_id: str, ticket_id: str, X_Amz_Access
         user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
         customer_id = user['Username']
 
-        job = get_job_ticket(jobs_table, ticket_id)
+        # The ticket is the version base of the booking write, so it is read with a consistent read
+        # from the jobs table rather than from the item cache; the reservation comes from the job
+        # collection when it is in use
+        job = get_job_ticket(jobs_table, ticket_id, consistent=True)
+        aggregate = get_job_aggregate(ticket_id)
         if job['customer_id'] != customer_id: 
             raise CustomerNotAuthorizedToEditTicket()
 
         # reservations = get_installer_reservations_by_id(reservations_table, reserved_installer_id)
-        res = get_reservation_by_id(reservations_table, reservation_id)
+        res = aggregate and aggregate.reservation(reservation_id) or get_reservation_by_id(reservations_table, reservation_id)
         # logger.info(f'found reservation {reservations}')
         # for res in reservations:
         if res['customer_id'] == customer_id:
             installer_id = res['installer_id']
             installer = get_installer(cognito_client, s3_client, INSTALLER_USER_POOL_ID, USER_DATA_BUCKET, installer_id)
-            conversation_id = start_conversation(messages_table, installer, installer_id, customer_id)
+            # Commit the whole booking in one transaction so a failure can't leave it half written
+            transaction = DynamoTransaction()
+            transaction.condition_check(reservations_table, {'id': res['id'], 'ts': res['ts']}, Attr('customer_id').eq(customer_id))
+            conversation_id = start_conversation(messages_table, installer, installer_id, customer_id, transaction=transaction)
             logger.info(f'Updating job ticket with installer {installer_id} and conversation {conversation_id}')
-            update_job_ticket(jobs_table, {'installer_id': installer_id, 'conversation_id': conversation_id}, ticket_id, customer_id)
+            update_job_ticket(jobs_table, {'installer_id': installer_id, 'conversation_id': conversation_id}, ticket_id, customer_id,
+                              job_ticket=job, transaction=transaction)
             # Create the job
-            add_job_to_schedule(job_schedule_table, res, ticket_id)
+            add_job_to_schedule(job_schedule_table, res, ticket_id, transaction=transaction)
             # Then send alerts
-            add_user_alert(alerts_table, customer_id, create_customer_new_job_alert(customer_id))
-            add_user_alert(alerts_table, installer_id, create_installer_new_job_alert(installer_id))
+            add_user_alert(alerts_table, customer_id, create_customer_new_job_alert(customer_id), transaction=transaction)
+            add_user_alert(alerts_table, installer_id, create_installer_new_job_alert(installer_id), transaction=transaction)
+            transaction.commit()
             return installer_id
         raise CustomerNotAuthorizedToEditSchedule()
         
@@ -153,6 +170,10 @@ def post_customer_job_schedule(reservation_id: str, ticket_id: str, X_Amz_Access
         err = f'Customer {customer_id} is not authorized to post schedule for ticket {ticket_id}'
         logger.exception(err)
         return JSONResponse({'error': err}, 403)
+    except TransactionCancelled as e:
+        err = f'Ticket {ticket_id} or reservation {reservation_id} changed while booking, nothing was written'
+        logger.exception(f'{err}: {e.reasons}')
+        return JSONResponse({'error': err}, 409)
     except ClientError as e:
         logger.exception(f'Error posting reservation')
         return JSONResponse({'error': str(e)}, 400)
@@ -6,4 +6,23 @@ def test_health(mock_env):
     
     client = TestClient(app)
     response = client.get('/health')
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+def test_job_numbers_keep_their_type(mock_env, monkeypatch):
+    from decimal import Decimal
+
+    from handler import app
+    from routers import jobs
+
+    ticket = {'ticket_id': 't1', 'customer_id': 'c1', 'version': Decimal('3'),
+              'job_scope': {'tier': {'price': Decimal('1500'), 'hours': [Decimal('5'), Decimal('7')]}},
+              'rating': Decimal('4.5')}
+    monkeypatch.setattr(jobs, 'get_user_with_access_token', lambda client, token: {'Username': 'c1'})
+    monkeypatch.setattr(jobs, 'get_job_ticket', lambda table, id: ticket)
+
+    client = TestClient(app)
+    response = client.get('/job/t1')
+    assert response.status_code == 200
+    assert response.text.count('.') == 1  # only the rating is a float
+    assert response.json() == {'ticket_id': 't1', 'customer_id': 'c1', 'version': 3,
+                                'job_scope': {'tier': {'price': 1500, 'hours': [5, 7]}}, 'rating': 4.5}
@@ -0,0 +1,35 @@
+"""Helper methods for api"""
+import asyncio
+import functools
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+from rctools.aws.dynamodb import JSON_ENCODERS
+
+
+def _encode_result(result):
+    if isinstance(result, Response):
+        return result
+    return jsonable_encoder(result, custom_encoder=JSON_ENCODERS)
+
+
+class DecimalRoute(APIRoute):
+    """
+    Route class of every router: encodes what the endpoint returns with the
+    rctools JSON_ENCODERS first, so numbers read from DynamoDB go out as ints
+    when they are integral rather than as the floats FastAPI makes of every
+    Decimal
+    """
+    def get_route_handler(self):
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            @functools.wraps(call)
+            async def encoded(**values):
+                return _encode_result(await call(**values))
+        else:
+            @functools.wraps(call)
+            def encoded(**values):
+                return _encode_result(call(**values))
+        self.dependant.call = encoded
+        return super().get_route_handler()
@@ -3,16 +3,17 @@ import logging
 import os
 from typing import Optional
 
-import boto3
-import botocore
-from fastapi import APIRouter, Header, status
+from fastapi import APIRouter, Depends, Header, status
+from rctools.aws.clients import get_client, get_resource
 from rctools.background_checks import (
     create_background_check_hash, order_background_check,
     get_background_check_api_key
 )
 from rctools.aws.cognito import get_user_with_access_token, flatten_user_attributes
+from rctools.aws.unit_of_work import UnitOfWork, request_unit_of_work
 from rctools.alerts import create_background_check_in_progress_alert, add_user_alert
 from rctools.installers import get_installer_data_from_s3, update_installer_data_in_s3
+from utils import DecimalRoute
 
 
 ALERTS_TABLE = os.getenv('ALERTS_TABLE')
@@ -25,16 +26,15 @@ INSTALLER_USER_POOL_ID = os.environ.get('INSTALLER_USER_POOL_ID')
 USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
-lambda_config = botocore.config.Config(retries={'max_attempts': 0})
-lambda_client = boto3.client('lambda', config=lambda_config)
-secrets_client = boto3.client('secretsmanager')
+cognito_client = get_client('cognito-idp')
+lambda_client = get_client('lambda')
+secrets_client = get_client('secretsmanager')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = get_resource('dynamodb')
 alerts_table = dynamodb.Table(ALERTS_TABLE)
 
 g_context = {}
@@ -48,7 +48,8 @@ def get_api_key():
 
 
 @router.put('/installer/background-check', status_code=status.HTTP_201_CREATED)
-def submit_background_check(update: dict, X_Amz_Access_Token: Optional[str] = Header(default=None)):
+def submit_background_check(update: dict, X_Amz_Access_Token: Optional[str] = Header(default=None),
+                            uow: Optional[UnitOfWork] = Depends(request_unit_of_work)):
     """
     Submits a request for a ClearChecks background check.
 
@@ -85,7 +86,8 @@ def submit_background_check(update: dict, X_Amz_Access_Token: Optional[str] = He
     logger.info(f'Success! Returned report key {report_key}')
     update_installer_data_in_s3(s3_client, USER_DATA_BUCKET, uid, {'background_check': {'report_key': report_key}})
     # Create in-progress alert
-    add_user_alert(alerts_table, uid, create_background_check_in_progress_alert(uid))
+    # Written with the rest of the request once it succeeds
+    add_user_alert(alerts_table, uid, create_background_check_in_progress_alert(uid), transaction=uow)
     # Queue status check
     lambda_client.invoke(
         FunctionName=BACKGROUND_CHECK_STATUS_CHECK_LAMBDA_NAME,
@@ -3,21 +3,24 @@ import logging
 import os
 from typing import Optional
 
-import boto3
-import botocore
 from botocore.exceptions import ClientError
-from fastapi import APIRouter, Header, status
+from fastapi import APIRouter, Depends, Header, status
 from fastapi.responses import JSONResponse
 from rctools.alerts import add_user_alert, create_certification_in_progress_alert
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import get_user_with_access_token, merge_user_data
-from rctools.aws.s3 import get_object_from_s3, put_object_into_s3
-from rctools.installers import (add_photo_to_installer_data, get_installer_data_from_s3, get_installer,
-                                update_installer_service_area,
+from rctools.aws.s3 import put_object_into_s3
+from rctools.aws.unit_of_work import UnitOfWork, request_unit_of_work
+from rctools.exceptions import InvalidUpload
+from rctools.installers import (add_photo_to_installer_data, complete_installer_image_upload,
+                                create_installer_image_upload, get_installer_data_from_s3, get_installer,
+                                get_installer_image, update_installer_service_area,
                                 update_installer_data_in_s3, put_installer_data_into_s3)
-from rctools.models import Installer
+from rctools.models import Installer, PresignedUpload, UploadRequest
 from rctools.models.users import InstallerImage
 from rctools.utils import mk_timestamp
 from rctools.rates import lookup_rate_by_state
+from utils import DecimalRoute
 
 
 ALERTS_TABLE = os.environ.get('ALERTS_TABLE')
@@ -28,14 +31,13 @@ USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 ZIP_CODE_DISTANCE_BUCKET = os.environ.get('ZIP_CODE_DISTANCE_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
-dynamodb = boto3.resource('dynamodb')
-lambda_config = botocore.config.Config(retries={'max_attempts': 0})
-lambda_client = boto3.client('lambda', config=lambda_config)
+cognito_client = get_client('cognito-idp')
+dynamodb = get_resource('dynamodb')
+lambda_client = get_client('lambda')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
 alerts_table = dynamodb.Table(ALERTS_TABLE)
 service_area_table = dynamodb.Table(INSTALLER_SERVICE_AREA_TABLE_NAME)
@@ -82,7 +84,8 @@ def edit_installer(update: Installer, X_Amz_Access_Token: Optional[str] = Header
 
 
 @router.put('/installer/certification', response_model=Installer, status_code=status.HTTP_200_OK)
-def update_installer_certification(update: dict, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> Installer:
+def update_installer_certification(update: dict, X_Amz_Access_Token: Optional[str] = Header(default=None),
+                                   uow: Optional[UnitOfWork] = Depends(request_unit_of_work)) -> Installer:
     """Updates installer with certification data and triggers the lambda to check it by state"""
     logger.info(f'Updating with certification info {update}')
     user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
@@ -98,7 +101,8 @@ def update_installer_certification(update: dict, X_Amz_Access_Token: Optional[st
         license_number = installer['license']['licenseNumber']
         # Add certification in-progress alert
         alert = create_certification_in_progress_alert(installer_id)
-        add_user_alert(alerts_table, installer_id, alert)
+        # Written with the rest of the request once it succeeds
+        add_user_alert(alerts_table, installer_id, alert, transaction=uow)
         # Invoke lambda
         logger.info(f'Invoking certification lambda {CERTIFICATION_LAMBDA_NAME}')
         resp = lambda_client.invoke(
@@ -161,7 +165,10 @@ def get_installer_rates_by_state(X_Amz_Access_Token: Optional[str] = Header(defa
 
 @router.post('/image/{type}', response_model=InstallerImage, status_code=status.HTTP_201_CREATED)
 def post_type_image(image: dict, type: str, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> InstallerImage:
-    """Uploads an image of a specific type in s3"""
+    """
+    Stores an image of a specific type sent in the request body. Prefer
+    /image/{type}/upload, which sends the file straight to S3
+    """
     user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
     installer_id = user['Username']
     image['uid'] = installer_id
@@ -176,13 +183,40 @@ def post_type_image(image: dict, type: str, X_Amz_Access_Token: Optional[str] =
         return JSONResponse({'error': str(e)}, 400)
 
 
+@router.post('/image/{type}/upload', response_model=PresignedUpload, status_code=status.HTTP_201_CREATED)
+def create_image_upload_url(type: str, upload: UploadRequest, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> PresignedUpload:
+    """
+    Returns a presigned POST for uploading an image of a specific type straight
+    to S3. Once the upload finishes, POST /image/{type}/{upload_id} to save it
+    """
+    try:
+        user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
+        installer_id = user['Username']
+        return create_installer_image_upload(s3_client, USER_DATA_BUCKET, installer_id, type, upload.content_type)
+    except (InvalidUpload, ClientError) as e:
+        logger.exception('Error creating image upload')
+        return JSONResponse({'error': str(e)}, 400)
+
+
+@router.post('/image/{type}/{image_id}', response_model=InstallerImage, status_code=status.HTTP_201_CREATED)
+def complete_image_upload(type: str, image_id: str, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> InstallerImage:
+    """Saves an image uploaded with /image/{type}/upload as the installer's latest image of that type"""
+    try:
+        user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
+        installer_id = user['Username']
+        return complete_installer_image_upload(s3_client, USER_DATA_BUCKET, installer_id, type, image_id)
+    except (InvalidUpload, ClientError) as e:
+        logger.exception('Error completing image upload')
+        return JSONResponse({'error': str(e)}, 400)
+
+
 @router.get('/image/{type}', response_model=InstallerImage, status_code=status.HTTP_200_OK)
 def get_profile_image(type: str, X_Amz_Access_Token: Optional[str] = Header(default=None)) -> InstallerImage:
     """Gets an image to use as the installer's profile image"""
     try:
         user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
         installer_id = user['Username']
-        return get_object_from_s3(s3_client, USER_DATA_BUCKET, f'installers/{installer_id}/images/{type}/', {})
+        return get_installer_image(s3_client, USER_DATA_BUCKET, installer_id, type) or {}
     except ClientError as e:
         logger.exception('Error uploading photo: {e}')
         return JSONResponse({'error': str(e)}, 400)
\ No newline at end of file
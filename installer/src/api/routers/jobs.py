@@ -2,15 +2,17 @@ import logging
 import os
 from typing import Optional
 
-import boto3
 from botocore.exceptions import ClientError
 from fastapi import APIRouter, Header, status
 from fastapi.responses import JSONResponse
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import get_user_with_access_token
 from rctools.exceptions import InstallerNotAuthorizedToEditTicket
 from rctools.installers import get_installer_jobs_from_dynamo
+from rctools.job_collection import get_job_aggregate
 from rctools.jobs import fill_out_job_ticket, get_job_ticket
 from rctools.models import JobsResponse
+from utils import DecimalRoute
 
 JOBS_TABLE = os.environ.get('JOBS_TABLE')
 INSTALLER_USER_POOL_ID = os.environ.get('INSTALLER_USER_POOL_ID')
@@ -20,13 +22,13 @@ MESSAGES_TABLE = os.environ.get('MESSAGES_TABLE')
 
 ALERTS_TABLE = os.environ.get('ALERTS_TABLE')
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = get_resource('dynamodb')
 alerts_table = dynamodb.Table(ALERTS_TABLE)
 jobs_table = dynamodb.Table(JOBS_TABLE)
 message_table = dynamodb.Table(MESSAGES_TABLE)
@@ -53,7 +55,10 @@ def get_job(id: str, X_Amz_Access_Token: Optional[str] = Header(default=None)):
     user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
     installer_id = user['Username']
     try:
-        job_ticket = get_job_ticket(jobs_table, id)
+        # With the job collection the conversation pointer comes with the ticket, saving the conversation lookup
+        aggregate = get_job_aggregate(id)
+        job_ticket = get_job_ticket(jobs_table, id) if aggregate is None else {
+            **aggregate.ticket, 'conversation_id': aggregate.conversation_id}
         if job_ticket['installer_id'] != installer_id:
             raise InstallerNotAuthorizedToEditTicket()
         return fill_out_job_ticket(cognito_client, s3_client, message_table, CUSTOMER_USER_POOL_ID, USER_DATA_BUCKET, job_ticket)
@@ -2,22 +2,23 @@ import logging
 import os
 from typing import Optional
 
-import boto3
 from fastapi import APIRouter, Header, status
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import get_user_with_access_token
-from rctools.messages import check_for_conversations, get_latest_message, get_messages_for_conversation, post_message_to_conversation
+from rctools.messages import check_for_conversations, get_latest_messages, get_messages_for_conversation, post_message_to_conversation
 from rctools.models import ConversationsResponse, Message, MessagePostRequest, MessageResponse
+from utils import DecimalRoute
 
 
 MESSAGES_TABLE = os.environ.get('MESSAGES_TABLE')
 
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+dynamodb = get_resource('dynamodb')
+s3_client = get_client('s3')
 
 message_table = dynamodb.Table(MESSAGES_TABLE)
 
@@ -34,7 +35,7 @@ def get_all_conversations(X_Amz_Access_Token: Optional[str] = Header(default=Non
     response = ConversationsResponse()
     convos, cursor_token = check_for_conversations(message_table, 'installer', uid, cursor_token=cursor_token, limit=20)  # limiting by max presumed to display on a screen at once
     if convos:
-        response.conversations = [get_latest_message(message_table, c['conversation_id']) for c in convos]
+        response.conversations = get_latest_messages(message_table, [c['conversation_id'] for c in convos])
         response.cursor_token = cursor_token
 
     logger.info(f'Found {len(response.conversations)} conversation(s) for user {uid}')
@@ -42,17 +43,17 @@ def get_all_conversations(X_Amz_Access_Token: Optional[str] = Header(default=Non
 
 
 @router.get('/messages/{conversation_id}', response_model=MessageResponse, status_code=status.HTTP_200_OK)
-def get_messages_for_conversation_id(conversation_id: str, X_Amz_Access_Token: Optional[str] = Header(default=None), cursor_token: Optional[str] = None) -> MessageResponse:
+def get_messages_for_conversation_id(conversation_id: str, X_Amz_Access_Token: Optional[str] = Header(default=None), cursor_token: Optional[str] = None, before: Optional[int] = None) -> MessageResponse:
     """
     Returns all messages for a given conversation up to the given limit, or any messages occuring after the
-    provided cursor token
+    provided cursor token. Pass before (a timestamp) to only return older messages
     """
     logger.info(f'Polling messages for conversation {conversation_id}')
     user = get_user_with_access_token(cognito_client, X_Amz_Access_Token)
     uid = user['Username']
 
     response = MessageResponse()
-    messages, cursor_token = get_messages_for_conversation(message_table, conversation_id, cursor_token=cursor_token, limit=20)  # arbitray "reasonable" number of messages to show at once
+    messages, cursor_token = get_messages_for_conversation(message_table, conversation_id, cursor_token=cursor_token, limit=20, before=before)  # arbitray "reasonable" number of messages to show at once
     if messages:
         response.conversation_id = conversation_id
         response.messages = messages
@@ -3,8 +3,8 @@ import os
 from typing import Optional
 from uuid import uuid4
 
-import boto3
 from fastapi import APIRouter, Header, status
+from rctools.aws.clients import get_client
 from rctools.aws.cognito import get_user_with_access_token, merge_user_data
 from rctools.aws.secrets import get_json_secret
 from rctools.installers import get_installer_data_from_s3, update_installer_data_in_s3
@@ -13,6 +13,7 @@ from rctools.payments import (
     create_connected_installer_account, create_connected_installer_account_link
 )
 from rctools.utils import mk_timestamp
+from utils import DecimalRoute
 
 AWS_REGION_NAME = os.environ.get('AWS_REGION')
 INSTALLER_USER_POOL_ID = os.environ.get('INSTALLER_USER_POOL_ID')
@@ -21,12 +22,12 @@ STRIPE_PRIVATE_KEY = os.environ.get('STRIPE_PRIVATE_KEY')
 USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
-secrets_client = boto3.client('secretsmanager')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
+secrets_client = get_client('secretsmanager')
 
 g_context = {}
 
@@ -2,25 +2,26 @@ import logging
 import os
 from typing import Optional
 
-import boto3
 from botocore.exceptions import ClientError
 from fastapi import APIRouter, Header, status
 from fastapi.responses import JSONResponse
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.cognito import (get_user_with_access_token)
 from rctools.exceptions import (InstallerNotAuthorizedToEditSchedule)
 from rctools.scheduling import (get_customer_scheduled_jobs_from_dynamo, get_scheduled_job)
+from utils import DecimalRoute
 
 JOBS_TABLE = os.environ.get('JOBS_TABLE')
 RESERVATIONS_TABLE = os.environ.get('RESERVATIONS_TABLE')
 JOB_SCHEDULE_TABLE = os.environ.get('JOB_SCHEDULE_TABLE')
 INSTALLER_USER_POOL_ID = os.environ.get('INSTALLER_USER_POOL_ID')
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
+router = APIRouter(route_class=DecimalRoute)
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = get_resource('dynamodb')
 jobs_table = dynamodb.Table(JOBS_TABLE)
 reservations_table = dynamodb.Table(RESERVATIONS_TABLE)
 job_schedule_table = dynamodb.Table(JOB_SCHEDULE_TABLE)
@@ -1,7 +1,14 @@
 """Helper methods for api"""
+import asyncio
+import functools
 import json
 from urllib.parse import parse_qs
 
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+from rctools.aws.dynamodb import JSON_ENCODERS
+
 def parse_params(req_url):
     """parse query parameters"""
     params = parse_qs(req_url.query)
@@ -22,4 +29,31 @@ def filter_results(response_data, search, search_fields):
         for item in response_data:
             if search.lower() in str(item[field]).lower() and item not in search_data:
                 search_data.append(item)
-    return search_data
\ No newline at end of file
+    return search_data
+
+
+def _encode_result(result):
+    if isinstance(result, Response):
+        return result
+    return jsonable_encoder(result, custom_encoder=JSON_ENCODERS)
+
+
+class DecimalRoute(APIRoute):
+    """
+    Route class of every router: encodes what the endpoint returns with the
+    rctools JSON_ENCODERS first, so numbers read from DynamoDB go out as ints
+    when they are integral rather than as the floats FastAPI makes of every
+    Decimal
+    """
+    def get_route_handler(self):
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            @functools.wraps(call)
+            async def encoded(**values):
+                return _encode_result(await call(**values))
+        else:
+            @functools.wraps(call)
+            def encoded(**values):
+                return _encode_result(call(**values))
+        self.dependant.call = encoded
+        return super().get_route_handler()
@@ -4,9 +4,9 @@ import os
 import logging
 from typing import Dict
 
-import boto3
 import requests
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.secrets import get_json_secret
 from rctools.alerts import add_user_alert, create_background_check_approved_alert, create_background_check_rejected_alert
 from rctools.installers import update_installer_data_in_s3, get_installer_data_from_s3
@@ -15,9 +15,9 @@ from rctools.installers import update_installer_data_in_s3, get_installer_data_f
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
-sqs_client = boto3.client('sqs')
+dynamodb = get_resource('dynamodb')
+s3_client = get_client('s3')
+sqs_client = get_client('sqs')
 
 ALERTS_TABLE = os.environ.get('ALERTS_TABLE')
 AWS_REGION_NAME = os.environ.get('AWS_REGION_NAME')
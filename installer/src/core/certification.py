@@ -2,12 +2,12 @@ import json
 import logging
 import requests
 import os
-import boto3
 
 from aws_lambda_powertools.utilities.typing import LambdaContext
 from bs4 import BeautifulSoup
 from datetime import datetime
 from rctools.alerts import create_certification_approved_alert, create_certification_rejected_alert, add_user_alert
+from rctools.aws.clients import get_client, get_resource
 from rctools.installers import update_installer_data_in_s3, get_installer_data_from_s3
 from rctools.models import ReadiChargeBaseModel
 from typing import Optional, Dict
@@ -19,8 +19,8 @@ USER_DATA_BUCKET = os.environ.get('USER_DATA_BUCKET')
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
+dynamodb = get_resource('dynamodb')
+s3_client = get_client('s3')
 
 alerts_table = dynamodb.Table(ALERTS_TABLE)
 
@@ -1,15 +1,15 @@
-import boto3
 import json
 import logging
 import os
 
 from typing import Dict
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from rctools.aws.clients import get_client
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-sqs_client = boto3.client('sqs')
+sqs_client = get_client('sqs')
 
 BACKGROUND_CHECK_STATUS_QUEUE_URL = os.getenv('BACKGROUND_CHECK_STATUS_QUEUE_URL')
 VERIFY_CERTIFICATION_QUEUE_URL = os.getenv('VERIFY_CERTIFICATION_QUEUE_URL')
@@ -1,9 +1,9 @@
 
-import boto3
 import json
 import logging
 import os
 
+from rctools.aws.clients import get_client
 from rctools.aws.ses import send_email
 from typing import Dict
 from aws_lambda_powertools.utilities.typing import LambdaContext
@@ -12,8 +12,8 @@ from mail import get_content
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-ses_client = boto3.client('ses')
-sqs_client = boto3.client('sqs')
+ses_client = get_client('ses')
+sqs_client = get_client('sqs')
 
 SEND_EMAIL_QUEUE_URL = os.getenv('SEND_EMAIL_QUEUE_URL')
 
@@ -6,15 +6,18 @@ import os
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from rctools.aws.metrics import collect_dynamodb_metrics, instrument_dynamodb, log_dynamodb_metrics
+from rctools.aws.unit_of_work import UnitOfWorkMiddleware
 
 from constants import SERVICE_NAME
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-STAGE = os.environ.get('STAGE')
-
+# Must run before the routers create their boto3 clients
+instrument_dynamodb()
 
+STAGE = os.environ.get('STAGE')
 def create_app():
     """
     Setup app
@@ -43,13 +46,23 @@ def create_app():
         expose_headers=['Content-Range']
     )
 
+    # Every request gets a unit of work: repeated lookups of the same item resolve once, and the writes
+    # staged on it are committed before a successful response is sent
+    app.add_middleware(UnitOfWorkMiddleware)
+
     @app.middleware('http')
     async def middleware_logging(request: Request, call_next):
         """
-        Middleware for each request to log simple information about it.
+        Middleware for each request to log simple information about it,
+        including the DynamoDB capacity and latency it used.
         """
         logging.info('Logging request. Method: %s on path of: %s',
                      request.method, request.url.path)
-        return await call_next(request)
+        with collect_dynamodb_metrics() as metrics:
+            response = await call_next(request)
+        endpoint = request.scope.get('endpoint')
+        log_dynamodb_metrics(metrics, method=request.method,
+                             endpoint=endpoint.__name__ if endpoint else request.url.path)
+        return response
 
     return app
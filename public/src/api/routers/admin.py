@@ -6,9 +6,11 @@ import boto3
 from fastapi import APIRouter, status
 from fastapi.responses import RedirectResponse
 
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.secrets import get_json_secret
 from rctools.payments import create_connected_installer_account_link
 from rctools.users import get_admin_user, update_admin_data_in_s3
+from utils import DecimalRoute
 
 
 ADMIN_USER_POOL_ID = os.getenv('ADMIN_USER_POOL_ID')
@@ -19,13 +21,13 @@ STAGE = os.getenv('STAGE')
 STRIPE_PRIVATE_KEY = os.getenv('STRIPE_PRIVATE_KEY')
 USER_DATA_BUCKET = os.getenv('USER_DATA_BUCKET')
 
-cognito_client = boto3.client('cognito-idp')
-dynamodb = boto3.resource('dynamodb')
+cognito_client = get_client('cognito-idp')
+dynamodb = get_resource('dynamodb')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
+router = APIRouter(route_class=DecimalRoute)
 
-s3_client = boto3.client('s3')
+s3_client = get_client('s3')
 secrets_client = boto3.session.Session()
 
 
@@ -1,13 +1,14 @@
 import logging
 import os
 
-import boto3
 from botocore.exceptions import ClientError
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
+from rctools.aws.clients import get_client, get_resource
 from rctools.company import create_company_admin, create_company_id, put_company_data
 from rctools.models import CompanyAdmin
 from models import NewCompanyAdminResponse
+from utils import DecimalRoute
 
 ADMIN_USER_POOL_ID = os.getenv('ADMIN_USER_POOL_ID')
 COMPANY_DATA_BUCKET = os.getenv('COMPANY_DATA_BUCKET')
@@ -15,12 +16,12 @@ OWNER_ADMIN_GROUP_ID = os.getenv('OWNER_ADMIN_GROUP_ID')
 USER_DATA_BUCKET = os.getenv('USER_DATA_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
-dynamodb = boto3.resource('dynamodb')
+cognito_client = get_client('cognito-idp')
+dynamodb = get_resource('dynamodb')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
 
 @router.post('/company/admin', response_model=NewCompanyAdminResponse)
@@ -1,12 +1,13 @@
 import logging
 import os
 
-import boto3
 from botocore.exceptions import ClientError
 from fastapi import APIRouter, status
 from fastapi.responses import JSONResponse
+from rctools.aws.clients import get_client
 from rctools.customers import create_customer
 from rctools.models import Customer, NewCustomerResponse
+from utils import DecimalRoute
 
 
 COMPANY_DATA_BUCKET = os.getenv('COMPANY_DATA_BUCKET')
@@ -14,11 +15,11 @@ CUSTOMER_USER_POOL_ID = os.getenv('CUSTOMER_USER_POOL_ID')
 USER_DATA_BUCKET = os.getenv('USER_DATA_BUCKET')
 
 
-cognito_client = boto3.client('cognito-idp')
+cognito_client = get_client('cognito-idp')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
-s3_client = boto3.client('s3')
+router = APIRouter(route_class=DecimalRoute)
+s3_client = get_client('s3')
 
 
 @router.post('/customer', response_model=NewCustomerResponse)
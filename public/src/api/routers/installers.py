@@ -9,6 +9,7 @@ from fastapi.responses import JSONResponse, RedirectResponse
 from models import (InstallerCodeResponse, QualificationResponse,
                     QualificationUserData, InstallersInYourAreaResponse)
 from rate import get_rate
+from rctools.aws.clients import get_client, get_resource
 from rctools.aws.dynamodb import create_dynamo_record, update_dynamo_record
 from rctools.aws.secrets import get_json_secret
 from rctools.company import get_company_data, get_company_installer_by_code
@@ -17,6 +18,7 @@ from rctools.models import Installer, InstallerUser, NewInstallerResponse
 from rctools.payments import create_connected_installer_account_link
 from rctools.utils import create_random_code, mk_timestamp
 from rctools.zip_codes import get_installers_by_zip
+from utils import DecimalRoute
 
 
 AWS_REGION_NAME = os.getenv('AWS_REGION_NAME')
@@ -30,13 +32,13 @@ STAGE = os.getenv('STAGE')
 STRIPE_PRIVATE_KEY = os.getenv('STRIPE_PRIVATE_KEY')
 USER_DATA_BUCKET = os.getenv('USER_DATA_BUCKET')
 
-cognito_client = boto3.client('cognito-idp')
-dynamodb = boto3.resource('dynamodb')
+cognito_client = get_client('cognito-idp')
+dynamodb = get_resource('dynamodb')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-router = APIRouter()
+router = APIRouter(route_class=DecimalRoute)
 
-s3_client = boto3.client('s3')
+s3_client = get_client('s3')
 secrets_client = boto3.session.Session()
 
 installer_codes_table = dynamodb.Table(INSTALLER_CODES_TABLE)